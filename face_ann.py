@@ -0,0 +1,164 @@
+import os
+import time
+
+import numpy as np
+
+IVF_FILE = 'ivf.npz'
+DEFAULT_NPROBE = 16
+TRAIN_POINTS_PER_LIST = 32  # 每个聚类中心平均使用的训练样本数
+ASSIGN_BLOCK = 16384  # 分配倒排表时每次读入的特征行数
+
+
+def default_nlist(count):
+    """聚类中心数取 sqrt(N) 左右：300 万张人脸约 1800 个倒排表"""
+    return int(np.clip(round(np.sqrt(count)), 1, 4096))
+
+
+def _nearest_centroids(vectors, centroids, block=ASSIGN_BLOCK):
+    """分块计算每个向量余弦距离最近的聚类中心"""
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), block):
+        chunk = np.asarray(vectors[start:start + block], dtype=np.float32)
+        labels[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return labels
+
+
+def train_centroids(sample, nlist, iterations=10, seed=0):
+    """球面 k-means：特征已 L2 归一化，按内积分配，中心每轮重新归一化；空的簇用随机样本重新初始化"""
+    rng = np.random.default_rng(seed)
+    sample = np.asarray(sample, dtype=np.float32)
+    nlist = min(nlist, len(sample))
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _nearest_centroids(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=nlist)
+        empty = counts == 0
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.maximum(norms, 1e-10)
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """倒排文件（IVF）近似检索：特征按最近的聚类中心分成若干倒排表，查询时只扫描最近的 nprobe 个表
+
+    nprobe 是召回率与延迟之间的旋钮：越大越接近精确检索，越小越快。特征矩阵本身不复制，
+    仍使用特征库的内存映射矩阵，倒排表只保存行号。
+    """
+
+    def __init__(self, centroids, offsets, rows, count, gallery_updated=None, nprobe=DEFAULT_NPROBE):
+        self.centroids = centroids
+        self.offsets = offsets  # 第 i 个倒排表的行号为 rows[offsets[i]:offsets[i + 1]]
+        self.rows = rows
+        self.count = count
+        self.gallery_updated = gallery_updated
+        self.nprobe = nprobe
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, embeddings, nlist=None, train_size=None, centroids=None, iterations=10, seed=0,
+              gallery_updated=None, nprobe=DEFAULT_NPROBE):
+        """训练聚类中心并把所有特征分配到倒排表；传入 centroids 时跳过训练，只重新分配（特征库增量更新后使用）"""
+        count = len(embeddings)
+        if centroids is None:
+            nlist = nlist or default_nlist(count)
+            train_size = min(count, train_size or nlist * TRAIN_POINTS_PER_LIST)
+            rng = np.random.default_rng(seed)
+            # 排序后读取，对内存映射矩阵是顺序访问
+            sample = np.asarray(embeddings[np.sort(rng.choice(count, train_size, replace=False))], dtype=np.float32)
+            centroids = train_centroids(sample, nlist, iterations=iterations, seed=seed)
+        labels = _nearest_centroids(embeddings, centroids)
+        rows = np.argsort(labels, kind='stable').astype(np.int32)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=len(centroids)))]).astype(np.int64)
+        return cls(centroids, offsets, rows, count, gallery_updated=gallery_updated, nprobe=nprobe)
+
+    def save(self, index_dir):
+        """写入特征库目录，先写临时文件再替换"""
+        path = os.path.join(index_dir, IVF_FILE)
+        tmp_path = f"{path}.tmp{os.getpid()}.npz"
+        np.savez(tmp_path, centroids=self.centroids, offsets=self.offsets, rows=self.rows,
+                 count=np.int64(self.count), nprobe=np.int64(self.nprobe),
+                 gallery_updated=np.float64(self.gallery_updated or 0))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, index_dir):
+        """读取倒排索引，不存在时返回 None"""
+        path = os.path.join(index_dir, IVF_FILE)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return cls(data['centroids'], data['offsets'], data['rows'], int(data['count']),
+                       gallery_updated=float(data['gallery_updated']) or None, nprobe=int(data['nprobe']))
+
+    def matches(self, count, gallery_updated):
+        """倒排索引是否与当前特征库对应（特征库重写后旧索引作废）"""
+        return self.count == count and (self.gallery_updated is None or self.gallery_updated == gallery_updated)
+
+    def candidates(self, query, nprobe):
+        """查询最近的 nprobe 个倒排表中的所有行号（升序，便于顺序读取内存映射矩阵）"""
+        nprobe = min(nprobe, self.nlist)
+        scores = self.centroids @ query
+        lists = np.argpartition(-scores, nprobe - 1)[:nprobe] if nprobe < self.nlist else np.arange(self.nlist)
+        rows = np.concatenate([self.rows[self.offsets[i]:self.offsets[i + 1]] for i in lists])
+        return np.sort(rows)
+
+    def search(self, distances, queries, k=5, nprobe=None):
+        """近似 top-k 检索，返回 (距离, 行号) 两个列表，每个查询一项，按距离升序
+
+        distances(query, rows) 计算查询与指定行的距离，可以基于原始特征或压缩特征。
+        """
+        nprobe = nprobe or self.nprobe
+        all_dist, all_rows = [], []
+        for query in np.atleast_2d(np.asarray(queries, dtype=np.float32)):
+            rows = self.candidates(query, nprobe)
+            if len(rows) == 0:
+                all_dist.append(np.zeros(0, dtype=np.float32))
+                all_rows.append(rows.astype(np.int64))
+                continue
+            dist = distances(query, rows)
+            top = min(k, len(rows))
+            part = np.argpartition(dist, top - 1)[:top] if len(rows) > top else np.arange(len(rows))
+            part = part[np.argsort(dist[part])]
+            all_dist.append(dist[part])
+            all_rows.append(rows[part].astype(np.int64))
+        return all_dist, all_rows
+
+
+def benchmark(index, sample=200, k=5, nprobes=(1, 2, 4, 8, 16, 32, 64), seed=0):
+    """比较精确检索与不同 nprobe 的近似检索，返回每种设置的 recall@k、单次查询平均延迟和扫描的候选数
+
+    index 为带倒排索引的 GalleryIndex。从特征库中随机抽取 sample 张人脸作为查询，检索时排除查询本身
+    （留一法），recall@k 为近似 top-k 与精确 top-k 的交集比例。
+    """
+    rng = np.random.default_rng(seed)
+    query_rows = np.sort(rng.choice(len(index), min(sample, len(index)), replace=False))
+    queries = np.asarray(index.embeddings[query_rows], dtype=np.float32)
+
+    def without_self(rows, row):
+        return [int(r) for r in rows if r != row][:k]
+
+    start = time.perf_counter()
+    exact = [set(without_self(index.exact_topk(query[np.newaxis], k + 1)[1][0], row))
+             for query, row in zip(queries, query_rows)]
+    results = [{'nprobe': 0, 'recall': 1.0, 'latency_ms': (time.perf_counter() - start) * 1000 / len(queries),
+                'candidates': float(len(index))}]
+    total = max(sum(len(truth) for truth in exact), 1)
+    for nprobe in nprobes:
+        if nprobe > index.ann.nlist:
+            break
+        hits = 0
+        start = time.perf_counter()
+        for query, row, truth in zip(queries, query_rows, exact):
+            dists, found = index.ann.search(index.exact_distances, query, k=k + 1, nprobe=nprobe)
+            hits += len(truth & set(without_self(found[0], row)))
+        elapsed = time.perf_counter() - start
+        candidates = np.mean([len(index.ann.candidates(query, nprobe)) for query in queries])
+        results.append({'nprobe': nprobe, 'recall': hits / total, 'latency_ms': elapsed * 1000 / len(queries),
+                        'candidates': float(candidates)})
+    return results
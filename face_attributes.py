@@ -0,0 +1,104 @@
+import json
+
+import cv2
+import numpy as np
+
+import face_cache
+import face_cascade
+import face_engine
+import face_image
+
+ACTIONS = ('age', 'gender', 'race', 'emotion')
+GENDER_LABELS = ['Woman', 'Man']
+RACE_LABELS = ['asian', 'indian', 'black', 'white', 'middle eastern', 'latino hispanic']
+EMOTION_LABELS = ['angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral']
+ATTRIBUTE_SIZE = (224, 224)
+EMOTION_SIZE = (48, 48)
+
+
+def validate_actions(actions):
+    """检查并去重属性列表"""
+    actions = list(dict.fromkeys(action.lower() for action in actions))
+    unknown = [action for action in actions if action not in ACTIONS]
+    if unknown:
+        raise ValueError(f"不支持的分析项: {', '.join(unknown)} (可选: {', '.join(ACTIONS)})")
+    return actions
+
+
+def prepare_crops(faces):
+    """把对齐后的人脸（RGB，0~1）转换为 BGR 并缩放到属性模型的输入尺寸，流程与 DeepFace.analyze 相同"""
+    from deepface.modules import preprocessing
+    crops = [preprocessing.resize_image(img=face['face'][:, :, ::-1], target_size=ATTRIBUTE_SIZE) for face in faces]
+    return np.concatenate(crops).astype(np.float32)
+
+
+def _emotion_inputs(crops):
+    """情绪模型使用 48x48 灰度图"""
+    gray = [cv2.resize(cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY), EMOTION_SIZE) for crop in crops]
+    return np.expand_dims(np.stack(gray), axis=-1)
+
+
+def _predict(action, batch):
+    """对一个批次做一次前向推理，不支持批量的模型逐张计算"""
+    client = face_engine.get_attribute_model(action)
+    keras_model = getattr(client, 'model', None)
+    if keras_model is not None and hasattr(keras_model, 'predict_on_batch'):
+        return np.asarray(keras_model.predict_on_batch(batch), dtype=np.float64).reshape(len(batch), -1)
+    return np.asarray([np.atleast_1d(client.predict(img[np.newaxis, ...])) for img in batch], dtype=np.float64)
+
+
+def _percentages(predictions, labels):
+    scores = 100 * predictions / np.maximum(predictions.sum(axis=1, keepdims=True), 1e-10)
+    return [{label: float(score) for label, score in zip(labels, row)} for row in scores]
+
+
+def analyze_faces(faces, actions=ACTIONS):
+    """对一批已检测对齐的人脸，按所选属性各做一次批量前向推理
+
+    返回与 DeepFace.analyze 相同格式的结果列表，只包含所选属性。
+    """
+    actions = validate_actions(actions)
+    if not faces:
+        return []
+    crops = prepare_crops(faces)
+    results = [{'region': face.get('facial_area', {}), 'face_confidence': float(face.get('confidence', 0))}
+               for face in faces]
+
+    if 'age' in actions:
+        predictions = _predict('age', crops)
+        # 年龄模型输出 0~100 岁的概率分布，取期望作为表观年龄
+        ages = predictions @ np.arange(predictions.shape[1]) if predictions.shape[1] > 1 else predictions[:, 0]
+        for result, age in zip(results, ages):
+            result['age'] = int(age)
+    if 'gender' in actions:
+        for result, scores in zip(results, _percentages(_predict('gender', crops), GENDER_LABELS)):
+            result['gender'] = scores
+            result['dominant_gender'] = max(scores, key=scores.get)
+    if 'race' in actions:
+        for result, scores in zip(results, _percentages(_predict('race', crops), RACE_LABELS)):
+            result['race'] = scores
+            result['dominant_race'] = max(scores, key=scores.get)
+    if 'emotion' in actions:
+        for result, scores in zip(results, _percentages(_predict('emotion', _emotion_inputs(crops)), EMOTION_LABELS)):
+            result['emotion'] = scores
+            result['dominant_emotion'] = max(scores, key=scores.get)
+    return results
+
+
+def analyze_image(img_path, actions=ACTIONS, detector_backend=face_engine.DETECTOR_BACKEND):
+    """分析单张图片的人脸属性（结果格式同 DeepFace.analyze），图片文件的结果写入磁盘缓存
+
+    检测走 face_engine.detect_faces，大图只在缩小图上检测，不再由 DeepFace 按原分辨率重新解码和检测。
+    """
+    actions = validate_actions(actions)
+    key = face_cache.image_key(img_path, 'analyze', actions=sorted(actions),
+                               detector=face_cascade.backend_key(detector_backend), align=True,
+                               max_side=face_image.DETECT_MAX_SIDE)
+    hit = face_cache.load(key)
+    if hit is not None:
+        return hit[0]
+    objs = analyze_faces(face_engine.detect_faces(img_path, detector_backend=detector_backend), actions)
+    # 转换为纯 Python 类型，保证缓存命中与否返回的结果一致
+    objs = json.loads(json.dumps(objs, default=face_cache.to_json))
+    face_cache.store(key, 'analyze', objs)
+    return objs
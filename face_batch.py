@@ -0,0 +1,260 @@
+import csv
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import face_cascade
+import face_engine
+
+PAIR_BLOCK = 100000  # 每次计算并输出的图片对数量
+MATCH_FIELDS = ['img', 'face', 'x', 'y', 'w', 'h', 'rank', 'identity', 'path', 'distance', 'error']
+
+_worker = {}  # 子进程中的特征库和检索参数
+
+
+def read_pairs(pairs_path):
+    """读取图片对列表，支持 CSV（前两列或 img1/img2 列，可无表头）和 JSONL（{"img1", "img2"}）"""
+    pairs = []
+    with open(pairs_path, encoding='utf-8', newline='') as f:
+        if pairs_path.lower().endswith(('.jsonl', '.json')):
+            for line in f:
+                line = line.strip()
+                if line:
+                    obj = json.loads(line)
+                    pairs.append((obj['img1'], obj['img2']))
+            return pairs
+        for row in csv.reader(f):
+            if len(row) < 2 or not row[0].strip():
+                continue
+            if not pairs and row[0].strip().lower() in ('img1', 'image1', 'path1'):
+                continue  # 跳过表头
+            pairs.append((row[0].strip(), row[1].strip()))
+    return pairs
+
+
+def pair_distances(owners, embeddings, left, right):
+    """向量化计算一批图片对的距离
+
+    每张图片可能有多张人脸，与 DeepFace.verify 一致取两张图片所有人脸组合中的最小余弦距离。
+    没有人脸的图片对距离为 nan。
+    """
+    image_count = max(int(owners.max()) + 1 if len(owners) else 0, int(max(left.max(), right.max())) + 1)
+    counts = np.bincount(owners, minlength=image_count)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    order = np.argsort(owners, kind='stable')
+    sorted_embeddings = embeddings[order] if len(order) else embeddings
+
+    # 单人脸的常见情况：一次逐行内积即可
+    distances = np.full(len(left), np.nan, dtype=np.float32)
+    single = (counts[left] == 1) & (counts[right] == 1)
+    if single.any():
+        a = sorted_embeddings[starts[left[single]]]
+        b = sorted_embeddings[starts[right[single]]]
+        distances[single] = 1.0 - np.einsum('ij,ij->i', a, b)
+
+    # 多人脸：把图片对展开为人脸对，计算后按图片对取最小值
+    multi = np.flatnonzero(~single & (counts[left] > 0) & (counts[right] > 0))
+    if len(multi):
+        n_left, n_right = counts[left[multi]], counts[right[multi]]
+        combos = n_left * n_right
+        pair_id = np.repeat(np.arange(len(multi)), combos)
+        offset = np.arange(combos.sum()) - np.repeat(np.cumsum(combos) - combos, combos)
+        face_a = starts[left[multi]][pair_id] + offset // n_right[pair_id]
+        face_b = starts[right[multi]][pair_id] + offset % n_right[pair_id]
+        combo_dist = 1.0 - np.einsum('ij,ij->i', sorted_embeddings[face_a], sorted_embeddings[face_b])
+        best = np.full(len(multi), np.inf, dtype=np.float32)
+        np.minimum.at(best, pair_id, combo_dist)
+        distances[multi] = best
+    return distances
+
+
+def verify_batch(pairs_path, output=None, model_name=face_engine.MODEL_NAME,
+                 detector_backend=face_engine.DETECTOR_BACKEND, threshold=None, batch_size=32):
+    """批量人脸验证：每张不同的图片只提取一次特征，按块向量化计算距离并逐行输出 JSON"""
+    pairs = read_pairs(pairs_path)
+    if not pairs:
+        print("图片对列表为空", file=sys.stderr)
+        return {'pairs': 0, 'verified': 0, 'errors': 0}
+    images = list(dict.fromkeys(path for pair in pairs for path in pair))
+    position = {path: i for i, path in enumerate(images)}
+    if threshold is None:
+        threshold = face_engine.find_threshold(model_name, detector_backend)
+    print(f"共 {len(pairs)} 对图片，涉及 {len(images)} 张不同的图片", file=sys.stderr)
+
+    def progress(done, total):
+        if done % 100 == 0:
+            print(f"已提取 {done}/{total} 张图片的特征", file=sys.stderr)
+
+    owners, areas, embeddings, failed = face_engine.represent_batch(
+        images, model_name=model_name, detector_backend=detector_backend, batch_size=batch_size,
+        on_progress=progress)
+    errors = {images[i]: str(e) for i, e in failed}
+
+    left = np.array([position[a] for a, b in pairs], dtype=np.int64)
+    right = np.array([position[b] for a, b in pairs], dtype=np.int64)
+    out = open(output, 'w', encoding='utf-8') if output else sys.stdout
+    summary = {'pairs': len(pairs), 'verified': 0, 'errors': 0}
+    try:
+        for start in range(0, len(pairs), PAIR_BLOCK):
+            block = slice(start, start + PAIR_BLOCK)
+            distances = pair_distances(owners, embeddings, left[block], right[block])
+            lines = []
+            for (img1, img2), distance in zip(pairs[block], distances):
+                record = {'img1': img1, 'img2': img2}
+                if np.isnan(distance):
+                    record['error'] = errors.get(img1) or errors.get(img2) or "未检测到人脸"
+                    summary['errors'] += 1
+                else:
+                    record.update(verified=bool(distance <= threshold), distance=round(float(distance), 6),
+                                  threshold=threshold, model=model_name, detector_backend=detector_backend)
+                    summary['verified'] += record['verified']
+                lines.append(json.dumps(record, ensure_ascii=False))
+            out.write('\n'.join(lines) + '\n')
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return summary
+
+
+def list_probes(probes):
+    """待识别图片：目录（递归查找图片）或列表文件（每行一个路径）"""
+    if os.path.isdir(probes):
+        return [os.path.join(probes, rel_path) for rel_path in face_engine.list_images(probes)]
+    with open(probes, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def _init_worker(index_dir, db_path, model_name, detector_backend, k, threshold, batch_size, cascade_settings):
+    """子进程初始化：以只读内存映射打开特征库，所有进程共享同一份页缓存"""
+    import face_index
+    face_cascade.configure(**cascade_settings)  # spawn 的子进程不会继承命令行设置的级联检测参数
+    index = face_index.GalleryIndex.load(index_dir)
+    index.db_path = db_path
+    _worker.update(index=index, model_name=model_name, detector_backend=detector_backend, k=k,
+                   threshold=threshold, batch_size=batch_size)
+
+
+def _find_chunk(paths):
+    """在子进程中检测、提取特征并检索一组图片，返回每张图片的结果记录"""
+    owners, areas, embeddings, failed = face_engine.represent_batch(
+        paths, model_name=_worker['model_name'], detector_backend=_worker['detector_backend'],
+        batch_size=_worker['batch_size'])
+    matches = _worker['index'].search(embeddings, k=_worker['k'], threshold=_worker['threshold'])
+    records = [{'img': path, 'faces': []} for path in paths]
+    for owner, area, results in zip(owners, areas, matches):
+        records[owner]['faces'].append({'facial_area': area, 'matches': results})
+    for i, e in failed:
+        records[i]['error'] = str(e)
+    return records
+
+
+def _csv_rows(record):
+    """把一张图片的结果展开为 CSV 行：每个人脸的每个候选一行"""
+    if 'error' in record or not record['faces']:
+        yield {'img': record['img'], 'error': record.get('error', "未检测到人脸")}
+        return
+    for face_no, face in enumerate(record['faces']):
+        area = face['facial_area']
+        base = {'img': record['img'], 'face': face_no, 'x': area.get('x'), 'y': area.get('y'), 'w': area.get('w'),
+                'h': area.get('h')}
+        if not face['matches']:
+            yield dict(base, rank=0)
+        for rank, match in enumerate(face['matches'], start=1):
+            yield dict(base, rank=rank, identity=match['identity'], path=match['path'],
+                       distance=round(match['distance'], 6))
+
+
+def find_batch(probes, db_path, output=None, fmt='jsonl', workers=None, chunk_size=16, k=5, threshold=None,
+               model_name=face_engine.MODEL_NAME, detector_backend=face_engine.DETECTOR_BACKEND, batch_size=32,
+               probe_detector=None):
+    """多进程批量人脸识别，结果按输入顺序逐条写出（JSONL 或 CSV）
+
+    detector_backend 决定使用哪个特征库，probe_detector 为待识别图片所用的检测器（默认相同）。
+    """
+    import face_index
+    paths = list_probes(probes)
+    index = face_index.open_index(db_path, model_name, detector_backend)
+    probe_detector = probe_detector or detector_backend
+    if threshold is None:
+        threshold = face_engine.find_threshold(model_name, probe_detector)
+    workers = workers or os.cpu_count() or 1
+    chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+    print(f"共 {len(paths)} 张待识别图片，特征库 {len(index)} 条人脸，{workers} 个进程", file=sys.stderr)
+
+    summary = {'images': len(paths), 'faces': 0, 'matched': 0, 'errors': 0}
+    out = open(output, 'w', encoding='utf-8', newline='') if output else sys.stdout
+    writer = csv.DictWriter(out, fieldnames=MATCH_FIELDS) if fmt == 'csv' else None
+    if writer is not None:
+        writer.writeheader()
+    # 使用 spawn 启动子进程，避免 fork 已初始化的 TensorFlow 运行时
+    context = multiprocessing.get_context('spawn')
+    initargs = (index.index_dir, index.db_path, model_name, probe_detector, k, threshold, batch_size,
+                face_cascade.detector.settings())
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                 initargs=initargs) as pool:
+            for done, records in enumerate(pool.map(_find_chunk, chunks), start=1):
+                for record in records:
+                    summary['faces'] += len(record['faces'])
+                    summary['matched'] += sum(1 for face in record['faces'] if face['matches'])
+                    summary['errors'] += 'error' in record
+                    if writer is not None:
+                        writer.writerows(_csv_rows(record))
+                    else:
+                        out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                out.flush()
+                print(f"已完成 {min(done * chunk_size, len(paths))}/{len(paths)} 张图片", file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return summary
+
+
+def analyze_batch(probes, actions, output=None, detector_backend=face_engine.DETECTOR_BACKEND, batch_size=32):
+    """批量面部属性分析：每张人脸只检测对齐一次，跨图片凑批后对每个所选属性模型做一次批量推理
+
+    只加载所选属性对应的模型，结果按输入顺序逐行输出 JSON。
+    """
+    import face_attributes
+    actions = face_attributes.validate_actions(actions)
+    paths = list_probes(probes)
+    print(f"共 {len(paths)} 张图片，分析项: {', '.join(actions)}", file=sys.stderr)
+
+    summary = {'images': len(paths), 'faces': 0, 'errors': 0}
+    out = open(output, 'w', encoding='utf-8') if output else sys.stdout
+    pending = []  # [(记录, 人脸列表)]，凑满一批后统一推理
+
+    def flush():
+        faces = [face for record, record_faces in pending for face in record_faces]
+        results = iter(face_attributes.analyze_faces(faces, actions))
+        for record, record_faces in pending:
+            record['faces'] = [next(results) for face in record_faces]
+            summary['faces'] += len(record_faces)
+            out.write(json.dumps(record, ensure_ascii=False) + '\n')
+        out.flush()
+        pending.clear()
+
+    try:
+        for i, path in enumerate(paths):
+            record = {'img': path}
+            try:
+                faces = face_engine.detect_faces(path, detector_backend=detector_backend)
+            except Exception as e:
+                record['error'] = str(e)
+                summary['errors'] += 1
+                faces = []
+            pending.append((record, faces))
+            if sum(len(record_faces) for record, record_faces in pending) >= batch_size:
+                flush()
+            if (i + 1) % 100 == 0:
+                print(f"已处理 {i + 1}/{len(paths)} 张图片", file=sys.stderr)
+        flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return summary
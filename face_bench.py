@@ -0,0 +1,299 @@
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import face_engine
+import face_image
+import face_index
+import face_stream
+
+STAGES = ('decode', 'detect', 'align', 'embed', 'search', 'render')
+STUB_DIM = 4096  # 与 VGG-Face 的特征维度一致，检索阶段的耗时才有参考意义
+STUB_FACE_SIZE = (224, 224)
+VGG_FACE_WEIGHTS = os.path.join('.deepface', 'weights', 'vgg_face_weights.h5')
+PREVIEW_BOX = (900, 600)  # 与图形界面的预览区域大小相当
+
+
+def peak_rss_mb():
+    """进程峰值常驻内存（MB），不支持的平台返回 None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 上单位为 KB，macOS 上为字节
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024
+
+
+def weights_cached():
+    """DeepFace 已下载 VGG-Face 权重且可以导入时才能使用真实模型"""
+    home = os.environ.get('DEEPFACE_HOME', os.path.expanduser('~'))
+    if not os.path.exists(os.path.join(home, VGG_FACE_WEIGHTS)):
+        return False
+    try:
+        import deepface  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class StubModels:
+    """离线、无 GPU、无模型权重时使用的确定性检测器和特征提取器
+
+    检测固定取图像中央的方框，对齐为裁剪并缩放到 224x224，特征为 32x32 灰度图经固定随机投影到 4096 维。
+    结果与真实模型无关，但每次运行完全一致，耗时和内存可以在不同版本之间对比。
+    """
+    name = 'stub'
+
+    def __init__(self, dim=STUB_DIM, seed=0):
+        self.projection = np.random.default_rng(seed).standard_normal((32 * 32, dim)).astype(np.float32)
+
+    def detect(self, img, max_side=None):
+        h, w = img.shape[:2]
+        size = int(min(h, w) * 0.6)
+        x, y = (w - size) // 2, (h - size) // 3
+        return [{'facial_area': {'x': x, 'y': y, 'w': size, 'h': size}, 'confidence': 1.0}]
+
+    def align(self, img, faces):
+        for face in faces:
+            x, y, w, h = face_stream.face_rect(face)
+            crop = cv2.resize(img[y:y + h, x:x + w], STUB_FACE_SIZE)
+            face['face'] = crop[:, :, ::-1].astype(np.float32) / 255  # 与 extract_faces 一致：RGB，0~1
+        return faces
+
+    def embed(self, faces):
+        small = [cv2.resize(cv2.cvtColor(face['face'], cv2.COLOR_RGB2GRAY), (32, 32)).reshape(-1) for face in faces]
+        return face_engine.l2_normalize(np.asarray(small, dtype=np.float32) @ self.projection)
+
+
+class RealModels:
+    """真实模型：检测和对齐在 DeepFace.extract_faces 中一次完成（计入 detect），align 为缩放/归一化到模型输入"""
+    name = 'real'
+
+    def __init__(self, model_name=face_engine.MODEL_NAME, detector_backend=face_engine.DETECTOR_BACKEND):
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.model = face_engine.get_model(model_name)
+        face_engine.warm_detector(detector_backend)
+
+    def detect(self, img, max_side=face_image.DETECT_MAX_SIDE):
+        return face_engine.detect_faces(img, detector_backend=self.detector_backend, max_side=max_side)
+
+    def align(self, img, faces):
+        for face in faces:
+            face['input'] = face_engine._preprocess(face['face'], self.model)
+        return faces
+
+    def embed(self, faces):
+        if not faces:
+            return np.zeros((0, 0), dtype=np.float32)
+        batch = np.concatenate([face['input'] for face in faces])
+        return face_engine.l2_normalize(face_engine._forward_batch(self.model, batch))
+
+
+def summarize(samples, items=None):
+    """单个阶段的耗时统计（毫秒）和吞吐量（每秒处理的图片或人脸数）"""
+    samples = np.asarray(samples, dtype=np.float64) * 1000
+    if len(samples) == 0:
+        return {'count': 0}
+    total = samples.sum() / 1000
+    return {'count': int(len(samples)), 'mean_ms': float(samples.mean()), 'p50_ms': float(np.percentile(samples, 50)),
+            'p90_ms': float(np.percentile(samples, 90)), 'p99_ms': float(np.percentile(samples, 99)),
+            'max_ms': float(samples.max()), 'throughput': (items or len(samples)) / total if total > 0 else None}
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def run(db_path, models, repeat=3, limit=None, gallery_size=0, k=5, on_stage=None):
+    """按阶段依次对样例图片计时：decode → detect → align → embed → search → render
+
+    每个阶段对全部图片跑完再进入下一阶段，从而可以记录每个阶段结束时的峰值内存。gallery_size 大于样例人脸数时
+    用随机特征补足特征库，模拟大规模检索。返回可直接写成 JSON 的结果字典。
+    """
+    paths = [os.path.join(db_path, rel_path) for rel_path in face_engine.list_images(db_path)][:limit]
+    if not paths:
+        raise ValueError(f"没有找到图片: {db_path}")
+    timings = {stage: [] for stage in STAGES}
+    items = {stage: 0 for stage in STAGES}
+    stages = {}
+
+    def finish(stage):
+        stages[stage] = dict(summarize(timings[stage], items[stage]), peak_rss_mb=peak_rss_mb())
+        if on_stage is not None:
+            on_stage(stage, stages[stage])
+
+    images = []
+    for _ in range(repeat):
+        images = []
+        for path in paths:
+            img, seconds = _timed(cv2.imread, path)
+            timings['decode'].append(seconds)
+            images.append(img)
+    items['decode'] = len(timings['decode'])
+    finish('decode')
+
+    detections = []
+    for _ in range(repeat):
+        detections = []
+        for img in images:
+            faces, seconds = _timed(models.detect, img)
+            timings['detect'].append(seconds)
+            detections.append(faces)
+    items['detect'] = len(timings['detect'])
+    finish('detect')
+
+    for _ in range(repeat):
+        for img, faces in zip(images, detections):
+            faces, seconds = _timed(models.align, img, faces)
+            timings['align'].append(seconds)
+            items['align'] += len(faces)
+    finish('align')
+
+    embeddings = []
+    for _ in range(repeat):
+        embeddings = []
+        for faces in detections:
+            vectors, seconds = _timed(models.embed, faces)
+            timings['embed'].append(seconds)
+            items['embed'] += len(faces)
+            embeddings.append(vectors)
+    finish('embed')
+
+    owners = [i for i, faces in enumerate(detections) for _ in faces]
+    sample = np.concatenate([vectors for vectors in embeddings if len(vectors)])
+    records = [{'path': os.path.relpath(paths[i], db_path), 'identity': face_engine.identity_of(paths[i])}
+               for i in owners]
+    # 预先分配完整的特征库再分块填入随机特征，避免拼接时出现两份大矩阵
+    matrix = np.empty((max(gallery_size, len(sample)), sample.shape[1]), dtype=np.float32)
+    matrix[:len(sample)] = sample
+    rng = np.random.default_rng(0)
+    for start in range(len(sample), len(matrix), face_index.SEARCH_BLOCK):
+        block = matrix[start:start + face_index.SEARCH_BLOCK]
+        block[:] = rng.standard_normal(block.shape, dtype=np.float32)
+        block /= np.linalg.norm(block, axis=1, keepdims=True)
+    records += [{'path': f"synthetic/{i}.jpg", 'identity': 'synthetic'} for i in range(len(matrix) - len(sample))]
+    index = face_index.GalleryIndex(None, matrix, records, {'db_path': os.path.abspath(db_path)})
+    results = []
+    for _ in range(repeat):
+        results = []
+        for vectors in embeddings:
+            matches, seconds = _timed(index.search, vectors, k)
+            timings['search'].append(seconds)
+            items['search'] += len(vectors)
+            results.append(matches)
+    finish('search')
+
+    for _ in range(repeat):
+        for img, faces, matches in zip(images, detections, results):
+            frame = img.copy()
+            drawn = [face_stream.face_result(face, found[0] if found else None) for face, found in zip(faces, matches)]
+            frame, seconds = _timed(face_stream.draw_results, frame, drawn)
+            timings['render'].append(seconds)
+    items['render'] = len(timings['render'])
+    finish('render')
+
+    return {'mode': models.name, 'db_path': os.path.abspath(db_path), 'images': len(paths),
+            'faces': len(owners), 'gallery_size': len(matrix), 'repeat': repeat, 'k': k,
+            'python': platform.python_version(), 'numpy': np.__version__, 'opencv': cv2.__version__,
+            'platform': platform.platform(), 'timestamp': time.time(), 'stages': stages,
+            'peak_rss_mb': peak_rss_mb()}
+
+
+def _full_pipeline(path, models, box):
+    """原来的做法：PIL 打开原图生成预览，推理时再按原分辨率解码、检测并裁剪人脸"""
+    from PIL import Image
+    start = time.perf_counter()
+    with Image.open(path) as img:
+        img.thumbnail(box, Image.LANCZOS)
+    preview = time.perf_counter()
+    full = cv2.imread(path)
+    faces = models.detect(full, max_side=None)
+    for face in faces:
+        if 'face' not in face:
+            face['face'] = face_image.align_crop(full, face['facial_area'], max_side=None)
+    return preview - start, time.perf_counter() - preview, full.shape
+
+
+def _scaled_pipeline(path, models, box, max_side):
+    """新的做法：缩小解码一次，预览和检测共用，人脸框映射回原图裁剪"""
+    start = time.perf_counter()
+    face_image.preview(path, box)
+    preview = time.perf_counter()
+    face_image.detect_scaled(path, lambda image, align: models.detect(image, max_side=None), max_side=max_side)
+    return preview - start, time.perf_counter() - preview, None
+
+
+def run_preprocess(db_path, models, max_side=face_image.DETECT_MAX_SIDE, repeat=3, limit=None, box=PREVIEW_BOX):
+    """对比两种预处理流程每张图片的预览、检测（含解码和裁剪人脸）耗时和内存
+
+    内存为 tracemalloc 统计的 numpy / OpenCV 图像缓冲区峰值（单独跑一轮，不影响计时）。
+    返回可直接写成 JSON 的结果字典。
+    """
+    paths = [os.path.join(db_path, rel_path) for rel_path in face_engine.list_images(db_path)][:limit]
+    if not paths:
+        raise ValueError(f"没有找到图片: {db_path}")
+    pipelines = {'full': lambda path: _full_pipeline(path, models, box),
+                 'scaled': lambda path: _scaled_pipeline(path, models, box, max_side)}
+    result = {'mode': models.name, 'db_path': os.path.abspath(db_path), 'images': len(paths), 'max_side': max_side,
+              'repeat': repeat, 'pipelines': {}}
+    pixels = []
+    for name, pipeline in pipelines.items():
+        timings = {'preview': [], 'detect': [], 'total': []}
+        for _ in range(repeat):
+            for path in paths:
+                face_image.clear_cache()  # 每张图片都从冷缓存开始，与界面中先预览再推理的顺序一致
+                preview, detect, shape = pipeline(path)
+                timings['preview'].append(preview)
+                timings['detect'].append(detect)
+                timings['total'].append(preview + detect)
+                if shape is not None and len(pixels) < len(paths):
+                    pixels.append(shape[0] * shape[1])
+        peaks = []
+        tracemalloc.start()
+        try:
+            for path in paths:
+                face_image.clear_cache()
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                pipeline(path)
+                peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        finally:
+            tracemalloc.stop()
+        result['pipelines'][name] = dict({stage: summarize(samples) for stage, samples in timings.items()},
+                                         peak_mb=max(peaks) / 2 ** 20, mean_peak_mb=float(np.mean(peaks)) / 2 ** 20)
+    face_image.clear_cache()
+    result['megapixels'] = float(np.mean(pixels)) / 1e6
+    full, scaled = result['pipelines']['full'], result['pipelines']['scaled']
+    result['speedup'] = full['total']['p50_ms'] / max(scaled['total']['p50_ms'], 1e-9)
+    result['memory_ratio'] = full['peak_mb'] / max(scaled['peak_mb'], 1e-9)
+    return result
+
+
+def compare(current, baseline):
+    """与基线 JSON 对比各阶段 p50 耗时，返回 {阶段: 当前/基线 比值}"""
+    ratios = {}
+    for stage, stats in current['stages'].items():
+        base = baseline.get('stages', {}).get(stage, {})
+        if stats.get('p50_ms') and base.get('p50_ms'):
+            ratios[stage] = stats['p50_ms'] / base['p50_ms']
+    return ratios
+
+
+def save(result, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_PATH = os.environ.get('FACE_CACHE_PATH',
+                              os.path.join(os.path.expanduser('~'), '.face_cache', 'cache.sqlite3'))
+DEFAULT_MAX_BYTES = int(os.environ.get('FACE_CACHE_MAX_MB', 512)) * 1024 * 1024
+TOUCH_INTERVAL = 60  # 读取时最多每隔多少秒更新一次访问时间，减少并发读者之间的写冲突
+
+enabled = os.environ.get('FACE_CACHE', 'on').lower() not in ('0', 'off', 'false', 'no')
+_cache = None
+_file_hashes = {}  # (路径, 大小, 修改时间) -> 内容哈希，避免同一进程内重复读文件
+_lock = threading.Lock()
+
+
+class FaceCache:
+    """按图像内容寻址的磁盘缓存（单个 SQLite 文件）
+
+    保存检测结果、特征和属性分析结果。使用 WAL 模式，GUI 和命令行可以同时读写；
+    总大小超过上限时按最近访问时间淘汰（LRU）。
+    """
+
+    def __init__(self, path=DEFAULT_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connect()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, kind TEXT, value BLOB, "
+                         "size INTEGER, last_access REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute("SELECT value, last_access FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[1] > TOUCH_INTERVAL:
+            try:
+                conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            except sqlite3.OperationalError:
+                pass  # 数据库正忙时跳过访问时间更新，不影响读取
+        return row[0]
+
+    def put(self, key, kind, value):
+        conn = self._connect()
+        conn.execute("INSERT OR REPLACE INTO entries (key, kind, value, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                     (key, kind, sqlite3.Binary(value), len(value), time.time()))
+        self.evict()
+
+    def evict(self):
+        """超过大小上限时删除最久未访问的条目，直到降到上限的 90%"""
+        conn = self._connect()
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        target = total - int(self.max_bytes * 0.9)
+        removed, freed = 0, 0
+        rows = conn.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for key, size in rows:
+                if freed >= target:
+                    break
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                freed += size
+                removed += 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return removed
+
+    def stats(self):
+        conn = self._connect()
+        rows = conn.execute("SELECT kind, COUNT(*), COALESCE(SUM(size), 0) FROM entries GROUP BY kind").fetchall()
+        return {kind: {'entries': count, 'bytes': size} for kind, count, size in rows}
+
+    def clear(self):
+        self._connect().execute("DELETE FROM entries")
+
+
+def get_cache():
+    """进程内共享的缓存实例，缓存被禁用或无法打开时返回 None"""
+    global _cache
+    if not enabled:
+        return None
+    with _lock:
+        if _cache is None:
+            try:
+                _cache = FaceCache()
+            except (OSError, sqlite3.Error):
+                return None
+        return _cache
+
+
+def content_hash(path):
+    """文件内容的 SHA-256，同一进程内按 (路径, 大小, 修改时间) 记忆"""
+    stat = os.stat(path)
+    marker = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if marker not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        _file_hashes[marker] = digest.hexdigest()
+    return _file_hashes[marker]
+
+
+def image_key(img, kind, **settings):
+    """图像内容哈希 + 处理类型 + 模型/检测器/对齐等设置组成缓存键；非文件输入（如视频帧）不缓存，返回 None"""
+    if not isinstance(img, str) or not os.path.isfile(img):
+        return None
+    params = json.dumps(settings, sort_keys=True)
+    return hashlib.sha1(f"{content_hash(img)}|{kind}|{params}".encode('utf-8')).hexdigest()
+
+
+def encode(meta, array=None):
+    """序列化为 JSON 头 + 原始 float32 数据"""
+    array = None if array is None else np.ascontiguousarray(array, dtype=np.float32)
+    header = {'meta': meta, 'shape': None if array is None else list(array.shape)}
+    data = json.dumps(header, ensure_ascii=False, default=to_json).encode('utf-8') + b'\n'
+    return data + (b'' if array is None else array.tobytes())
+
+
+def decode(value):
+    header, data = bytes(value).split(b'\n', 1)
+    header = json.loads(header.decode('utf-8'))
+    array = None
+    if header['shape'] is not None:
+        array = np.frombuffer(data, dtype=np.float32).reshape(header['shape']).copy()
+    return header['meta'], array
+
+
+def to_json(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"无法序列化 {type(obj).__name__}")
+
+
+def load(key):
+    """读取缓存，未命中返回 None，命中返回 (meta, array)"""
+    cache = get_cache()
+    if key is None or cache is None:
+        return None
+    try:
+        value = cache.get(key)
+    except sqlite3.Error:
+        return None
+    return None if value is None else decode(value)
+
+
+def store(key, kind, meta, array=None):
+    """写入缓存，失败时静默跳过（缓存不影响正常功能）"""
+    cache = get_cache()
+    if key is None or cache is None:
+        return
+    try:
+        cache.put(key, kind, encode(meta, array))
+    except sqlite3.Error:
+        pass
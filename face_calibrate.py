@@ -0,0 +1,181 @@
+import csv
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+# 标定结果按 "模型/检测器" 保存在一个 JSON 文件中，verify / find / stream 取阈值时读取
+CONFIG_PATH = os.environ.get('FACE_CALIBRATION_PATH',
+                             os.path.join(os.path.expanduser('~'), '.face_calibration.json'))
+BINS = 20000  # 余弦距离 [0, 2] 划分的区间数，阈值精度 1e-4
+BLOCK = 2048  # 每次计算 BLOCK x BLOCK 个距离，临时内存约 BLOCK^2 * 16 字节
+DEFAULT_FAR = 1e-3
+REPORT_FARS = (1e-2, 1e-3, 1e-4, 1e-5)
+
+_config = {}  # path -> (mtime, 内容)
+_config_lock = threading.Lock()
+
+
+class PairHistogram:
+    """同一身份（genuine）和不同身份（impostor）图片对的距离直方图，全部 ROC / DET 指标都由它算出"""
+
+    def __init__(self, bins=BINS):
+        self.bins = bins
+        self.genuine = np.zeros(bins, dtype=np.int64)
+        self.impostor = np.zeros(bins, dtype=np.int64)
+
+    @property
+    def thresholds(self):
+        """各区间的上沿：阈值取 thresholds[i] 时前 i + 1 个区间内的图片对判为同一人"""
+        return np.arange(1, self.bins + 1) * (2.0 / self.bins)
+
+    def count(self, dist):
+        """距离落在各区间的个数"""
+        index = (np.ravel(dist) * (self.bins / 2)).astype(np.int64)
+        np.clip(index, 0, self.bins - 1, out=index)
+        return np.bincount(index, minlength=self.bins)
+
+    def rates(self):
+        """每个阈值下的 (FAR, FRR)：FAR 为被判为同一人的 impostor 比例，FRR 为被拒绝的 genuine 比例"""
+        accepted = np.cumsum(self.genuine)
+        false_accepted = np.cumsum(self.impostor)
+        far = false_accepted / max(int(false_accepted[-1]), 1)
+        frr = 1.0 - accepted / max(int(accepted[-1]), 1)
+        return far, frr
+
+    def eer(self):
+        """等错误率及其阈值"""
+        far, frr = self.rates()
+        i = int(np.argmin(np.abs(far - frr)))
+        return float((far[i] + frr[i]) / 2), float(self.thresholds[i])
+
+    def at_far(self, target):
+        """FAR 不超过 target 的最大阈值，返回 (阈值, FAR, FRR)"""
+        far, frr = self.rates()
+        i = max(int(np.searchsorted(far, target, side='right')) - 1, 0)
+        return float(self.thresholds[i]), float(far[i]), float(frr[i])
+
+    def at_threshold(self, threshold):
+        """给定阈值下的 (FAR, FRR)"""
+        far, frr = self.rates()
+        i = min(max(int(np.ceil(threshold * self.bins / 2)) - 1, 0), self.bins - 1)
+        return float(far[i]), float(frr[i])
+
+    def curve(self):
+        """ROC / DET 曲线上的点 [(阈值, FAR, FRR)]，只保留有图片对落入的区间"""
+        far, frr = self.rates()
+        keep = np.flatnonzero((self.genuine + self.impostor) > 0)
+        return [(float(self.thresholds[i]), float(far[i]), float(frr[i])) for i in keep]
+
+
+def _pair_counts(hist, get_block, n, block, on_block=None):
+    """分块计算 n 个特征两两之间（不含自身）的距离并计数；get_block(start, stop) 返回对应的特征"""
+    counts = np.zeros(hist.bins, dtype=np.int64)
+    for i in range(0, n, block):
+        a = np.asarray(get_block(i, min(i + block, n)), dtype=np.float32)
+        for j in range(i, n, block):
+            b = a if j == i else np.asarray(get_block(j, min(j + block, n)), dtype=np.float32)
+            dist = 1.0 - a @ b.T
+            if j == i:
+                dist = dist[np.triu_indices(len(a), 1)]
+            counts += hist.count(dist)
+            if on_block is not None:
+                on_block(len(a) * len(b) if j != i else len(a) * (len(a) - 1) // 2)
+    return counts
+
+
+def pair_histogram(embeddings, identities, bins=BINS, block=BLOCK, on_progress=None):
+    """全部图片对的距离直方图
+
+    先分块统计全部图片对，再在每个身份内部统计 genuine 对，impostor = 全部 - genuine。
+    embeddings 可以是内存映射矩阵，每次只读入两个分块。on_progress(已完成的对数, 总对数)。
+    """
+    hist = PairHistogram(bins)
+    n = len(embeddings)
+    total, done = n * (n - 1) // 2, 0
+
+    def on_block(pairs):
+        nonlocal done
+        done += pairs
+        if on_progress is not None:
+            on_progress(done, total)
+
+    everything = _pair_counts(hist, lambda start, stop: embeddings[start:stop], n, block, on_block)
+    labels = np.unique(np.asarray(identities), return_inverse=True)[1]
+    order = np.argsort(labels, kind='stable')
+    bounds = np.flatnonzero(np.diff(labels[order])) + 1
+    for rows in np.split(order, bounds):
+        if len(rows) > 1:
+            hist.genuine += _pair_counts(hist, lambda start, stop: embeddings[rows[start:stop]], len(rows), block)
+    hist.impostor = everything - hist.genuine
+    return hist
+
+
+def calibrate(index, far=DEFAULT_FAR, bins=BINS, block=BLOCK, on_progress=None):
+    """用特征库中已提取的特征标定阈值，返回 (标定结果, 直方图)"""
+    hist = pair_histogram(index.embeddings, [face['identity'] for face in index.faces], bins, block, on_progress)
+    eer, eer_threshold = hist.eer()
+    threshold, actual_far, frr = hist.at_far(far)
+    entry = {'model_name': index.model_name, 'detector_backend': index.detector_backend, 'db_path': index.db_path,
+             'images': len(index), 'identities': len(set(face['identity'] for face in index.faces)),
+             'genuine_pairs': int(hist.genuine.sum()), 'impostor_pairs': int(hist.impostor.sum()),
+             'target_far': far, 'threshold': threshold, 'far': actual_far, 'frr': frr,
+             'eer': eer, 'eer_threshold': eer_threshold,
+             'operating_points': [dict(zip(('far_target', 'threshold', 'far', 'frr'), (target, *hist.at_far(target))))
+                                  for target in REPORT_FARS],
+             'updated': time.time()}
+    return entry, hist
+
+
+def write_curve(path, hist):
+    """把 ROC / DET 曲线写成 CSV：threshold, far, frr, tar"""
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['threshold', 'far', 'frr', 'tar'])
+        for threshold, far, frr in hist.curve():
+            writer.writerow([f"{threshold:.5f}", f"{far:.8g}", f"{frr:.8g}", f"{1 - frr:.8g}"])
+
+
+def config_key(model_name, detector_backend):
+    return f"{model_name}/{detector_backend}"
+
+
+def load_config(path=None):
+    """读取标定配置（按修改时间缓存，长期运行的进程在重新标定后自动生效），文件不存在时返回空字典"""
+    path = path or CONFIG_PATH
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+    with _config_lock:
+        cached = _config.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    try:
+        with open(path, encoding='utf-8') as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    with _config_lock:
+        _config[path] = (mtime, config)
+    return config
+
+
+def save(entry, path=None):
+    """写入一个模型/检测器组合的标定结果，保留其它组合"""
+    path = path or CONFIG_PATH
+    config = dict(load_config(path))
+    config[config_key(entry['model_name'], entry['detector_backend'])] = entry
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def calibrated_threshold(model_name, detector_backend, path=None):
+    """已标定的阈值，没有标定过时返回 None"""
+    entry = load_config(path).get(config_key(model_name, detector_backend))
+    return None if entry is None else entry['threshold']
@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+import face_image
+
+CASCADE = 'cascade'  # 作为 detector_backend 使用的名称
+
+# 默认参数，可通过环境变量调整（图形界面没有命令行参数）
+FAST_BACKEND = os.environ.get('FACE_CASCADE_FAST', 'opencv')
+REFINE_BACKEND = os.environ.get('FACE_CASCADE_REFINE', 'retinaface')
+FAST_MAX_SIDE = int(os.environ.get('FACE_CASCADE_FAST_SIDE', 640))
+PAD = float(os.environ.get('FACE_CASCADE_PAD', 0.5))
+MIN_CONFIDENCE = float(os.environ.get('FACE_CASCADE_MIN_CONFIDENCE', 0.9))
+NMS_IOU = 0.4
+
+
+def iou(a, b):
+    """两个 facial_area 的交并比"""
+    x0, y0 = max(a['x'], b['x']), max(a['y'], b['y'])
+    x1, y1 = min(a['x'] + a['w'], b['x'] + b['w']), min(a['y'] + a['h'], b['y'] + b['h'])
+    inter = max(0, x1 - x0) * max(0, y1 - y0)
+    union = a['w'] * a['h'] + b['w'] * b['h'] - inter
+    return inter / union if union > 0 else 0.0
+
+
+def nms(faces, threshold=NMS_IOU):
+    """按置信度从高到低保留，去掉与已保留人脸重叠过多的重复检测（相邻裁剪区域会检出同一张人脸）"""
+    kept = []
+    for face in sorted(faces, key=lambda face: face.get('confidence', 0), reverse=True):
+        if all(iou(face['facial_area'], other['facial_area']) < threshold for other in kept):
+            kept.append(face)
+    return kept
+
+
+def whole_image(image):
+    """未检测到人脸时与 DeepFace 一样把整张图当作一张置信度为 0 的人脸"""
+    h, w = image.shape[:2]
+    return {'face': image[:, :, ::-1].astype(np.float32) / 255, 'confidence': 0,
+            'facial_area': {'x': 0, 'y': 0, 'w': w, 'h': h, 'left_eye': None, 'right_eye': None}}
+
+
+class CascadeDetector:
+    """级联检测：快速检测器在缩小图上给出候选区域，精确检测器只在候选区域外扩后的裁剪图上运行
+
+    快速检测器一个候选都没有，或所有候选都被精确检测器否决（视为误检）时，才在整张图上运行精确检测器。
+    检测器本身以函数形式传入 detect()：propose(image) 和 refine(image, align) 都返回 DeepFace.extract_faces
+    格式的结果，没有人脸时返回空列表。
+    """
+
+    def __init__(self, fast_backend=FAST_BACKEND, refine_backend=REFINE_BACKEND, fast_max_side=FAST_MAX_SIDE,
+                 pad=PAD, min_confidence=MIN_CONFIDENCE, nms_iou=NMS_IOU):
+        self.fast_backend = fast_backend
+        self.refine_backend = refine_backend
+        self.fast_max_side = fast_max_side
+        self.pad = pad
+        self.min_confidence = min_confidence
+        self.nms_iou = nms_iou
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    def settings(self):
+        """影响检测结果的参数，计入缓存键"""
+        return {'fast': self.fast_backend, 'refine': self.refine_backend, 'fast_max_side': self.fast_max_side,
+                'pad': self.pad, 'min_confidence': self.min_confidence, 'nms_iou': self.nms_iou}
+
+    def _count(self, **values):
+        with self._lock:
+            self.stats.update(values)
+
+    def propose(self, image, propose):
+        """在缩小图上运行快速检测器，返回原图坐标的候选框 [(x, y, w, h)]"""
+        small = face_image.fit(image, self.fast_max_side)
+        sy, sx = image.shape[0] / small.shape[0], image.shape[1] / small.shape[1]
+        boxes = []
+        for face in propose(small):
+            area = face_image.scale_area(face['facial_area'], sx, sy)
+            boxes.append((area['x'], area['y'], area['w'], area['h']))
+        return boxes
+
+    def _confident(self, faces):
+        return [face for face in faces if face.get('confidence', 0) >= self.min_confidence]
+
+    def detect(self, image, propose, refine, align=True):
+        h, w = image.shape[:2]
+        boxes = self.propose(image, propose)
+        if not boxes:
+            self._count(images=1, full=1, refined_pixels=h * w, pixels=h * w)
+            faces = self._confident(refine(image, align))
+        else:
+            faces, refined_pixels = [], 0
+            for x, y, bw, bh in boxes:
+                pad_x, pad_y = int(bw * self.pad), int(bh * self.pad)
+                x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+                x1, y1 = min(w, x + bw + pad_x), min(h, y + bh + pad_y)
+                if x1 <= x0 or y1 <= y0:
+                    continue
+                refined_pixels += (x1 - x0) * (y1 - y0)
+                for face in refine(image[y0:y1, x0:x1], align):
+                    face['facial_area'] = face_image.scale_area(face['facial_area'], 1, 1, x0, y0)
+                    faces.append(face)
+            faces = self._confident(faces)
+            if not faces:
+                # 候选全部是误检：快速检测器可能漏掉了真正的人脸（如很大或侧脸），同样回退到整图
+                self._count(full=1, rejected=1)
+                faces = self._confident(refine(image, align))
+                refined_pixels += h * w
+            self._count(images=1, proposals=len(boxes), refined_pixels=refined_pixels, pixels=h * w)
+        faces = nms(faces, self.nms_iou)
+        self._count(faces=len(faces))
+        return faces
+
+    def summary(self):
+        """平均每张图的候选数、整图回退比例和精确检测器实际处理的像素比例"""
+        with self._lock:
+            stats = dict(self.stats)
+        images = max(stats.get('images', 0), 1)
+        return {'images': stats.get('images', 0), 'proposals_per_image': stats.get('proposals', 0) / images,
+                'full_fallback_rate': stats.get('full', 0) / images, 'faces_per_image': stats.get('faces', 0) / images,
+                'refined_fraction': stats.get('refined_pixels', 0) / max(stats.get('pixels', 0), 1)}
+
+
+detector = CascadeDetector()
+
+
+def configure(**settings):
+    """替换默认级联检测器的参数（命令行参数调用）"""
+    global detector
+    values = dict(detector.settings(), **{key: value for key, value in settings.items() if value is not None})
+    detector = CascadeDetector(fast_backend=values['fast'], refine_backend=values['refine'],
+                               fast_max_side=values['fast_max_side'], pad=values['pad'],
+                               min_confidence=values['min_confidence'], nms_iou=values['nms_iou'])
+    return detector
+
+
+def backend_key(detector_backend):
+    """写入缓存键的检测器描述：级联检测器带上参数，参数变化后不会命中旧结果"""
+    if detector_backend != CASCADE:
+        return detector_backend
+    return {'name': CASCADE, **detector.settings()}
+
+
+def report(paths, reference, cascade, iou_threshold=0.5, on_image=None):
+    """逐张比较精确检测器（reference）和级联检测器（cascade）的耗时和检出人脸
+
+    reference / cascade 为 detect(image) 函数，返回 DeepFace.extract_faces 格式的结果。以 reference 的结果为准，
+    recall 为与级联检测结果 IoU 不低于 iou_threshold 的人脸比例，precision 为级联检测结果中能对应上的比例。
+    """
+    import cv2
+    times = {'reference': [], 'cascade': []}
+    counts = Counter()
+    for i, path in enumerate(paths):
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        start = time.perf_counter()
+        expected = reference(image)
+        middle = time.perf_counter()
+        found = cascade(image)
+        times['reference'].append(middle - start)
+        times['cascade'].append(time.perf_counter() - middle)
+        matched = sum(1 for face in expected if any(iou(face['facial_area'], other['facial_area']) >= iou_threshold
+                                                    for other in found))
+        hits = sum(1 for face in found if any(iou(face['facial_area'], other['facial_area']) >= iou_threshold
+                                              for other in expected))
+        counts.update(images=1, expected=len(expected), found=len(found), matched=matched, hits=hits)
+        if on_image is not None:
+            on_image(i + 1, len(paths))
+
+    def stats(samples):
+        samples = np.asarray(samples) * 1000
+        if not len(samples):
+            return {'mean_ms': 0.0, 'p50_ms': 0.0, 'p90_ms': 0.0}
+        return {'mean_ms': float(samples.mean()), 'p50_ms': float(np.percentile(samples, 50)),
+                'p90_ms': float(np.percentile(samples, 90))}
+
+    result = {'images': counts['images'], 'reference_faces': counts['expected'], 'cascade_faces': counts['found'],
+              'recall': counts['matched'] / counts['expected'] if counts['expected'] else None,
+              'precision': counts['hits'] / counts['found'] if counts['found'] else None,
+              'reference': stats(times['reference']), 'cascade': stats(times['cascade'])}
+    result['speedup'] = result['reference']['mean_ms'] / max(result['cascade']['mean_ms'], 1e-9)
+    return result
@@ -0,0 +1,34 @@
+import json
+import os
+import socket
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = int(os.environ.get('FACE_SERVER_PORT', 8765))
+
+
+def server_available(host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=0.05):
+    """检查本地模型服务是否在运行（只尝试建立 TCP 连接，不导入任何模型）"""
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def request(endpoint, payload, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=600):
+    """向模型服务发送请求，服务端出错时抛出 RuntimeError"""
+    import urllib.error
+    import urllib.request
+
+    data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    req = urllib.request.Request(f"http://{host}:{port}/{endpoint}", data=data,
+                                 headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return json.loads(resp.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        try:
+            message = json.loads(e.read().decode('utf-8')).get('error', str(e))
+        except ValueError:
+            message = str(e)
+        raise RuntimeError(message)
@@ -0,0 +1,248 @@
+import os
+
+import numpy as np
+
+import face_cache
+import face_calibrate
+import face_cascade
+import face_image
+from face_profile import profiler
+
+# 默认模型配置，与 DeepFace.find / verify 的缺省行为保持一致
+MODEL_NAME = 'VGG-Face'
+DETECTOR_BACKEND = 'retinaface'
+NORMALIZATION = 'base'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# DeepFace 中余弦距离的默认阈值
+COSINE_THRESHOLDS = {'VGG-Face': 0.68, 'Facenet': 0.40, 'Facenet512': 0.30, 'ArcFace': 0.68, 'Dlib': 0.07,
+                     'SFace': 0.593, 'OpenFace': 0.10, 'DeepFace': 0.23, 'DeepID': 0.015, 'GhostFaceNet': 0.65}
+
+_models = {}
+
+
+def list_images(db_path):
+    """递归列出数据库文件夹中的所有图片（相对路径，按字典序）"""
+    images = []
+    for root, dirs, files in os.walk(db_path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                rel_path = os.path.relpath(os.path.join(root, name), db_path)
+                images.append(rel_path.replace(os.sep, '/'))
+    return images
+
+
+def identity_of(path):
+    """身份名取图片所在文件夹的名称"""
+    return os.path.basename(os.path.dirname(os.path.abspath(path)))
+
+
+def find_threshold(model_name=MODEL_NAME, detector_backend=DETECTOR_BACKEND, default=None):
+    """获取模型对应的余弦距离阈值
+
+    优先使用 calibrate 命令在本地数据上为该模型/检测器标定的阈值（见 face_calibrate），没有标定时使用 default，
+    default 也未指定时使用 DeepFace 的默认阈值。
+    """
+    calibrated = face_calibrate.calibrated_threshold(model_name, detector_backend)
+    if calibrated is not None:
+        return calibrated
+    return default if default is not None else COSINE_THRESHOLDS.get(model_name, 0.68)
+
+
+def l2_normalize(x):
+    """按行做 L2 归一化，归一化后余弦距离 = 1 - 内积"""
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.maximum(norms, 1e-10)
+
+
+def get_model(model_name=MODEL_NAME):
+    """加载并缓存人脸识别模型"""
+    if model_name not in _models:
+        from deepface import DeepFace
+        with profiler.span(f"load model {model_name}"):
+            try:
+                _models[model_name] = DeepFace.build_model(model_name, task='facial_recognition')
+            except TypeError:
+                _models[model_name] = DeepFace.build_model(model_name)
+    return _models[model_name]
+
+
+def get_attribute_model(action):
+    """加载并缓存属性分析模型（age / gender / race / emotion）"""
+    key = f"attribute:{action}"
+    if key not in _models:
+        from deepface import DeepFace
+        with profiler.span(f"load model {action}"):
+            try:
+                _models[key] = DeepFace.build_model(action.capitalize(), task='facial_attribute')
+            except TypeError:
+                _models[key] = DeepFace.build_model(action.capitalize())
+    return _models[key]
+
+
+def warm_detector(detector_backend=DETECTOR_BACKEND):
+    """在空白图像上运行一次检测器，使其模型提前加载"""
+    key = f"detector:{detector_backend}"
+    if key not in _models:
+        with profiler.span(f"load detector {detector_backend}"):
+            detect_faces(np.zeros((224, 224, 3), dtype=np.uint8), detector_backend=detector_backend)
+        _models[key] = True
+
+
+def detect_faces(img, detector_backend=DETECTOR_BACKEND, align=True, enforce_detection=False,
+                 max_side=face_image.DETECT_MAX_SIDE):
+    """检测并对齐人脸，返回 [{'face', 'facial_area', 'confidence'}]
+
+    enforce_detection=False 时未检测到人脸会把整张图当作一张人脸（与 DeepFace 一致），
+    为 True 时返回空列表。detector_backend 为 'cascade' 时使用级联检测（见 face_cascade）。
+    大图只在长边为 max_side 的缩小图上检测，人脸从原图裁出（见 face_image.detect_scaled），
+    max_side=None 时在原图上检测。
+    """
+
+    def detect(image, align):
+        if detector_backend != face_cascade.CASCADE:
+            return _extract_faces(image, detector_backend, enforce_detection, align)
+        cascade = face_cascade.detector
+        faces = cascade.detect(image, lambda small: _extract_faces(small, cascade.fast_backend, True, False),
+                               lambda crop, align: _extract_faces(crop, cascade.refine_backend, True, align), align)
+        return faces or ([] if enforce_detection else [face_cascade.whole_image(image)])
+
+    return face_image.detect_scaled(img, detect, max_side=max_side, align=align)
+
+
+def _extract_faces(image, detector_backend, enforce_detection, align):
+    from deepface import DeepFace
+    try:
+        return DeepFace.extract_faces(img_path=image, detector_backend=detector_backend,
+                                      enforce_detection=enforce_detection, align=align)
+    except ValueError:
+        return []
+
+
+def _preprocess(face, model):
+    """把对齐后的人脸缩放到模型输入尺寸，流程与 DeepFace.represent 相同"""
+    from deepface.modules import preprocessing
+    target_size = model.input_shape
+    img = face[:, :, ::-1]
+    img = preprocessing.resize_image(img=img, target_size=(target_size[1], target_size[0]))
+    return preprocessing.normalize_input(img=img, normalization=NORMALIZATION)
+
+
+def _forward_batch(model, batch):
+    """批量前向推理，不支持批量的模型逐张计算"""
+    keras_model = getattr(model, 'model', None)
+    if keras_model is not None and hasattr(keras_model, 'predict_on_batch'):
+        output = keras_model.predict_on_batch(batch)
+        return np.asarray(output, dtype=np.float32).reshape(len(batch), -1)
+    return np.asarray([model.forward(img[np.newaxis, ...]) for img in batch], dtype=np.float32)
+
+
+def embed_faces(faces, model_name=MODEL_NAME, batch_size=32):
+    """批量提取人脸特征，返回 L2 归一化后的 float32 矩阵"""
+    if not faces:
+        return np.zeros((0, 0), dtype=np.float32)
+    model = get_model(model_name)
+    embeddings = []
+    for start in range(0, len(faces), batch_size):
+        batch = np.concatenate([_preprocess(face['face'], model) for face in faces[start:start + batch_size]])
+        embeddings.append(_forward_batch(model, batch))
+    return l2_normalize(np.concatenate(embeddings))
+
+
+def represent_key(img, model_name=MODEL_NAME, detector_backend=DETECTOR_BACKEND):
+    """represent 结果的缓存键，非图片文件输入返回 None"""
+    return face_cache.image_key(img, 'represent', model=model_name, detector=face_cascade.backend_key(detector_backend),
+                                align=True, normalization=NORMALIZATION, max_side=face_image.DETECT_MAX_SIDE)
+
+
+def face_meta(face):
+    """去掉人脸图像本身，只保留位置和置信度"""
+    return {'facial_area': face.get('facial_area', {}), 'confidence': face.get('confidence', 0)}
+
+
+def represent(img, model_name=MODEL_NAME, detector_backend=DETECTOR_BACKEND):
+    """检测图像中的人脸并提取特征，返回 (faces, embeddings)
+
+    图片文件的结果会写入磁盘缓存；缓存命中时 faces 只包含 facial_area 和 confidence，不含对齐后的人脸图像。
+    """
+    key = represent_key(img, model_name, detector_backend)
+    hit = face_cache.load(key)
+    if hit is not None:
+        faces, embeddings = hit
+        return faces, embeddings
+    faces = detect_faces(img, detector_backend=detector_backend)
+    embeddings = embed_faces(faces, model_name=model_name)
+    face_cache.store(key, 'represent', [face_meta(face) for face in faces], embeddings)
+    return faces, embeddings
+
+
+def verify(img1, img2, model_name=MODEL_NAME, detector_backend=DETECTOR_BACKEND, threshold=None):
+    """人脸验证，与 DeepFace.verify 一致取两张图片所有人脸组合中的最小余弦距离"""
+    faces1, embeddings1 = represent(img1, model_name=model_name, detector_backend=detector_backend)
+    faces2, embeddings2 = represent(img2, model_name=model_name, detector_backend=detector_backend)
+    if not faces1 or not faces2:
+        raise ValueError("未检测到人脸")
+    return verification_result(embeddings1, embeddings2, model_name, detector_backend, threshold)
+
+
+def verification_result(embeddings1, embeddings2, model_name=MODEL_NAME, detector_backend=DETECTOR_BACKEND,
+                        threshold=None):
+    """根据两组特征生成与 DeepFace.verify 相同字段的验证结果"""
+    distance = float(np.min(1.0 - embeddings1 @ embeddings2.T))
+    if threshold is None:
+        threshold = find_threshold(model_name, detector_backend)
+    return {'verified': distance <= threshold, 'distance': distance, 'threshold': threshold, 'model': model_name,
+            'detector_backend': detector_backend}
+
+
+def represent_batch(images, model_name=MODEL_NAME, detector_backend=DETECTOR_BACKEND, batch_size=32,
+                    on_progress=None):
+    """逐张检测人脸，跨图片凑批提取特征，对齐后的人脸图像提取完即释放；命中缓存的图片跳过检测和推理
+
+    返回 (owners, areas, embeddings, failed)：owners[i] 为第 i 张人脸所属图片在 images 中的下标，
+    failed 为检测失败的 (下标, 错误) 列表。owners 不保证有序。
+    """
+    owners, areas, blocks, failed, pending = [], [], [], [], []
+    keys = {}
+
+    def flush():
+        if pending:
+            embeddings = embed_faces([face for i, face in pending], model_name=model_name, batch_size=batch_size)
+            blocks.append(embeddings)
+            owners.extend(i for i, face in pending)
+            areas.extend(face.get('facial_area', {}) for i, face in pending)
+            # 同一张图片的人脸总是一起进入同一批，可以按图片写缓存
+            for i in dict.fromkeys(i for i, face in pending):
+                rows = [row for row, (owner, face) in enumerate(pending) if owner == i]
+                face_cache.store(keys.get(i), 'represent', [face_meta(pending[row][1]) for row in rows],
+                                 embeddings[rows])
+            pending.clear()
+
+    for i, img in enumerate(images):
+        try:
+            keys[i] = represent_key(img, model_name, detector_backend)
+            hit = face_cache.load(keys[i])
+            if hit is not None:
+                faces, embeddings = hit
+                if len(faces):
+                    blocks.append(embeddings)
+                    owners.extend([i] * len(faces))
+                    areas.extend(face['facial_area'] for face in faces)
+                detected = []
+            else:
+                detected = detect_faces(img, detector_backend=detector_backend)
+                if not detected:
+                    face_cache.store(keys[i], 'represent', [], np.zeros((0, 0), dtype=np.float32))
+        except Exception as e:
+            failed.append((i, e))
+            continue
+        pending.extend((i, face) for face in detected)
+        if len(pending) >= batch_size:
+            flush()
+        if on_progress is not None:
+            on_progress(i + 1, len(images))
+    flush()
+    embeddings = np.concatenate(blocks) if blocks else np.zeros((0, 0), dtype=np.float32)
+    return np.asarray(owners, dtype=np.int64), areas, embeddings, failed
@@ -0,0 +1,381 @@
+import itertools
+import os
+import shutil
+import threading
+import time
+import traceback
+
+import numpy as np
+
+import face_cache
+import face_engine
+import face_index
+
+# 登记日志：特征库目录旁的 <特征库目录>_log，每次登记写入一个不可变的日志段（先写临时文件再改名）
+LOG_SUFFIX = '_log'
+SEGMENT_EXT = '.seg'
+REFRESH_INTERVAL = float(os.environ.get('FACE_ENROLL_REFRESH', 1.0))  # 实时识别检查特征库和日志变化的间隔（秒）
+LOCK_STALE = 600  # 合并锁超过该秒数未释放视为合并进程已退出
+# 日志中未合并的人脸达到该数量时，实时识别在后台把日志合并进特征库（日志中的人脸逐个计算距离）；0 不自动合并
+COMPACT_THRESHOLD = int(os.environ.get('FACE_ENROLL_COMPACT', 1000))
+
+_counter = itertools.count()
+
+
+def log_dir(index_dir):
+    return f"{index_dir}{LOG_SUFFIX}"
+
+
+def append(index_dir, faces, embeddings):
+    """追加一个日志段，返回段名；读者只会看到写完整的段"""
+    directory = log_dir(index_dir)
+    os.makedirs(directory, exist_ok=True)
+    name = f"{time.time_ns():020d}-{os.getpid()}-{next(_counter)}{SEGMENT_EXT}"
+    tmp_path = os.path.join(directory, f"{name}.tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(face_cache.encode({'faces': faces}, embeddings))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(directory, name))
+    return name
+
+
+def read_segment(index_dir, name):
+    """返回日志段中的 (人脸记录, 特征矩阵)"""
+    with open(os.path.join(log_dir(index_dir), name), 'rb') as f:
+        meta, embeddings = face_cache.decode(f.read())
+    return meta['faces'], embeddings
+
+
+def list_segments(index_dir):
+    try:
+        names = os.listdir(log_dir(index_dir))
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in names if name.endswith(SEGMENT_EXT))
+
+
+def pending_segments(index):
+    """尚未合并进该特征库的日志段（特征库 meta 中记录了上次合并的日志段）"""
+    merged = set(index.meta.get('log_segments', []))
+    return [name for name in list_segments(index.index_dir) if name not in merged]
+
+
+class GallerySnapshot:
+    """不可变的检索快照：特征库（内存映射）加上日志中尚未合并的人脸，检索时合并两部分的结果"""
+
+    def __init__(self, index, segments=(), faces=(), embeddings=None, sizes=()):
+        self.index = index
+        self.segments = tuple(segments)
+        self.faces = list(faces)
+        self.embeddings = embeddings if embeddings is not None else np.zeros((0, 0), dtype=np.float32)
+        self.sizes = list(sizes)  # [(段名, 该段在 faces 中的人脸数)]
+        # 日志中各身份的人脸下标和原型（归一化均值），供按身份检索使用
+        names, labels = np.unique([face['identity'] for face in self.faces], return_inverse=True)
+        self.groups = [(str(name), np.flatnonzero(labels == i)) for i, name in enumerate(names)]
+        self.prototypes = face_engine.l2_normalize([self.embeddings[rows].mean(axis=0) for _, rows in self.groups]) \
+            if self.groups else np.zeros((0, self.embeddings.shape[1]), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.index) + len(self.faces)
+
+    @property
+    def model_name(self):
+        return self.index.model_name
+
+    @property
+    def detector_backend(self):
+        return self.index.detector_backend
+
+    def _result(self, i, distance):
+        face = self.faces[i]
+        return {'identity': face['identity'], 'path': os.path.join(self.index.db_path, face['path']),
+                'distance': float(distance), 'row': int(len(self.index) + i)}
+
+    def _log_distances(self, queries):
+        return 1.0 - queries @ self.embeddings.T
+
+    def search(self, queries, k=5, threshold=None, **kwargs):
+        """同 GalleryIndex.search，日志中的人脸精确计算距离后与特征库的结果合并"""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        results = self.index.search(queries, k=k, threshold=threshold, **kwargs)
+        if not self.faces:
+            return results
+        merged = []
+        for found, dists in zip(results, self._log_distances(queries)):
+            best = np.argsort(dists)[:k]
+            extra = [self._result(i, dists[i]) for i in best if threshold is None or dists[i] <= threshold]
+            merged.append(sorted(found + extra, key=lambda result: result['distance'])[:k])
+        return merged
+
+    def search_identities(self, queries, k=5, threshold=None, images_per_identity=3, **kwargs):
+        """同 GalleryIndex.search_identities，日志中的人脸按身份与特征库的结果合并
+
+        只在日志中的身份用日志人脸的原型计算 prototype_distance；特征库中已有的身份保留特征库原型的距离，
+        images 取两边最接近的 images_per_identity 张图片。
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        results = self.index.search_identities(queries, k=k, threshold=threshold,
+                                               images_per_identity=images_per_identity, **kwargs)
+        if not self.faces:
+            return results
+        merged = []
+        proto_dist = 1.0 - queries @ self.prototypes.T
+        for found, dists, prototype_dists in zip(results, self._log_distances(queries), proto_dist):
+            best = {result['identity']: result for result in found}
+            for (identity, rows), prototype_distance in zip(self.groups, prototype_dists):
+                order = rows[np.argsort(dists[rows])[:images_per_identity]]
+                if threshold is not None and dists[order[0]] > threshold:
+                    continue
+                images = [self._result(i, dists[i]) for i in order]
+                current = best.get(identity)
+                if current is None:
+                    best[identity] = dict(images[0], prototype_distance=float(prototype_distance), images=images)
+                else:
+                    images = sorted(current['images'] + images, key=lambda result: result['distance'])
+                    best[identity] = dict(current, **images[0], images=images[:images_per_identity])
+            merged.append(sorted(best.values(), key=lambda result: result['distance'])[:k])
+        return merged
+
+
+def _new_faces(faces, known):
+    """faces 中路径不在 known 里的人脸下标，并把它们的路径加入 known（同一图片只保留第一次登记的结果）"""
+    keep = []
+    for i, face in enumerate(faces):
+        if face['path'] not in known:
+            known.add(face['path'])
+            keep.append(i)
+    return keep
+
+
+def load_snapshot(db_path, model_name=face_engine.MODEL_NAME, detector_backend=face_engine.DETECTOR_BACKEND,
+                  previous=None, build=True):
+    """读取当前的特征库和日志，建立新快照；都没有变化时直接返回 previous
+
+    build=False 时特征库不存在不会去建立：有 previous 时继续使用它，否则抛出 FileNotFoundError。
+    """
+    try:
+        index = face_index.open_index(db_path, model_name, detector_backend, build=build)
+    except (FileNotFoundError, ValueError):
+        if previous is None:
+            raise
+        return previous
+    segments = pending_segments(index)
+    if previous is not None and previous.index is index and previous.segments == tuple(segments):
+        return previous
+    reuse = {}
+    if previous is not None and previous.index is index:
+        # 同一特征库上只读取新增的日志段
+        start = 0
+        for name, count in previous.sizes:
+            reuse[name] = (previous.faces[start:start + count], previous.embeddings[start:start + count])
+            start += count
+    known = {face['path'] for face in index.faces} if segments else set()  # 已在特征库中的图片不重复计入
+    faces, blocks, sizes = [], [], []
+    for name in segments:
+        try:
+            segment_faces, embeddings = reuse.get(name) or read_segment(index.index_dir, name)
+        except FileNotFoundError:  # 刚被合并进新特征库并删除，下次刷新时会读到新特征库
+            continue
+        keep = _new_faces(segment_faces, known)
+        faces.extend(segment_faces[i] for i in keep)
+        blocks.append(np.asarray(embeddings, dtype=np.float32)[keep])
+        sizes.append((name, len(keep)))
+    return GallerySnapshot(index, segments, faces, np.concatenate(blocks) if faces else None, sizes)
+
+
+class LiveGallery:
+    """长期运行的读者（实时识别）使用的特征库
+
+    检索总在一个不可变快照上进行。距上次检查超过 interval 秒时，由一个后台线程检查特征库和日志并建立新快照，
+    建好后整体替换引用；检索从不等待加载，登记或合并特征库期间识别不会停顿。
+    日志中未合并的人脸达到 COMPACT_THRESHOLD 时在后台合并日志，合并完成后下次刷新即换用新特征库。
+    """
+
+    def __init__(self, db_path, model_name=face_engine.MODEL_NAME, detector_backend=face_engine.DETECTOR_BACKEND,
+                 interval=REFRESH_INTERVAL):
+        self.db_path = db_path
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.interval = interval
+        self.snapshot = load_snapshot(db_path, model_name, detector_backend)
+        self._checked = time.monotonic()
+        self._refreshing = threading.Lock()
+        self._compaction = None
+
+    def __len__(self):
+        return len(self.snapshot)
+
+    def refresh(self):
+        """建立新快照（在调用线程中执行），有变化时返回 True"""
+        with self._refreshing:
+            # 刷新只读取已有的特征库，特征库被删除时保留当前快照，不会在识别过程中触发重建
+            snapshot = load_snapshot(self.db_path, self.model_name, self.detector_backend, previous=self.snapshot,
+                                     build=False)
+            changed = snapshot is not self.snapshot
+            self.snapshot = snapshot
+            self._checked = time.monotonic()
+        if COMPACT_THRESHOLD and len(snapshot.faces) >= COMPACT_THRESHOLD and \
+                (self._compaction is None or not self._compaction.is_alive()):
+            self._compaction = compact_in_background(self.db_path, self.model_name, self.detector_backend)
+        return changed
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception:
+            traceback.print_exc()
+            self._checked = time.monotonic()
+
+    def current(self):
+        """当前快照；需要检查更新时在后台线程中进行，本次仍返回旧快照"""
+        if self.interval is not None and time.monotonic() - self._checked >= self.interval \
+                and not self._refreshing.locked():
+            self._checked = time.monotonic()
+            threading.Thread(target=self._refresh_in_background, daemon=True).start()
+        return self.snapshot
+
+    def search(self, queries, **kwargs):
+        return self.current().search(queries, **kwargs)
+
+    def search_identities(self, queries, **kwargs):
+        return self.current().search_identities(queries, **kwargs)
+
+
+def _largest(faces):
+    areas = [face['facial_area'].get('w', 0) * face['facial_area'].get('h', 0) for face in faces]
+    return int(np.argmax(areas))
+
+
+def _destination(db_path, identity, img_path):
+    """图片复制到数据库中的相对路径，同名文件已存在时加序号"""
+    stem, ext = os.path.splitext(os.path.basename(img_path))
+    for n in itertools.count():
+        name = f"{stem}{ext}" if n == 0 else f"{stem}_{n}{ext}"
+        rel_path = f"{identity}/{name}"
+        target = os.path.join(db_path, rel_path)
+        if not os.path.exists(target) or os.path.samefile(target, img_path):
+            return rel_path
+
+
+def enroll(db_path, identity, images, model_name=face_engine.MODEL_NAME,
+           detector_backend=face_engine.DETECTOR_BACKEND, probe_detector=None):
+    """登记一个人：提取每张图片中最大人脸的特征并写入日志，正在运行的实时识别在几秒内即可识别该人
+
+    detector_backend 决定写入哪个特征库的日志，probe_detector 为登记图片所用的检测器（默认相同）。
+    图片会复制到数据库的身份文件夹中（与手动放入图片的效果相同，之后重建特征库时也包含该人）。
+    返回 (写入的人脸记录, 失败的图片及原因)。
+    """
+    if not identity or identity.startswith('.') or os.sep in identity or '/' in identity:
+        raise ValueError(f"无效的身份名: {identity}")
+    index = face_index.open_index(db_path, model_name, detector_backend)
+    records, rows, failed = [], [], []
+    for img_path in images:
+        try:
+            faces, embeddings = face_engine.represent(img_path, model_name=model_name,
+                                                      detector_backend=probe_detector or detector_backend)
+            if not faces:
+                raise ValueError("未检测到人脸")
+        except Exception as e:
+            failed.append((img_path, str(e)))
+            continue
+        best = _largest(faces)
+        rel_path = _destination(db_path, identity, img_path)
+        target = os.path.join(db_path, rel_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if not os.path.exists(target):
+            shutil.copy2(img_path, target)
+        area = faces[best]['facial_area']
+        records.append({'path': rel_path, 'identity': identity, 'x': area.get('x', 0), 'y': area.get('y', 0),
+                        'w': area.get('w', 0), 'h': area.get('h', 0)})
+        rows.append(embeddings[best])
+    if records:
+        append(index.index_dir, records, np.stack(rows))
+    return records, failed
+
+
+class _CompactionLock:
+    """同一特征库同一时间只允许一个进程合并日志（锁文件）"""
+
+    def __init__(self, index_dir):
+        self.path = os.path.join(log_dir(index_dir), 'compact.lock')
+        self.acquired = False
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        for _ in range(2):
+            try:
+                os.close(os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                self.acquired = True
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.path) < LOCK_STALE:
+                        break
+                    os.remove(self.path)
+                except FileNotFoundError:
+                    pass
+        return self.acquired
+
+    def __exit__(self, *exc):
+        if self.acquired:
+            os.remove(self.path)
+
+
+def compact(db_path, model_name=face_engine.MODEL_NAME, detector_backend=face_engine.DETECTOR_BACKEND):
+    """把日志合并进特征库
+
+    写出包含日志中人脸的新特征库（先写临时目录再整体替换），并把复制进来的图片记入文件清单，之后的增量更新
+    不会重新提取它们的特征；最后删除已合并的日志段。合并期间读者继续使用旧快照。
+    返回合并的人脸数，另一个进程正在合并时返回 None。
+    """
+    index_dir = os.path.abspath(face_index.default_index_dir(db_path, model_name, detector_backend))
+    with _CompactionLock(index_dir) as acquired:
+        if not acquired:
+            return None
+        index = face_index.GalleryIndex.load(index_dir)
+        index.db_path = os.path.abspath(db_path)
+        merged = set(index.meta.get('log_segments', []))
+        for name in list_segments(index_dir):
+            if name in merged:  # 上次合并后没来得及删除
+                os.remove(os.path.join(log_dir(index_dir), name))
+        segments = pending_segments(index)
+        if not segments:
+            return 0
+        known = {face['path'] for face in index.faces}
+        faces = list(index.faces)
+        blocks = [index.embeddings[start:start + face_index.SEARCH_BLOCK]
+                  for start in range(0, len(index), face_index.SEARCH_BLOCK)]
+        manifest = index.load_manifest()
+        added = 0
+        for name in segments:
+            segment_faces, embeddings = read_segment(index_dir, name)
+            keep = _new_faces(segment_faces, known)
+            for i in keep:
+                face = segment_faces[i]
+                path = os.path.join(index.db_path, face['path'])
+                if face['path'] not in manifest and os.path.exists(path):
+                    manifest[face['path']] = face_index.file_entry(path)
+                faces.append(face)
+            blocks.append(np.asarray(embeddings, dtype=np.float32)[keep])
+            added += len(keep)
+        face_index.GalleryIndex.write(index_dir, blocks, faces, dict(index.meta, log_segments=segments),
+                                      manifest=manifest)
+        face_index.carry_over(face_index.GalleryIndex.load(index_dir), index)
+        for name in segments:
+            os.remove(os.path.join(log_dir(index_dir), name))
+        return added
+
+
+def _compact_quietly(db_path, model_name, detector_backend):
+    try:
+        compact(db_path, model_name, detector_backend)
+    except Exception:
+        traceback.print_exc()
+
+
+def compact_in_background(db_path, model_name=face_engine.MODEL_NAME, detector_backend=face_engine.DETECTOR_BACKEND):
+    """在后台线程中合并日志（另一个进程正在合并时直接结束），返回该线程；LiveGallery 在日志过长时调用"""
+    thread = threading.Thread(target=_compact_quietly, args=(db_path, model_name, detector_backend), daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,183 @@
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+DETECT_MAX_SIDE = 1280  # 检测在长边不超过该值的缩小图上进行，人脸框再映射回原图
+MAX_CROP_SIDE = 512  # 原图上裁出的人脸超过该尺寸时先缩小，模型输入只有 224 左右，不需要保留更多像素
+CACHE_SIZE = 4  # 缓存最近几张图片的缩小图，供预览和推理共用
+REDUCED_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def image_size(path):
+    """只读取文件头得到 (宽, 高)，读取失败返回 None"""
+    try:
+        from PIL import Image
+        with Image.open(path) as img:
+            return img.size
+    except Exception:
+        return None
+
+
+def reduce_factor(size, max_side):
+    """JPEG 可以在解码时直接按 1/2、1/4、1/8 缩小（只做部分 IDCT），选缩小后长边仍不小于 max_side 的最大倍数"""
+    if size is None or max_side is None:
+        return 1
+    for factor in (8, 4, 2):
+        if max(size) / factor >= max_side:
+            return factor
+    return 1
+
+
+def fit(img, max_side):
+    """把图像缩小到长边不超过 max_side，本来就不大时原样返回"""
+    h, w = img.shape[:2]
+    if max_side is None or max(h, w) <= max_side:
+        return img
+    scale = max_side / max(h, w)
+    return cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+class DecodedImage:
+    """一张图片文件的解码结果：缩小图只解码一次，供界面预览和人脸检测共用
+
+    原图只在需要裁出人脸时解码，且不常驻内存。
+    """
+
+    def __init__(self, path, max_side=DETECT_MAX_SIDE):
+        self.path = path
+        self.max_side = max_side
+        self.size = image_size(path)
+        self._small = None
+        self._lock = threading.Lock()
+
+    @property
+    def scaled(self):
+        """缩小图是否比原图小（不需要缩小时缩小图就是原图），在 small() 之后才确定"""
+        return self.size is not None and self.max_side is not None and max(self.size) > self.max_side
+
+    def small(self):
+        """长边不超过 max_side 的 BGR 图像"""
+        with self._lock:
+            if self._small is None:
+                factor = reduce_factor(self.size, self.max_side)
+                img = cv2.imread(self.path, REDUCED_FLAGS[factor]) if factor > 1 else cv2.imread(self.path)
+                if img is None:
+                    raise ValueError(f"无法读取图像: {self.path}")
+                if self.size is None:  # 读不到文件头时按解码结果确定原图尺寸
+                    self.size = (img.shape[1], img.shape[0])
+                self._small = fit(img, self.max_side)
+            return self._small
+
+    def full(self):
+        """原分辨率 BGR 图像，不需要缩小时直接返回缩小图，不重复解码"""
+        if not self.scaled:
+            return self.small()
+        img = cv2.imread(self.path)
+        if img is None:
+            raise ValueError(f"无法读取图像: {self.path}")
+        return img
+
+
+def open_image(path, max_side=DETECT_MAX_SIDE):
+    """打开图片文件，最近用过的图片直接返回已解码的缩小图（文件被修改后重新解码）"""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, max_side)
+    with _cache_lock:
+        decoded = _cache.get(key)
+        if decoded is not None:
+            _cache.move_to_end(key)
+            return decoded
+        decoded = _cache[key] = DecodedImage(path, max_side)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+        return decoded
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def preview(path, box):
+    """界面预览用的 PIL 图像，缩放到不超过 box=(宽, 高)，与检测共用同一份缩小图"""
+    from PIL import Image
+    img = Image.fromarray(cv2.cvtColor(open_image(path).small(), cv2.COLOR_BGR2RGB))
+    if box[0] > 0 and box[1] > 0:
+        img.thumbnail(box, Image.LANCZOS)
+    return img
+
+
+def scale_area(area, sx, sy, dx=0, dy=0):
+    """把缩小图（或裁剪图）上的人脸框和关键点（双眼、鼻子、嘴角）换算到原图坐标：先缩放，再平移 (dx, dy)"""
+    scaled = dict(area)
+    for key, value in area.items():
+        if key == 'x':
+            scaled[key] = int(round(value * sx)) + dx
+        elif key == 'y':
+            scaled[key] = int(round(value * sy)) + dy
+        elif key == 'w':
+            scaled[key] = int(round(value * sx))
+        elif key == 'h':
+            scaled[key] = int(round(value * sy))
+        elif isinstance(value, (tuple, list)) and len(value) == 2:
+            scaled[key] = (int(round(value[0] * sx)) + dx, int(round(value[1] * sy)) + dy)
+    return scaled
+
+
+def align_crop(img, area, align=True, max_side=MAX_CROP_SIDE):
+    """从原图裁出人脸，align 时与 DeepFace 一样按双眼连线旋转摆正；返回 RGB、0~1 的 float32 图像
+
+    只对输出区域做仿射变换，不旋转整张原图。
+    """
+    x, y, w, h = area['x'], area['y'], max(area['w'], 1), max(area['h'], 1)
+    left_eye, right_eye = area.get('left_eye'), area.get('right_eye')
+    if align and left_eye is not None and right_eye is not None:
+        angle = float(np.degrees(np.arctan2(left_eye[1] - right_eye[1], left_eye[0] - right_eye[0])))
+    else:
+        angle = 0.0
+    scale = min(1.0, max_side / max(w, h)) if max_side else 1.0
+    out_w, out_h = max(1, round(w * scale)), max(1, round(h * scale))
+    if angle == 0.0 and scale == 1.0:
+        crop = img[max(y, 0):y + h, max(x, 0):x + w]
+    else:
+        # 以人脸框中心为原点旋转并缩放，再平移使人脸框落在输出图像内
+        matrix = cv2.getRotationMatrix2D((x + w / 2, y + h / 2), angle, scale)
+        matrix[0, 2] += out_w / 2 - (x + w / 2)
+        matrix[1, 2] += out_h / 2 - (y + h / 2)
+        flags = cv2.INTER_AREA if angle == 0.0 else cv2.INTER_LINEAR
+        crop = cv2.warpAffine(img, matrix, (out_w, out_h), flags=flags, borderMode=cv2.BORDER_CONSTANT)
+    return crop[:, :, ::-1].astype(np.float32) / 255
+
+
+def detect_scaled(img, detect, max_side=DETECT_MAX_SIDE, align=True):
+    """分辨率自适应的检测：在缩小图上检测，人脸框映射回原图后从原图裁出对齐的人脸
+
+    img 为图片路径或 BGR 图像；detect(image, align) 返回 DeepFace.extract_faces 格式的结果。
+    图像本来就不大时直接在原图上检测，结果与不缩小时完全相同。
+    """
+    if isinstance(img, str):
+        decoded = open_image(img, max_side)
+        small = decoded.small()
+        if not decoded.scaled:
+            return detect(small, align)
+        load_full = decoded.full
+    else:
+        small = fit(img, max_side)
+        if small is img:
+            return detect(img, align)
+        load_full = lambda: img  # noqa: E731
+    faces = detect(small, False)  # 缩小图上的对齐结果用不到，改在原图上对齐
+    if not faces:
+        return faces
+    full = load_full()
+    sy, sx = full.shape[0] / small.shape[0], full.shape[1] / small.shape[1]
+    for face in faces:
+        face['facial_area'] = scale_area(face.get('facial_area', {}), sx, sy)
+        face['face'] = align_crop(full, face['facial_area'], align=align)
+    return faces
@@ -0,0 +1,602 @@
+import csv
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import time
+
+import numpy as np
+
+import face_ann
+import face_engine
+import face_quant
+
+INDEX_FOLDER = '.face_index'
+EMBEDDINGS_FILE = 'embeddings.npy'
+FACES_FILE = 'faces.tsv'
+META_FILE = 'meta.json'
+MANIFEST_FILE = 'manifest.json'
+IDENTITIES_FILE = 'identities.npz'
+FACE_FIELDS = ['path', 'identity', 'x', 'y', 'w', 'h']
+SEARCH_BLOCK = 65536  # 分块计算距离，限制单次查询的临时内存
+VERSION_MARK = '.v'  # 特征库目录是指向 <特征库目录>.v<版本> 的符号链接，改写时写出新版本再切换链接
+KEEP_VERSIONS = 2  # 保留的版本数（含当前版本），切换时正在读取旧版本的进程不会读到一半文件被删
+
+_loaded = {}
+
+
+def default_index_dir(db_path, model_name=face_engine.MODEL_NAME, detector_backend=face_engine.DETECTOR_BACKEND):
+    """特征库默认存放在数据库文件夹下的隐藏目录中"""
+    name = f"{model_name}_{detector_backend}".lower().replace('-', '')
+    return os.path.join(db_path, INDEX_FOLDER, name)
+
+
+class GalleryIndex:
+    """内存映射的人脸特征库：一个连续的 float32 特征矩阵加一张身份/路径表"""
+
+    def __init__(self, index_dir, embeddings, faces, meta, version_dir=None):
+        self.index_dir = index_dir
+        self.version_dir = version_dir or index_dir  # 实际读取的版本目录，切换后仍指向加载时的版本
+        self.embeddings = embeddings
+        self.faces = faces
+        self.meta = meta
+        self.db_path = meta.get('db_path', '')
+        self.loaded_mtime = None
+        self.ann = None  # 可选的倒排近似索引，见 build_ann
+        self.quantized = None  # 可选的常驻内存压缩特征，见 build_quantized
+        self._identities = None
+
+    def __len__(self):
+        return len(self.faces)
+
+    @property
+    def model_name(self):
+        return self.meta['model_name']
+
+    @property
+    def detector_backend(self):
+        return self.meta['detector_backend']
+
+    @classmethod
+    def load(cls, index_dir):
+        """以只读内存映射方式打开特征库，不会把整个矩阵读入内存
+
+        先解析出当前版本目录，所有文件都从同一版本读取，读取期间特征库被改写也不会混用两个版本。
+        """
+        version_dir = os.path.realpath(index_dir)
+        with open(os.path.join(version_dir, META_FILE), encoding='utf-8') as f:
+            meta = json.load(f)
+        embeddings = np.load(os.path.join(version_dir, EMBEDDINGS_FILE), mmap_mode='r')
+        with open(os.path.join(version_dir, FACES_FILE), encoding='utf-8', newline='') as f:
+            faces = list(csv.DictReader(f, delimiter='\t'))
+        if len(faces) != len(embeddings):
+            raise ValueError(f"特征库损坏: {index_dir}")
+        index = cls(index_dir, embeddings, faces, meta, version_dir)
+        ann = face_ann.IVFIndex.load(version_dir)
+        if ann is not None and ann.matches(len(index), meta.get('updated')):
+            index.ann = ann
+        quantized = face_quant.QuantizedGallery.load(version_dir)
+        if quantized is not None and quantized.matches(len(index), meta.get('updated')):
+            index.quantized = quantized
+        return index
+
+    @staticmethod
+    def write(index_dir, embeddings, faces, meta, manifest=None):
+        """写入特征库：写出一个新版本目录，再用一次 os.replace 把特征库目录（符号链接）切换到新版本
+
+        读者在任何时刻看到的都是某个完整的版本，不会看到写了一半的文件，也不会遇到特征库暂时不存在。
+        embeddings 可以是一个矩阵，也可以是按顺序拼接的若干分块（避免把整个特征库读入内存）。
+        """
+        index_dir = os.path.abspath(index_dir)
+        os.makedirs(os.path.dirname(index_dir), exist_ok=True)
+        tmp_dir = f"{index_dir}{VERSION_MARK}{time.time_ns():020d}-{os.getpid()}"
+        os.makedirs(tmp_dir)
+
+        blocks = [embeddings] if isinstance(embeddings, np.ndarray) else list(embeddings)
+        blocks = [block for block in blocks if len(block)]
+        dim = blocks[0].shape[1] if blocks else 0
+        out = np.lib.format.open_memmap(os.path.join(tmp_dir, EMBEDDINGS_FILE), mode='w+', dtype=np.float32,
+                                        shape=(sum(len(block) for block in blocks), dim))
+        prototypes = IdentityPrototypes.accumulate(faces, dim)
+        start = 0
+        for block in blocks:
+            out[start:start + len(block)] = block
+            prototypes.add(start, block)
+            start += len(block)
+        out.flush()
+        del out
+        prototypes.finish().save(tmp_dir)
+
+        with open(os.path.join(tmp_dir, FACES_FILE), 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=FACE_FIELDS, delimiter='\t', extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(faces)
+
+        meta = dict(meta, count=len(faces), dim=int(dim), updated=time.time())
+        with open(os.path.join(tmp_dir, META_FILE), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        if manifest is not None:
+            with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False)
+
+        _switch_version(index_dir, tmp_dir)
+        _loaded.pop(index_dir, None)
+
+    def load_manifest(self):
+        """读取文件清单 {相对路径: {size, mtime, hash}}，旧版特征库没有清单时返回空字典"""
+        manifest_path = os.path.join(self.version_dir, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return {}
+        with open(manifest_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def path_of(self, row):
+        """第 row 条记录对应图片的完整路径"""
+        return os.path.join(self.db_path, self.faces[row]['path'])
+
+    def result(self, row, distance):
+        """把一条命中记录整理为结果字典"""
+        return {'identity': self.faces[row]['identity'], 'path': self.path_of(row), 'distance': float(distance),
+                'row': int(row)}
+
+    def exact_topk(self, queries, k=5):
+        """精确检索：分块计算与全部特征的距离，返回按距离升序的 (距离, 行号) 两个 (m, k) 矩阵"""
+        k = min(k, len(self))
+        best_dist = np.full((len(queries), 0), np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(self), SEARCH_BLOCK):
+            block = self.embeddings[start:start + SEARCH_BLOCK]
+            dist = 1.0 - queries @ block.T
+            if dist.shape[1] > k:
+                part = np.argpartition(dist, k - 1, axis=1)[:, :k]
+                dist = np.take_along_axis(dist, part, axis=1)
+            else:
+                part = np.broadcast_to(np.arange(dist.shape[1]), dist.shape)
+            best_dist = np.concatenate([best_dist, dist], axis=1)
+            best_rows = np.concatenate([best_rows, part + start], axis=1)
+            if best_dist.shape[1] > k:
+                keep = np.argpartition(best_dist, k - 1, axis=1)[:, :k]
+                best_dist = np.take_along_axis(best_dist, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+
+        order = np.argsort(best_dist, axis=1)
+        return np.take_along_axis(best_dist, order, axis=1), np.take_along_axis(best_rows, order, axis=1)
+
+    def exact_distances(self, query, rows):
+        """查询与指定行原始 float32 特征的余弦距离"""
+        return 1.0 - np.asarray(self.embeddings[rows], dtype=np.float32) @ query
+
+    def approx_distances(self, query, rows):
+        """有压缩特征时用压缩特征计算距离，否则用原始特征"""
+        if self.quantized is None:
+            return self.exact_distances(query, rows)
+        return self.quantized.distances(query, rows)
+
+    def quantized_topk(self, queries, k=5):
+        """在常驻内存的压缩特征上全量扫描，返回每个查询的近似 top-k (距离, 行号)"""
+        all_dist, all_rows = [], []
+        for query in queries:
+            dist = self.quantized.distances(query)
+            top = min(k, len(dist))
+            part = np.argpartition(dist, top - 1)[:top] if len(dist) > top else np.arange(len(dist))
+            part = part[np.argsort(dist[part])]
+            all_dist.append(dist[part])
+            all_rows.append(part.astype(np.int64))
+        return all_dist, all_rows
+
+    def rerank(self, queries, candidates, k=5):
+        """用原始 float32 特征对候选行精确重排，只读取候选行（按行号排序后读取内存映射矩阵）"""
+        all_dist, all_rows = [], []
+        for query, rows in zip(queries, candidates):
+            rows = np.sort(rows)
+            dist = self.exact_distances(query, rows)
+            order = np.argsort(dist)[:k]
+            all_dist.append(dist[order])
+            all_rows.append(rows[order])
+        return all_dist, all_rows
+
+    def search(self, queries, k=5, threshold=None, nprobe=None, rerank=None):
+        """向量化 top-k 检索，queries 为 (d,) 或 (m, d) 的归一化特征，返回每个查询的结果列表
+
+        建有倒排近似索引时默认使用它，nprobe 为扫描的倒排表个数（None 用建索引时的默认值），
+        nprobe=0 不使用倒排索引。
+        建有压缩特征时用压缩特征计算距离，再用原始特征精确重排前 rerank 个候选（None 用默认值，0 不重排）。
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if len(self) == 0 or len(queries) == 0:
+            return [[] for _ in range(len(queries))]
+        if rerank is None:
+            rerank = self.quantized.rerank if self.quantized is not None else 0
+        shortlist = max(k, rerank) if self.quantized is not None else k
+        if self.ann is not None and nprobe != 0:
+            best_dist, best_rows = self.ann.search(self.approx_distances, queries, k=shortlist, nprobe=nprobe)
+        elif self.quantized is not None:
+            best_dist, best_rows = self.quantized_topk(queries, shortlist)
+        else:
+            best_dist, best_rows = self.exact_topk(queries, k)
+        if self.quantized is not None and rerank:
+            best_dist, best_rows = self.rerank(queries, best_rows, k)
+        elif shortlist > k:
+            best_dist, best_rows = [dist[:k] for dist in best_dist], [rows[:k] for rows in best_rows]
+        results = []
+        for dists, rows in zip(best_dist, best_rows):
+            results.append([self.result(row, dist) for row, dist in zip(rows, dists)
+                            if threshold is None or dist <= threshold])
+        return results
+
+    @property
+    def identities(self):
+        """每个身份的原型特征，旧版特征库没有保存时按需计算一次"""
+        if self._identities is None:
+            self._identities = IdentityPrototypes.load(self.version_dir)
+            if self._identities is None or self._identities.count != len(self):
+                prototypes = IdentityPrototypes.accumulate(self.faces, self.embeddings.shape[1])
+                for start in range(0, len(self), SEARCH_BLOCK):
+                    prototypes.add(start, self.embeddings[start:start + SEARCH_BLOCK])
+                self._identities = prototypes.finish()
+        return self._identities
+
+    def search_identities(self, queries, k=5, threshold=None, shortlist=20, images_per_identity=3):
+        """两阶段检索：先用身份原型选出最接近的 shortlist 个身份，再只对这些身份的图片逐张计算距离重排
+
+        返回每个查询按最佳图片距离排序的前 k 个身份，每项包含身份级分数 prototype_distance（与原型的距离）
+        和图片级分数 distance / path（该身份最接近的图片），images 为该身份最接近的若干张图片。
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        identities = self.identities
+        if len(self) == 0 or len(queries) == 0 or len(identities) == 0:
+            return [[] for _ in range(len(queries))]
+        shortlist = min(max(shortlist, k), len(identities))
+        proto_dist = 1.0 - queries @ identities.prototypes.T
+        if shortlist < len(identities):
+            candidates = np.argpartition(proto_dist, shortlist - 1, axis=1)[:, :shortlist]
+        else:
+            candidates = np.broadcast_to(np.arange(len(identities)), proto_dist.shape)
+
+        results = []
+        for query, dists, ids in zip(queries, proto_dist, candidates):
+            groups = [identities.rows_of(i) for i in ids]
+            rows = np.concatenate(groups)
+            order = np.argsort(rows)  # 顺序读取内存映射矩阵
+            image_dist = np.empty(len(rows), dtype=np.float32)
+            image_dist[order] = 1.0 - np.asarray(self.embeddings[rows[order]], dtype=np.float32) @ query
+            ranked, start = [], 0
+            for i, group in zip(ids, groups):
+                group_dist = image_dist[start:start + len(group)]
+                start += len(group)
+                best = np.argsort(group_dist)[:images_per_identity]
+                if len(best) == 0 or (threshold is not None and group_dist[best[0]] > threshold):
+                    continue
+                images = [self.result(group[j], group_dist[j]) for j in best]
+                ranked.append(dict(images[0], identity=str(identities.names[i]),
+                                   prototype_distance=float(dists[i]), images=images))
+            ranked.sort(key=lambda item: item['distance'])
+            results.append(ranked[:k])
+        return results
+
+
+class IdentityPrototypes:
+    """每个身份文件夹一个原型特征（该身份所有人脸特征的归一化均值），以及各身份对应的行号"""
+
+    def __init__(self, names, prototypes, offsets, rows):
+        self.names = names
+        self.prototypes = prototypes
+        self.offsets = offsets  # 第 i 个身份的行号为 rows[offsets[i]:offsets[i + 1]]
+        self.rows = rows
+        self.codes = None  # 累加阶段每一行所属身份的编号
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def count(self):
+        return len(self.rows)
+
+    def rows_of(self, i):
+        return self.rows[self.offsets[i]:self.offsets[i + 1]]
+
+    @classmethod
+    def accumulate(cls, faces, dim):
+        """开始按块累加特征，配合 add / finish 使用，不需要把整个特征矩阵读入内存"""
+        names, codes = np.unique([face['identity'] for face in faces], return_inverse=True)
+        acc = cls(names, np.zeros((len(names), dim), dtype=np.float64), None, None)
+        acc.codes = codes.reshape(-1)
+        return acc
+
+    def add(self, start, block):
+        """累加从第 start 行开始的一块特征"""
+        if len(block) == 0:
+            return
+        codes = self.codes[start:start + len(block)]
+        order = np.argsort(codes, kind='stable')
+        codes = codes[order]
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        self.prototypes[codes[starts]] += np.add.reduceat(np.asarray(block, dtype=np.float64)[order], starts, axis=0)
+
+    def finish(self):
+        norms = np.linalg.norm(self.prototypes, axis=1, keepdims=True)
+        prototypes = (self.prototypes / np.maximum(norms, 1e-10)).astype(np.float32)
+        rows = np.argsort(self.codes, kind='stable').astype(np.int64)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(self.codes, minlength=len(self.names)))])
+        return IdentityPrototypes(self.names, prototypes, offsets.astype(np.int64), rows)
+
+    def save(self, index_dir):
+        np.savez(os.path.join(index_dir, IDENTITIES_FILE), names=self.names, prototypes=self.prototypes,
+                 offsets=self.offsets, rows=self.rows)
+
+    @classmethod
+    def load(cls, index_dir):
+        """读取身份原型，不存在时返回 None"""
+        path = os.path.join(index_dir, IDENTITIES_FILE)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return cls(data['names'], data['prototypes'], data['offsets'], data['rows'])
+
+
+def _versions(index_dir):
+    """特征库的全部版本目录，按写入时间排序"""
+    parent, name = os.path.split(index_dir)
+    prefix = f"{name}{VERSION_MARK}"
+    return sorted(os.path.join(parent, entry) for entry in os.listdir(parent)
+                  if entry.startswith(prefix) and os.path.isdir(os.path.join(parent, entry)))
+
+
+def _switch_version(index_dir, version_dir):
+    """把特征库目录切换到 version_dir 并清理更早的版本
+
+    不支持符号链接的系统（如没有相应权限的 Windows）退回到两次改名，中间有很短的时间特征库不存在。
+    """
+    link_path = f"{index_dir}.link{os.getpid()}"
+    if os.path.lexists(link_path):  # 上次写入中途退出留下的
+        os.remove(link_path)
+    try:
+        os.symlink(os.path.basename(version_dir), link_path)  # 相对路径，数据库文件夹可以整体移动
+    except (OSError, NotImplementedError):
+        old_dir = f"{index_dir}.old{os.getpid()}"
+        if os.path.exists(index_dir):
+            os.replace(index_dir, old_dir)
+        os.replace(version_dir, index_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        return
+    if os.path.isdir(index_dir) and not os.path.islink(index_dir):
+        # 旧版特征库是普通目录，先改名为最早的版本（只在第一次改写时有很短的空档）
+        os.replace(index_dir, f"{index_dir}{VERSION_MARK}{0:020d}-{os.getpid()}")
+    os.replace(link_path, index_dir)
+    current = os.path.basename(version_dir)
+    older = [path for path in _versions(index_dir) if os.path.basename(path) < current]
+    for path in older[:max(len(older) - (KEEP_VERSIONS - 1), 0)]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _face_record(rel_path, face, db_path):
+    area = face.get('facial_area', {})
+    return {'path': rel_path, 'identity': face_engine.identity_of(os.path.join(db_path, rel_path)),
+            'x': area.get('x', 0), 'y': area.get('y', 0), 'w': area.get('w', 0), 'h': area.get('h', 0)}
+
+
+def _base_meta(db_path, model_name, detector_backend):
+    return {'db_path': os.path.abspath(db_path), 'model_name': model_name, 'detector_backend': detector_backend,
+            'normalization': face_engine.NORMALIZATION}
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """计算文件内容的 SHA-1"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_entry(path, content_hash=None):
+    """文件清单中的一项：大小、修改时间和内容哈希"""
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': content_hash or file_hash(path)}
+
+
+def scan_changes(db_path, manifest):
+    """对比文件清单与数据库现状，返回 (新清单, 新增, 修改, 删除, 未变)
+
+    大小和修改时间都没变的文件直接视为未变；否则再比较内容哈希，只是被 touch 过的文件不会重新提取特征。
+    """
+    new_manifest, added, changed, unchanged = {}, [], [], []
+    for rel_path in face_engine.list_images(db_path):
+        full_path = os.path.join(db_path, rel_path)
+        old = manifest.get(rel_path)
+        stat = os.stat(full_path)
+        if old and old['size'] == stat.st_size and old['mtime'] == stat.st_mtime:
+            new_manifest[rel_path] = old
+            unchanged.append(rel_path)
+            continue
+        entry = file_entry(full_path)
+        new_manifest[rel_path] = entry
+        if old is None:
+            added.append(rel_path)
+        elif old['hash'] != entry['hash']:
+            changed.append(rel_path)
+        else:
+            unchanged.append(rel_path)
+    removed = [rel_path for rel_path in manifest if rel_path not in new_manifest]
+    return new_manifest, added, changed, removed, unchanged
+
+
+def embed_images(db_path, rel_paths, model_name=face_engine.MODEL_NAME, detector_backend=face_engine.DETECTOR_BACKEND,
+                 batch_size=32, silent=False, on_progress=None):
+    """批量提取图片中的人脸特征，返回 (人脸记录, 特征矩阵, 失败的图片)"""
+
+    def progress(done, total):
+        if not silent and done % 100 == 0:
+            print(f"已处理 {done}/{total} 张图片")
+        if on_progress is not None:
+            on_progress(done, total)
+
+    owners, areas, matrix, failed = face_engine.represent_batch(
+        [os.path.join(db_path, rel_path) for rel_path in rel_paths], model_name=model_name,
+        detector_backend=detector_backend, batch_size=batch_size, on_progress=progress)
+    if not silent:
+        for i, e in failed:
+            print(f"跳过 {rel_paths[i]}: {str(e)}")
+    records = [_face_record(rel_paths[i], {'facial_area': area}, db_path) for i, area in zip(owners, areas)]
+    return records, matrix, [rel_paths[i] for i, e in failed]
+
+
+def update_index(db_path, model_name=face_engine.MODEL_NAME, detector_backend=face_engine.DETECTOR_BACKEND,
+                 index_dir=None, rebuild=False, silent=False, on_progress=None):
+    """增量更新特征库：只为新增或内容变化的图片提取特征，并删除已移除图片的记录
+
+    on_progress(已处理, 总数) 在每张图片处理后调用，抛出异常即可中止（特征库不会被改写）。返回 (特征库, 统计信息)。
+    """
+    index_dir = index_dir or default_index_dir(db_path, model_name, detector_backend)
+    old_index = None
+    if not rebuild and os.path.exists(os.path.join(index_dir, META_FILE)):
+        old_index = GalleryIndex.load(index_dir)
+        if old_index.model_name != model_name or old_index.detector_backend != detector_backend:
+            old_index = None
+    manifest = old_index.load_manifest() if old_index is not None else {}
+
+    new_manifest, added, changed, removed, unchanged = scan_changes(db_path, manifest)
+    stats = {'added': len(added), 'changed': len(changed), 'removed': len(removed), 'unchanged': len(unchanged)}
+    if old_index is not None and not (added or changed or removed) and new_manifest == manifest:
+        return old_index, stats
+
+    records, matrix, failed = embed_images(db_path, added + changed, model_name, detector_backend, silent=silent,
+                                           on_progress=on_progress)
+    for rel_path in failed:
+        new_manifest.pop(rel_path, None)  # 失败的图片不记入清单，下次运行时重试
+    stats['failed'] = len(failed)
+
+    faces, blocks = [], []
+    if old_index is not None:
+        # 按块复制保留的行，不需要把旧特征库整体读入内存
+        stale = set(changed) | set(removed)
+        keep = np.array([face['path'] not in stale for face in old_index.faces], dtype=bool)
+        faces = [face for face, kept in zip(old_index.faces, keep) if kept]
+        for start in range(0, len(keep), SEARCH_BLOCK):
+            blocks.append(old_index.embeddings[start:start + SEARCH_BLOCK][keep[start:start + SEARCH_BLOCK]])
+    faces.extend(records)
+    blocks.append(matrix)
+
+    GalleryIndex.write(index_dir, blocks, faces, _base_meta(db_path, model_name, detector_backend),
+                       manifest=new_manifest)
+    index = GalleryIndex.load(index_dir)
+    if old_index is not None:
+        carry_over(index, old_index)
+    return index, stats
+
+
+def carry_over(index, old_index):
+    """特征库改写后，按旧特征库的设置重新生成倒排索引和压缩特征"""
+    if old_index.ann is not None:
+        # 沿用已训练的聚类中心，只把特征重新分配到倒排表
+        build_ann(index, centroids=old_index.ann.centroids, nprobe=old_index.ann.nprobe)
+    if old_index.quantized is not None:
+        # 同样沿用已训练的码本，只重新编码
+        build_quantized(index, old_index.quantized.codec.name, codec=old_index.quantized.codec,
+                        rerank=old_index.quantized.rerank)
+
+
+def build_ann(index, nlist=None, nprobe=face_ann.DEFAULT_NPROBE, centroids=None, train_size=None):
+    """为特征库建立倒排近似索引并保存到特征库目录，之后的检索自动使用"""
+    index.ann = face_ann.IVFIndex.build(index.embeddings, nlist=nlist, train_size=train_size, centroids=centroids,
+                                        gallery_updated=index.meta.get('updated'), nprobe=nprobe)
+    index.ann.save(index.version_dir)
+    return index.ann
+
+
+def build_quantized(index, fmt, pq_m=64, rerank=face_quant.DEFAULT_RERANK, codec=None):
+    """为特征库生成常驻内存的压缩特征（float16 / int8 / pq）并保存到特征库目录，之后的检索自动使用"""
+    index.quantized = face_quant.QuantizedGallery.build(index.embeddings, fmt, codec=codec, pq_m=pq_m,
+                                                        gallery_updated=index.meta.get('updated'), rerank=rerank)
+    index.quantized.save(index.version_dir)
+    return index.quantized
+
+
+def build_index(db_path, model_name=face_engine.MODEL_NAME, detector_backend=face_engine.DETECTOR_BACKEND,
+                index_dir=None, silent=False, on_progress=None):
+    """对数据库中的所有图片提取特征并建立特征库"""
+    index, stats = update_index(db_path, model_name, detector_backend, index_dir=index_dir, rebuild=True,
+                                silent=silent, on_progress=on_progress)
+    return index
+
+
+def import_deepface_pickle(db_path, pkl_path, model_name=face_engine.MODEL_NAME,
+                           detector_backend=face_engine.DETECTOR_BACKEND, index_dir=None):
+    """从 DeepFace 生成的 ds_model_*.pkl 导入特征，免去重新提取"""
+    index_dir = index_dir or default_index_dir(db_path, model_name, detector_backend)
+    with open(pkl_path, 'rb') as f:
+        representations = pickle.load(f)
+
+    known = set(face_engine.list_images(db_path))
+    faces, embeddings = [], []
+    for rep in representations:
+        # pkl 中保存的是生成时的绝对路径，只保留 "身份/文件名" 两级与当前数据库对应
+        parts = rep['identity'].replace('\\', '/').split('/')
+        rel_path = '/'.join(parts[-2:])
+        if rel_path not in known or rep.get('embedding') is None:
+            continue
+        faces.append({'path': rel_path, 'identity': face_engine.identity_of(os.path.join(db_path, rel_path)),
+                      'x': rep.get('target_x', 0), 'y': rep.get('target_y', 0), 'w': rep.get('target_w', 0),
+                      'h': rep.get('target_h', 0)})
+        embeddings.append(rep['embedding'])
+
+    matrix = face_engine.l2_normalize(embeddings) if embeddings else np.zeros((0, 0), dtype=np.float32)
+    manifest = {rel_path: file_entry(os.path.join(db_path, rel_path)) for rel_path in {face['path'] for face in faces}}
+    GalleryIndex.write(index_dir, matrix, faces, _base_meta(db_path, model_name, detector_backend),
+                       manifest=manifest)
+    return GalleryIndex.load(index_dir)
+
+
+def _index_mtime(index_dir):
+    version_dir = os.path.realpath(index_dir)
+    paths = [os.path.join(version_dir, name) for name in (META_FILE, face_ann.IVF_FILE, face_quant.QUANTIZED_FILE)]
+    return max(os.path.getmtime(path) for path in paths if os.path.exists(path))
+
+
+def open_index(db_path, model_name=face_engine.MODEL_NAME, detector_backend=face_engine.DETECTOR_BACKEND,
+               build=True, on_progress=None):
+    """打开数据库对应的特征库（进程内缓存），不存在时按需建立（on_progress 见 update_index）"""
+    if not os.path.isdir(db_path):
+        raise FileNotFoundError(f"数据库文件夹不存在: {db_path}")
+    index_dir = os.path.abspath(default_index_dir(db_path, model_name, detector_backend))
+    meta_path = os.path.join(index_dir, META_FILE)
+    cached = _loaded.get(index_dir)
+    # 长期运行的进程（如模型服务）在特征库或倒排索引被其它进程更新后自动重新加载
+    if cached is not None and os.path.exists(meta_path) and _index_mtime(index_dir) == cached.loaded_mtime:
+        return cached
+    if os.path.exists(meta_path):
+        index = GalleryIndex.load(index_dir)
+    elif build:
+        index = build_index(db_path, model_name, detector_backend, index_dir=index_dir, on_progress=on_progress)
+    else:
+        raise FileNotFoundError(f"特征库不存在: {index_dir}")
+    index.db_path = os.path.abspath(db_path)
+    index.loaded_mtime = _index_mtime(index_dir)
+    _loaded[index_dir] = index
+    return index
+
+
+def find(img, db_path, k=5, model_name=face_engine.MODEL_NAME, detector_backend=face_engine.DETECTOR_BACKEND,
+         threshold=None, probe_detector=None, nprobe=None, shortlist=None, rerank=None):
+    """在数据库中检索图像中的每张人脸，返回与检测结果一一对应的 (face, results) 列表
+
+    detector_backend 决定使用哪个特征库，probe_detector 为待识别图像所用的检测器（默认相同），
+    nprobe、rerank 见 GalleryIndex.search；指定 shortlist 时按身份两阶段检索（见 GalleryIndex.search_identities），
+    每个结果是一个身份。
+    """
+    index = open_index(db_path, model_name, detector_backend)
+    if threshold is None:
+        threshold = face_engine.find_threshold(model_name, probe_detector or detector_backend)
+    faces, embeddings = face_engine.represent(img, model_name=model_name,
+                                              detector_backend=probe_detector or detector_backend)
+    if not faces:
+        return []
+    return list(zip(faces, search_matches(index, embeddings, k, threshold, nprobe, shortlist, rerank)))
+
+
+def search_matches(index, embeddings, k=5, threshold=None, nprobe=None, shortlist=None, rerank=None):
+    """find 的检索部分，本进程和模型服务共用，保证两边对同一参数给出相同的结果"""
+    if shortlist:
+        return index.search_identities(embeddings, k=k, threshold=threshold, shortlist=shortlist)
+    return index.search(embeddings, k=k, threshold=threshold, nprobe=nprobe, rerank=rerank)
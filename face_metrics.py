@@ -0,0 +1,185 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+WINDOW = 512  # 每个阶段保留最近多少次耗时用于计算分位数
+FPS_WINDOW = 2.0  # 按最近多少秒内显示的帧数计算 FPS
+QUANTILES = (0.5, 0.9, 0.99)
+OVERLAY_STAGES = ('detect', 'embed', 'search', 'track', 'draw')
+
+# 图形界面没有命令行参数，通过环境变量开启导出和叠加显示
+ENV_PORT = int(os.environ.get('FACE_METRICS_PORT', 0)) or None
+ENV_JSONL = os.environ.get('FACE_METRICS_JSONL') or None
+ENV_OVERLAY = os.environ.get('FACE_METRICS_OVERLAY', '').lower() in ('1', 'on', 'true', 'yes')
+
+
+class Metrics:
+    """热路径计时和计数
+
+    span 记录检测、特征提取、检索、绘制等阶段的耗时，inc 累加帧数、人脸数等计数，frame 标记一帧显示完成用于计算 FPS。
+    所有方法线程安全，开销只有一次计时和一次加锁，可以常开。
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.stages = {}  # 阶段名 -> {'count', 'sum', 'last', 'recent'}
+        self.started = time.time()
+        self._frames = deque()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name, seconds):
+        """记录某阶段的一次耗时（秒）"""
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = {'count': 0, 'sum': 0.0, 'last': 0.0, 'recent': deque(maxlen=WINDOW)}
+            stage['count'] += 1
+            stage['sum'] += seconds
+            stage['last'] = seconds
+            stage['recent'].append(seconds)
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def frame(self):
+        """标记一帧显示完成"""
+        now = time.perf_counter()
+        with self._lock:
+            self.counters['frames_rendered'] = self.counters.get('frames_rendered', 0) + 1
+            self._frames.append(now)
+            while self._frames and now - self._frames[0] > FPS_WINDOW:
+                self._frames.popleft()
+
+    @property
+    def fps(self):
+        with self._lock:
+            if len(self._frames) < 2:
+                return 0.0
+            return (len(self._frames) - 1) / max(self._frames[-1] - self._frames[0], 1e-9)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.stages.clear()
+            self._frames.clear()
+            self.started = time.time()
+
+    def snapshot(self):
+        """当前所有计数和各阶段耗时统计（毫秒）"""
+        fps = self.fps
+        with self._lock:
+            stages = {}
+            for name, stage in self.stages.items():
+                recent = np.asarray(stage['recent']) * 1000
+                stages[name] = {'count': stage['count'], 'total_ms': stage['sum'] * 1000,
+                                'mean_ms': stage['sum'] * 1000 / stage['count'], 'last_ms': stage['last'] * 1000,
+                                **{f"p{int(q * 100)}_ms": float(np.quantile(recent, q)) for q in QUANTILES}}
+            return {'time': time.time(), 'uptime': time.time() - self.started, 'fps': fps,
+                    'counters': dict(self.counters), 'stages': stages}
+
+    def overlay_text(self):
+        """叠加在画面上的一行：FPS 和各阶段最近窗口内的中位耗时"""
+        snapshot = self.snapshot()
+        parts = [f"FPS {snapshot['fps']:.1f}"]
+        for name in OVERLAY_STAGES:
+            if name in snapshot['stages']:
+                parts.append(f"{name} {snapshot['stages'][name]['p50_ms']:.1f}")
+        return "  ".join(parts) + " ms"
+
+    def prometheus_text(self):
+        """Prometheus 文本格式"""
+        snapshot = self.snapshot()
+        lines = ["# HELP face_stage_seconds 各处理阶段的耗时（最近窗口内的分位数）",
+                 "# TYPE face_stage_seconds summary"]
+        for name, stats in sorted(snapshot['stages'].items()):
+            for q in QUANTILES:
+                value = stats[f"p{int(q * 100)}_ms"] / 1000
+                lines.append(f'face_stage_seconds{{stage="{name}",quantile="{q}"}} {value:.6f}')
+            lines.append(f'face_stage_seconds_sum{{stage="{name}"}} {stats["total_ms"] / 1000:.6f}')
+            lines.append(f'face_stage_seconds_count{{stage="{name}"}} {stats["count"]}')
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append(f"# TYPE face_{name}_total counter")
+            lines.append(f"face_{name}_total {value}")
+        lines.append("# TYPE face_fps gauge")
+        lines.append(f"face_fps {snapshot['fps']:.3f}")
+        return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0].strip('/') in ('', 'metrics'):
+            body, content_type = self.server.metrics.prometheus_text(), 'text/plain; version=0.0.4; charset=utf-8'
+        elif self.path.strip('/') == 'metrics.json':
+            body, content_type = json.dumps(self.server.metrics.snapshot(), ensure_ascii=False), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsExporter:
+    """在后台线程中导出指标：本地端口上的 Prometheus 接口（/metrics），以及定期追加到 JSON Lines 文件"""
+
+    def __init__(self, metrics, port=None, jsonl_path=None, interval=5.0, host='127.0.0.1'):
+        self.metrics = metrics
+        self.port = port
+        self.jsonl_path = jsonl_path
+        self.interval = interval
+        self.host = host
+        self._server = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.port:
+            self._server = ThreadingHTTPServer((self.host, self.port), _MetricsHandler)
+            self._server.daemon_threads = True
+            self._server.metrics = self.metrics
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        if self.jsonl_path:
+            self._thread = threading.Thread(target=self._write_loop, daemon=True)
+            self._thread.start()
+        return self
+
+    def _write_line(self):
+        with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(self.metrics.snapshot(), ensure_ascii=False) + "\n")
+
+    def _write_loop(self):
+        while not self._stop.wait(self.interval):
+            self._write_line()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._write_line()  # 退出前写入最终结果
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+metrics = Metrics()
@@ -0,0 +1,231 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+import face_stream
+import face_video
+from face_metrics import metrics
+
+
+class SourceReader:
+    """一路视频源的采集线程：只保留最新一帧，被新帧覆盖的旧帧计为丢弃
+
+    视频文件和图片序列按自身帧率放慢读取，模拟实时摄像头。
+    """
+
+    def __init__(self, source_id, source, target_fps):
+        self.source_id = source_id
+        self.source = source
+        self.target_fps = target_fps
+        self.capture = face_video.open_source(source)
+        self.paced = os.path.exists(source)  # 本地文件按帧率放慢，摄像头和网络流本身就是实时的
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 25.0
+        self.latest = None  # (序号, 采集时间, 帧)
+        self.finished = False
+        self.next_due = 0.0  # 下一次允许送去识别的时间
+        self.last_taken = 0  # 最近一次送去识别的帧序号
+        self.stats = {'frames_read': 0, 'frames_dropped': 0, 'frames_shed': 0, 'frames_analysed': 0, 'faces': 0,
+                      'matched': 0, 'latency_ms': 0.0, 'analysed_fps': 0.0}
+        self._first_analysed = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._read_loop, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=2)
+        self.capture.release()
+
+    def _read_loop(self):
+        seq, started = 0, time.perf_counter()
+        while not self._stop.is_set():
+            ret, frame = self.capture.read()
+            if not ret:
+                break
+            seq += 1
+            if self.paced:
+                delay = started + seq / self.fps - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            with self._lock:
+                if self.latest is not None and self.latest[0] > self.last_taken:
+                    self.stats['frames_dropped'] += 1
+                    metrics.inc('frames_dropped')
+                self.latest = (seq, time.perf_counter(), frame)
+                self.stats['frames_read'] += 1
+            metrics.inc('frames_read')
+        self.finished = True
+
+    def has_new(self):
+        with self._lock:
+            return self.latest is not None and self.latest[0] > self.last_taken
+
+    def shed(self):
+        """记录一帧因过期被丢弃"""
+        with self._lock:
+            self.stats['frames_shed'] += 1
+        metrics.inc('frames_shed')
+
+    def take(self):
+        """取出尚未处理过的最新一帧，没有新帧时返回 None"""
+        with self._lock:
+            if self.latest is None or self.latest[0] <= self.last_taken:
+                return None
+            self.last_taken = self.latest[0]
+            return self.latest
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def record(self, captured_at, results, ema=0.1):
+        now = time.perf_counter()
+        latency = (now - captured_at) * 1000
+        with self._lock:
+            stats = self.stats
+            stats['frames_analysed'] += 1
+            stats['faces'] += len(results)
+            stats['matched'] += sum(1 for result in results if result['distance'] is not None)
+            previous = stats['latency_ms']
+            stats['latency_ms'] = latency if previous == 0 else (1 - ema) * previous + ema * latency
+            if self._first_analysed is None:
+                self._first_analysed = now
+            elif now > self._first_analysed:
+                stats['analysed_fps'] = (stats['frames_analysed'] - 1) / (now - self._first_analysed)
+
+
+class MultiStreamScheduler:
+    """多路视频源共用一套检测器、特征提取模型和特征库
+
+    每一轮从到期（按各自的目标帧率）且有新帧的视频源中各取一帧，从上一轮之后的下一路开始轮询，保证公平；
+    各帧的检测并行执行，所有人脸合成一批提取特征并检索。过载时：
+    - 送去识别时已超过 max_age 秒的帧直接丢弃（计为 shed），不再浪费算力；
+    - 一轮的耗时超过目标间隔时，所有视频源的识别间隔按同一比例拉长，各路仍平分算力。
+    """
+
+    def __init__(self, sources, db_path, target_fps=5.0, max_age=1.0, workers=None,
+                 detector_backend=face_stream.STREAM_DETECTOR, threshold=None, ema=0.2):
+        fps_list = target_fps if isinstance(target_fps, (list, tuple)) else [target_fps] * len(sources)
+        if len(fps_list) != len(sources):
+            raise ValueError("目标帧率的个数必须与视频源个数一致")
+        self.recognizer = face_stream.StreamRecognizer(db_path, detector_backend=detector_backend,
+                                                       threshold=threshold)
+        self.readers = [SourceReader(i, source, fps) for i, (source, fps) in enumerate(zip(sources, fps_list))]
+        self.max_age = max_age
+        self.workers = workers or len(sources)
+        self.ema = ema
+        self.slowdown = 1.0  # 过载时识别间隔的放大倍数
+        self.round_ms = 0.0
+        self.rounds = 0
+        self._offset = 0
+
+    def start(self):
+        for reader in self.readers:
+            reader.start()
+        return self
+
+    def stop(self):
+        for reader in self.readers:
+            reader.stop()
+
+    @property
+    def finished(self):
+        return all(reader.finished and not reader.has_new() for reader in self.readers)
+
+    def _due_frames(self):
+        """按轮询顺序收集本轮要处理的帧"""
+        now = time.perf_counter()
+        order = self.readers[self._offset:] + self.readers[:self._offset]
+        self._offset = (self._offset + 1) % len(self.readers)
+        picked = []
+        for reader in order:
+            if now < reader.next_due:
+                continue
+            item = reader.take()
+            if item is None:
+                continue
+            seq, captured_at, frame = item
+            if now - captured_at > self.max_age:
+                reader.shed()
+                continue
+            reader.next_due = now + self.slowdown / reader.target_fps
+            picked.append((reader, seq, captured_at, frame))
+        return picked
+
+    def _adapt(self, seconds):
+        """根据本轮耗时调整过载放大倍数：一轮耗时应不超过最快一路的识别间隔"""
+        ms = seconds * 1000
+        self.round_ms = ms if self.round_ms == 0 else (1 - self.ema) * self.round_ms + self.ema * ms
+        budget = 1000 / max(reader.target_fps for reader in self.readers)
+        self.slowdown = max(1.0, self.round_ms / budget)
+
+    def _detect(self, item):
+        try:
+            return self.recognizer.detect(item[3])
+        except Exception:
+            metrics.inc('errors')
+            return []
+
+    def run_round(self, pool):
+        """处理一轮，返回 [(视频源编号, 序号, 帧, 结果)]；没有到期的帧时返回空列表"""
+        picked = self._due_frames()
+        if not picked:
+            return []
+        start = time.perf_counter()
+        detections = list(pool.map(self._detect, picked))
+        faces = [face for detected in detections for face in detected]
+        results = self.recognizer.identify(faces) if faces else []
+        output, position = [], 0
+        for (reader, seq, captured_at, frame), detected in zip(picked, detections):
+            frame_results = results[position:position + len(detected)]
+            position += len(detected)
+            reader.record(captured_at, frame_results)
+            output.append((reader.source_id, seq, frame, frame_results))
+        metrics.inc('frames_analysed', len(picked))
+        self._adapt(time.perf_counter() - start)
+        self.rounds += 1
+        return output
+
+    def run(self, on_result=None, should_stop=None, idle_sleep=0.002):
+        """主循环，直到所有视频源结束或 should_stop() 返回 True"""
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while not (should_stop and should_stop()) and not self.finished:
+                output = self.run_round(pool)
+                if not output:
+                    time.sleep(idle_sleep)
+                    continue
+                if on_result is not None:
+                    for source_id, seq, frame, results in output:
+                        on_result(source_id, seq, frame, results)
+
+    def summary(self):
+        """各视频源的统计信息"""
+        rows = [dict(reader.snapshot(), source=reader.source, target_fps=reader.target_fps) for reader in self.readers]
+        return {'sources': rows, 'rounds': self.rounds, 'round_ms': self.round_ms, 'slowdown': self.slowdown}
+
+
+def result_record(source_id, source, seq, results):
+    """一路视频源一帧的输出记录"""
+    return {'source': source_id, 'uri': source, 'frame': seq, 'time': time.time(),
+            'faces': [{'box': list(map(int, result['rect'])), 'identity': result['identity'],
+                       'distance': result['distance']} for result in results]}
+
+
+def format_summary(summary):
+    """把统计信息格式化为多行文本"""
+    lines = [f"{'#':>3} {'目标fps':>8} {'实际fps':>8} {'采集':>7} {'识别':>7} {'覆盖丢弃':>8} {'过期丢弃':>8} "
+             f"{'延迟(ms)':>9}  视频源"]
+    for i, row in enumerate(summary['sources']):
+        lines.append(f"{i:>3} {row['target_fps']:>8.1f} {row['analysed_fps']:>8.1f} {row['frames_read']:>7} "
+                     f"{row['frames_analysed']:>7} {row['frames_dropped']:>8} {row['frames_shed']:>8} "
+                     f"{row['latency_ms']:>9.0f}  {row['source']}")
+    lines.append(f"共 {summary['rounds']} 轮，每轮 {summary['round_ms']:.0f} ms，过载放大倍数 {summary['slowdown']:.2f}")
+    return "\n".join(lines)
+
@@ -0,0 +1,157 @@
+import queue
+import threading
+import time
+
+import face_stream
+from face_metrics import metrics
+
+
+class FramePacket:
+    """采集到的一帧及其序号和采集时间"""
+
+    def __init__(self, seq, frame):
+        self.seq = seq
+        self.captured_at = time.perf_counter()
+        self.frame = frame
+
+
+class ResultPacket:
+    """一帧的识别结果"""
+
+    def __init__(self, seq, captured_at, results):
+        self.seq = seq
+        self.captured_at = captured_at
+        self.finished_at = time.perf_counter()
+        self.results = results
+
+
+def put_latest(q, item):
+    """向有界队列放入元素，队列满时丢弃最旧的一个，返回丢弃的数量"""
+    dropped = 0
+    while True:
+        try:
+            q.put_nowait(item)
+            return dropped
+        except queue.Full:
+            try:
+                q.get_nowait()
+                dropped += 1
+            except queue.Empty:
+                pass
+
+
+class StreamPipeline:
+    """采集 / 推理 / 绘制流水线
+
+    采集线程不停读取摄像头并只保留最新一帧用于显示；送去推理的帧放入有界队列，满了就丢弃旧帧；
+    推理线程池并行识别；绘制端总是显示最新一帧并叠加最新的识别结果，显示帧率不再受推理速度限制。
+    """
+
+    def __init__(self, capture, analyze, workers=2, queue_size=2, ema=0.1):
+        self.capture = capture
+        self.analyze = analyze
+        self.workers = workers
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.ema = ema
+        self.latest_frame = None
+        self.latest_result = None
+        self.finished = False
+        self.stats = {"frames_read": 0, "frames_dropped": 0, "frames_analysed": 0, "frames_rendered": 0,
+                      "errors": 0, "inference_ms": 0.0, "latency_ms": 0.0}
+        self._new_frame = threading.Condition()
+        self._lock = threading.Lock()  # 保护 stats 和 latest_result
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self._threads = [threading.Thread(target=self._capture_loop, daemon=True)]
+        self._threads += [threading.Thread(target=self._infer_loop, daemon=True) for _ in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self._new_frame:
+            self._new_frame.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=2)
+
+    def _average(self, key, value):
+        self.stats[key] = value if self.stats[key] == 0 else (1 - self.ema) * self.stats[key] + self.ema * value
+
+    def _capture_loop(self):
+        seq = 0
+        while not self._stop.is_set():
+            ret, frame = self.capture.read()
+            if not ret:
+                break
+            seq += 1
+            packet = FramePacket(seq, frame)
+            with self._new_frame:
+                self.latest_frame = packet
+                self._new_frame.notify_all()
+            dropped = put_latest(self.frames, packet)
+            with self._lock:
+                self.stats["frames_read"] += 1
+                self.stats["frames_dropped"] += dropped
+            metrics.inc('frames_read')
+            metrics.inc('frames_dropped', dropped)
+        self.finished = True
+        with self._new_frame:
+            self._new_frame.notify_all()
+
+    def _infer_loop(self):
+        while not self._stop.is_set():
+            try:
+                packet = self.frames.get(timeout=0.1)
+            except queue.Empty:
+                if self.finished:
+                    break
+                continue
+            with self._lock:
+                stale = self.latest_result is not None and packet.seq <= self.latest_result.seq
+                if stale:
+                    self.stats["frames_dropped"] += 1  # 已经有更新的结果，这一帧过时了
+            if stale:
+                metrics.inc('frames_dropped')
+                continue
+            started = time.perf_counter()
+            try:
+                results = self.analyze(packet.frame)
+            except Exception:
+                with self._lock:
+                    self.stats["errors"] += 1
+                metrics.inc('errors')
+                results = []
+            metrics.inc('frames_analysed')
+            result = ResultPacket(packet.seq, packet.captured_at, results)
+            with self._lock:
+                self.stats["frames_analysed"] += 1
+                self._average("inference_ms", (result.finished_at - started) * 1000)
+                if self.latest_result is None or result.seq > self.latest_result.seq:
+                    self.latest_result = result
+
+    def render(self, timeout=1.0, last_seq=None):
+        """等待新的一帧并绘制最新结果，返回 (序号, 图像)；采集结束或超时返回 (None, None)
+
+        端到端延迟 = 显示时刻 - 所用识别结果对应帧的采集时刻，即画面上的标注落后真实场景多久。
+        """
+        with self._new_frame:
+            self._new_frame.wait_for(lambda: self._stop.is_set() or self.finished or (
+                    self.latest_frame is not None and self.latest_frame.seq != last_seq), timeout=timeout)
+            packet = self.latest_frame
+        if packet is None or packet.seq == last_seq:
+            return None, None
+
+        frame = packet.frame.copy()
+        with self._lock:
+            result = self.latest_result
+            if result is not None:
+                self._average("latency_ms", (time.perf_counter() - result.captured_at) * 1000)
+            self.stats["frames_rendered"] += 1
+        if result is not None:
+            face_stream.draw_results(frame, result.results)
+        text = f"latency {self.stats['latency_ms']:.0f} ms  infer {self.stats['inference_ms']:.0f} ms"
+        face_stream.draw_status(frame, text)
+        return packet.seq, frame
@@ -0,0 +1,97 @@
+import importlib.abc
+import importlib.util
+import sys
+import time
+from contextlib import contextmanager
+
+# 需要单独统计导入耗时的重量级依赖
+TRACKED_MODULES = ('numpy', 'cv2', 'PIL', 'pandas', 'tensorflow', 'keras', 'tf_keras', 'deepface', 'retinaface')
+
+
+class _TimingLoader:
+    """包装模块加载器，记录模块执行（即导入）耗时"""
+
+    def __init__(self, loader, name, finder):
+        self._loader = loader
+        self._name = name
+        self._finder = finder
+
+    def __getattr__(self, item):
+        return getattr(self._loader, item)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        self._finder.active.add(self._name)
+        try:
+            with self._finder.profiler.span(f"import {self._name}"):
+                self._loader.exec_module(module)
+        finally:
+            self._finder.active.discard(self._name)
+
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+    """拦截被跟踪模块的首次导入"""
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.active = set()  # 正在执行导入的模块（如 cv2 在初始化过程中会重新导入自身）
+        self._resolving = set()
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname not in TRACKED_MODULES or fullname in self._resolving or fullname in self.active:
+            return None
+        self._resolving.add(fullname)
+        try:
+            spec = importlib.util.find_spec(fullname)
+        finally:
+            self._resolving.discard(fullname)
+        if spec is not None and spec.loader is not None:
+            spec.loader = _TimingLoader(spec.loader, fullname, self)
+        return spec
+
+
+class StartupProfiler:
+    """记录各组件的导入和模型加载耗时
+
+    耗时为包含关系：例如 deepface 的导入时间包含其内部导入 tensorflow 的时间，报告中按开始顺序缩进显示。
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.records = []  # (名称, 开始时间, 耗时, 嵌套深度)
+        self.origin = time.perf_counter()
+        self._depth = 0
+        self._finder = None
+
+    def enable(self):
+        if not self.enabled:
+            self.enabled = True
+            self._finder = _ImportTimer(self)
+            sys.meta_path.insert(0, self._finder)
+
+    @contextmanager
+    def span(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            self.records.append((name, start, time.perf_counter() - start, self._depth))
+
+    def report(self, file=sys.stderr):
+        """按开始时间输出各组件耗时"""
+        if not self.enabled:
+            return
+        print("\n===== 启动耗时分析 =====", file=file)
+        for name, start, seconds, depth in sorted(self.records, key=lambda record: record[1]):
+            print(f"{'  ' * depth}{name:<{40 - 2 * depth}} {seconds * 1000:9.1f} ms", file=file)
+        print(f"{'总耗时':<38} {(time.perf_counter() - self.origin) * 1000:9.1f} ms", file=file)
+
+
+profiler = StartupProfiler()
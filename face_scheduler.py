@@ -0,0 +1,92 @@
+import math
+import time
+from collections import Counter
+
+import cv2
+import numpy as np
+
+
+class RecognitionScheduler:
+    """自适应识别调度：根据画面运动和实测推理耗时决定当前帧是否做检测/识别
+
+    - 推理耗时超出目标帧率的预算时，自动拉长两次识别之间的帧数，保证显示帧率；
+    - 用缩小后的灰度帧差估计运动量，静止的空场景直接跳过；
+    - 画面中有人脸但静止时按 refresh_interval 定期刷新，完全静止的空场景按 idle_interval 偶尔复查。
+    """
+
+    def __init__(self, target_fps=15, motion_threshold=2.0, refresh_interval=15, idle_interval=150,
+                 motion_size=(64, 48), ema=0.2):
+        self.target_fps = target_fps
+        self.motion_threshold = motion_threshold
+        self.refresh_interval = refresh_interval
+        self.idle_interval = idle_interval
+        self.motion_size = motion_size
+        self.ema = ema
+        self.latency = 0.0  # 识别耗时的指数滑动平均（秒）
+        self.motion = 0.0
+        self.frames_since_run = math.inf
+        self.last_reason = None
+        self.decisions = Counter()
+        self._prev_small = None
+
+    @property
+    def min_interval(self):
+        """按推理耗时和目标帧率算出的两次识别之间至少间隔的帧数"""
+        if self.latency <= 0 or not self.target_fps:
+            return 1
+        return max(1, math.ceil(self.latency * self.target_fps))
+
+    def measure_motion(self, frame):
+        """缩小灰度帧之间的平均绝对差，作为运动量"""
+        small = cv2.resize(frame, self.motion_size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        small = cv2.GaussianBlur(small, (3, 3), 0)
+        motion = math.inf if self._prev_small is None else float(np.mean(cv2.absdiff(small, self._prev_small)))
+        self._prev_small = small
+        return motion
+
+    def should_run(self, frame, has_faces=False):
+        """决定当前帧是否做识别，并记录原因"""
+        self.motion = self.measure_motion(frame)
+        self.frames_since_run += 1
+        if self.frames_since_run < self.min_interval:
+            reason = 'skip:budget'
+        elif self.motion >= self.motion_threshold:
+            reason = 'run:motion'
+        elif has_faces and self.frames_since_run >= self.refresh_interval:
+            reason = 'run:refresh'
+        elif self.frames_since_run >= self.idle_interval:
+            reason = 'run:idle'
+        else:
+            reason = 'skip:static'
+        self.last_reason = reason
+        self.decisions[reason] += 1
+        run = reason.startswith('run')
+        if run:
+            self.frames_since_run = 0
+        return run
+
+    def record_latency(self, seconds):
+        """记录一次识别的实际耗时"""
+        self.latency = seconds if self.latency == 0 else (1 - self.ema) * self.latency + self.ema * seconds
+
+    def timed(self, func, *args, **kwargs):
+        """执行一次识别并记录耗时"""
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.record_latency(time.perf_counter() - start)
+
+    def status_text(self):
+        """当前决策的简短描述，用于叠加在画面上"""
+        return f"{self.last_reason} motion {self.motion:.1f} interval {self.min_interval}"
+
+    def summary(self):
+        """调度决策统计，便于调参"""
+        total = sum(self.decisions.values()) or 1
+        runs = sum(count for reason, count in self.decisions.items() if reason.startswith('run'))
+        details = ", ".join(f"{reason} {count}" for reason, count in sorted(self.decisions.items()))
+        return (f"调度: 共 {total} 帧，识别 {runs} 帧 ({runs / total:.0%})；{details}；"
+                f"识别耗时 {self.latency * 1000:.0f} ms，最小间隔 {self.min_interval} 帧")
@@ -0,0 +1,197 @@
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import face_cache
+import face_engine
+from face_client import DEFAULT_HOST, DEFAULT_PORT
+
+
+def _to_json(obj):
+    """把 numpy 类型转换为可序列化的 Python 类型"""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"无法序列化 {type(obj).__name__}")
+
+
+class EmbeddingBatcher:
+    """把并发请求中的人脸凑成一个批次做前向推理
+
+    第一个请求到达后最多再等待 max_wait 秒或凑满 max_batch 张人脸，然后一次性提取特征并分发结果。
+    """
+
+    def __init__(self, model_name=face_engine.MODEL_NAME, max_batch=32, max_wait=0.005):
+        self.model_name = model_name
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.jobs = queue.Queue()
+        self.stats = {'batches': 0, 'faces': 0}
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def embed(self, faces):
+        if not faces:
+            return np.zeros((0, 0), dtype=np.float32)
+        job = {'faces': faces, 'done': threading.Event(), 'result': None, 'error': None}
+        self.jobs.put(job)
+        job['done'].wait()
+        if job['error'] is not None:
+            raise job['error']
+        return job['result']
+
+    def _collect(self):
+        jobs = [self.jobs.get()]
+        count = len(jobs[0]['faces'])
+        deadline = time.perf_counter() + self.max_wait
+        while count < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                job = self.jobs.get(timeout=remaining)
+            except queue.Empty:
+                break
+            jobs.append(job)
+            count += len(job['faces'])
+        return jobs, count
+
+    def _loop(self):
+        while True:
+            jobs, count = self._collect()
+            try:
+                embeddings = face_engine.embed_faces([face for job in jobs for face in job['faces']],
+                                                     model_name=self.model_name, batch_size=max(count, 1))
+                start = 0
+                for job in jobs:
+                    job['result'] = embeddings[start:start + len(job['faces'])]
+                    start += len(job['faces'])
+            except Exception as e:
+                for job in jobs:
+                    job['error'] = e
+            self.stats['batches'] += 1
+            self.stats['faces'] += count
+            for job in jobs:
+                job['done'].set()
+
+
+class FaceService:
+    """常驻内存的模型服务，模型只加载一次"""
+
+    def __init__(self, model_name=face_engine.MODEL_NAME, detector_backend=face_engine.DETECTOR_BACKEND,
+                 max_batch=32, max_wait=0.005):
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.batcher = EmbeddingBatcher(model_name, max_batch=max_batch, max_wait=max_wait)
+        self.started = time.time()
+        self.requests = 0
+        self.handlers = {'verify': self.verify, 'find': self.find, 'analyze': self.analyze,
+                         'represent': self.represent}
+
+    def warm_up(self):
+        """预先加载识别模型和检测器"""
+        face_engine.get_model(self.model_name)
+        face_engine.warm_detector(self.detector_backend)
+
+    def _represent(self, img_path):
+        key = face_engine.represent_key(img_path, self.model_name, self.detector_backend)
+        hit = face_cache.load(key)
+        if hit is not None:
+            return hit
+        faces = face_engine.detect_faces(img_path, detector_backend=self.detector_backend)
+        embeddings = self.batcher.embed(faces)
+        face_cache.store(key, 'represent', [face_engine.face_meta(face) for face in faces], embeddings)
+        return faces, embeddings
+
+    def represent(self, payload):
+        faces, embeddings = self._represent(payload['img'])
+        return [dict(face_engine.face_meta(face), embedding=embedding.tolist()) for face, embedding in zip(faces, embeddings)]
+
+    def verify(self, payload):
+        faces1, embeddings1 = self._represent(payload['img1'])
+        faces2, embeddings2 = self._represent(payload['img2'])
+        if not faces1 or not faces2:
+            raise ValueError("未检测到人脸")
+        return face_engine.verification_result(embeddings1, embeddings2, self.model_name, self.detector_backend)
+
+    def find(self, payload):
+        import face_index
+        index = face_index.open_index(payload['db'], self.model_name, self.detector_backend)
+        faces, embeddings = self._represent(payload['img'])
+        if not faces:
+            return []
+        threshold = payload.get('threshold')
+        if threshold is None:
+            threshold = face_engine.find_threshold(self.model_name, self.detector_backend)
+        matches = face_index.search_matches(index, embeddings, k=payload.get('k', 5), threshold=threshold,
+                                            nprobe=payload.get('nprobe'), shortlist=payload.get('shortlist'),
+                                            rerank=payload.get('rerank'))
+        return [[face_engine.face_meta(face), results] for face, results in zip(faces, matches)]
+
+    def analyze(self, payload):
+        import face_attributes
+        actions = payload.get('actions') or list(face_attributes.ACTIONS)
+        return face_attributes.analyze_image(payload['img'], actions=actions, detector_backend=self.detector_backend)
+
+    def health(self):
+        return {'status': 'ok', 'model': self.model_name, 'detector_backend': self.detector_backend,
+                'uptime': time.time() - self.started, 'requests': self.requests, 'batcher': self.batcher.stats}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def _reply(self, status, body):
+        data = json.dumps(body, ensure_ascii=False, default=_to_json).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.strip('/') == 'health':
+            self._reply(200, self.server.service.health())
+        else:
+            self._reply(404, {'error': f"未知接口: {self.path}"})
+
+    def do_POST(self):
+        service = self.server.service
+        handler = service.handlers.get(self.path.strip('/'))
+        if handler is None:
+            self._reply(404, {'error': f"未知接口: {self.path}"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            service.requests += 1
+            self._reply(200, handler(payload))
+        except Exception as e:
+            self._reply(500, {'error': str(e)})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, max_batch=32, max_wait=0.005, verbose=False):
+    """启动模型服务（阻塞），每个请求在独立线程中处理，特征提取跨请求合批"""
+    service = FaceService(max_batch=max_batch, max_wait=max_wait)
+    print("正在加载模型...")
+    start = time.time()
+    service.warm_up()
+    print(f"模型加载完成，耗时 {time.time() - start:.2f} 秒")
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.service = service
+    server.verbose = verbose
+    print(f"模型服务已启动: http://{host}:{port} (按 Ctrl+C 停止)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print("模型服务已停止")
@@ -0,0 +1,315 @@
+import multiprocessing
+import os
+import socket
+import socketserver
+import struct
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+
+import face_cache
+import face_client
+import face_engine
+import face_index
+
+DEFAULT_PORT = 9100  # 本机分片服务的起始端口，第 i 个分片使用 DEFAULT_PORT + i
+DEFAULT_TIMEOUT = 2.0  # 等待各分片返回的时间，超时的分片本次不计入结果
+_LENGTH = struct.Struct('>I')
+
+
+def shards_root(index_dir, n):
+    """n 个分片存放在特征库目录旁边，特征库重写时不会被一起删除"""
+    return os.path.join(f"{index_dir}_shards", str(n))
+
+
+def shard_dir(index_dir, i, n):
+    return os.path.join(shards_root(index_dir, n), str(i))
+
+
+def assign_shards(faces, n):
+    """按身份文件夹分配分片：同一身份的人脸总在同一分片，按人脸数从多到少依次放进当前最小的分片"""
+    counts = Counter(face['identity'] for face in faces)
+    loads, assignment = [0] * n, {}
+    for identity, count in sorted(counts.items(), key=lambda item: (-item[1], item[0])):
+        target = loads.index(min(loads))
+        assignment[identity] = target
+        loads[target] += count
+    return assignment
+
+
+def build_shards(index, n):
+    """把特征库拆成 n 个独立的特征库（格式与 GalleryIndex 相同），返回各分片的人脸数
+
+    源特征库建有倒排索引或压缩特征时，各分片沿用同一组聚类中心和码本，nprobe / rerank 的含义与不分片时相同。
+    """
+    assignment = assign_shards(index.faces, n)
+    labels = np.array([assignment[face['identity']] for face in index.faces], dtype=np.int64)
+    sizes = []
+    for i in range(n):
+        rows = np.flatnonzero(labels == i)
+        blocks = [index.embeddings[rows[start:start + face_index.SEARCH_BLOCK]]
+                  for start in range(0, len(rows), face_index.SEARCH_BLOCK)]
+        meta = dict(index.meta, db_path=index.db_path, shard=i, shards=n, source_updated=index.meta.get('updated'))
+        path = shard_dir(index.index_dir, i, n)
+        face_index.GalleryIndex.write(path, blocks, [index.faces[row] for row in rows], meta)
+        if len(rows):
+            face_index.carry_over(face_index.GalleryIndex.load(path), index)
+        sizes.append(len(rows))
+    return sizes
+
+
+def parse_address(address):
+    """'host:port' 或 'port'"""
+    host, _, port = str(address).rpartition(':')
+    return host or face_client.DEFAULT_HOST, int(port)
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("连接已关闭")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def send_message(sock, meta, array=None):
+    """一条消息 = 4 字节长度 + JSON 头 + 原始 float32 数据（与磁盘缓存的编码相同）"""
+    data = face_cache.encode(meta, array)
+    sock.sendall(_LENGTH.pack(len(data)) + data)
+
+
+def recv_message(sock):
+    size, = _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))
+    return face_cache.decode(_recv_exact(sock, size))
+
+
+class ShardWorker:
+    """一个分片的检索服务：收到查询特征后返回本分片内的 top-k"""
+
+    def __init__(self, index_dir):
+        self.index = face_index.GalleryIndex.load(index_dir)
+        self.shard = self.index.meta.get('shard')
+        self.requests = 0
+
+    def handle(self, meta, queries):
+        op = meta.get('op')
+        if op == 'info':
+            return {'shard': self.shard, 'shards': self.index.meta.get('shards'), 'count': len(self.index),
+                    'source_updated': self.index.meta.get('source_updated'), 'requests': self.requests}
+        if op != 'search':
+            raise ValueError(f"未知操作: {op}")
+        self.requests += 1
+        results = face_index.search_matches(self.index, queries, meta.get('k', 5), meta.get('threshold'),
+                                            meta.get('nprobe'), meta.get('shortlist'), meta.get('rerank'))
+        return {'shard': self.shard, 'results': results}
+
+
+class _ShardHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        while True:
+            try:
+                meta, queries = recv_message(self.request)
+            except (ConnectionError, OSError):
+                return
+            try:
+                reply = self.server.worker.handle(meta, queries)
+            except Exception as e:
+                reply = {'error': str(e)}
+            send_message(self.request, reply)
+
+
+class _ShardServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve_shard(index_dir, host=face_client.DEFAULT_HOST, port=DEFAULT_PORT, verbose=True):
+    """启动一个分片服务（阻塞）"""
+    worker = ShardWorker(index_dir)
+    server = _ShardServer((host, port), _ShardHandler)
+    server.worker = worker
+    if verbose:
+        print(f"分片 {worker.shard} 已启动: {host}:{port}，{len(worker.index)} 张人脸", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+class ShardClient:
+    """到一个分片服务的持久连接；出错或超时后关闭连接，下次请求时重新连接"""
+
+    def __init__(self, address):
+        self.address = parse_address(address)
+        self._sock = None
+
+    def call(self, meta, array=None, timeout=DEFAULT_TIMEOUT):
+        try:
+            if self._sock is None:
+                self._sock = socket.create_connection(self.address, timeout=timeout)
+                self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._sock.settimeout(timeout)
+            send_message(self._sock, meta, array)
+            reply, _ = recv_message(self._sock)
+        except Exception:
+            self.close()  # 超时后连接上可能还有迟到的回复，不能再复用
+            raise
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return reply
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+class ShardCoordinator:
+    """把查询特征广播给所有分片，合并各分片的 top-k
+
+    每个分片一个线程和一条持久连接，同一分片的请求串行发送。在 timeout 秒内没有返回或出错的分片本次跳过，
+    返回的状态中会标出，结果只来自其余分片。
+    """
+
+    def __init__(self, addresses, timeout=DEFAULT_TIMEOUT):
+        self.addresses = list(addresses)
+        self.timeout = timeout
+        self.clients = [ShardClient(address) for address in self.addresses]
+        self.pools = [ThreadPoolExecutor(max_workers=1) for _ in self.clients]
+        self.stats = Counter()
+
+    def broadcast(self, meta, array=None, timeout=None):
+        """返回 ({分片序号: 回复}, {分片序号: 'ok' / 'timeout' / 错误信息})"""
+        timeout = self.timeout if timeout is None else timeout
+        futures = {pool.submit(client.call, meta, array, timeout): i
+                   for i, (client, pool) in enumerate(zip(self.clients, self.pools))}
+        done, pending = wait(futures, timeout=timeout)
+        replies, status = {}, {}
+        for future in done:
+            i = futures[future]
+            try:
+                replies[i] = future.result()
+                status[i] = 'ok'
+            except Exception as e:
+                status[i] = f"error: {e}" if not isinstance(e, socket.timeout) else 'timeout'
+        for future in pending:
+            status[futures[future]] = 'timeout'
+        self.stats.update(value.split(':')[0] for value in status.values())
+        return replies, dict(sorted(status.items()))
+
+    def info(self):
+        replies, status = self.broadcast({'op': 'info'})
+        return [replies.get(i) for i in range(len(self.clients))], status
+
+    def search(self, queries, k=5, threshold=None, nprobe=None, shortlist=None, rerank=None):
+        """与 GalleryIndex.search（指定 shortlist 时为 search_identities）格式相同的结果，每条结果多一个 shard 字段
+
+        返回 (结果, 各分片状态)。
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        meta = {'op': 'search', 'k': k, 'threshold': threshold, 'nprobe': nprobe, 'shortlist': shortlist,
+                'rerank': rerank}
+        replies, status = self.broadcast(meta, queries)
+        results = []
+        for q in range(len(queries)):
+            merged = [dict(result, shard=i) for i, reply in replies.items() for result in reply['results'][q]]
+            merged.sort(key=lambda result: result['distance'])
+            results.append(merged[:k])
+        return results, status
+
+    def close(self):
+        for client, pool in zip(self.clients, self.pools):
+            pool.shutdown(wait=False)
+            client.close()
+
+
+class LocalShardCluster:
+    """在本机为每个分片启动一个独立进程，多核并行扫描；用于单机扩展和测试"""
+
+    def __init__(self, index_dir, n, host=face_client.DEFAULT_HOST, base_port=DEFAULT_PORT):
+        self.dirs = [shard_dir(index_dir, i, n) for i in range(n)]
+        self.host = host
+        self.ports = [base_port + i for i in range(n)]
+        self.processes = []
+
+    @property
+    def addresses(self):
+        return [f"{self.host}:{port}" for port in self.ports]
+
+    def start(self, timeout=60):
+        missing = [path for path in self.dirs if not os.path.exists(os.path.join(path, face_index.META_FILE))]
+        if missing:
+            raise FileNotFoundError(f"分片不存在，请先运行 shard-build: {missing[0]}")
+        context = multiprocessing.get_context('spawn')
+        for path, port in zip(self.dirs, self.ports):
+            process = context.Process(target=serve_shard, args=(path, self.host, port, False), daemon=True)
+            process.start()
+            self.processes.append(process)
+        deadline = time.time() + timeout
+        for process, port in zip(self.processes, self.ports):
+            while not face_client.server_available(self.host, port, timeout=0.2):
+                if not process.is_alive() or time.time() > deadline:
+                    self.stop()
+                    raise RuntimeError(f"分片服务启动失败: {self.host}:{port}")
+                time.sleep(0.05)
+        return self
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join(timeout=5)
+        self.processes = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def find(img, coordinator, k=5, model_name=face_engine.MODEL_NAME, detector_backend=face_engine.DETECTOR_BACKEND,
+         threshold=None, nprobe=None, shortlist=None, rerank=None):
+    """与 face_index.find 相同，但在分片服务上检索；返回 ((face, results) 列表, 各分片状态)"""
+    if threshold is None:
+        threshold = face_engine.find_threshold(model_name, detector_backend)
+    faces, embeddings = face_engine.represent(img, model_name=model_name, detector_backend=detector_backend)
+    if not faces:
+        return [], {}
+    results, status = coordinator.search(embeddings, k=k, threshold=threshold, nprobe=nprobe, shortlist=shortlist,
+                                         rerank=rerank)
+    return list(zip(faces, results)), status
+
+
+def benchmark(index, coordinator, sample=200, k=5, seed=0):
+    """用特征库中抽样的特征做查询，对比单进程精确检索与分片检索的结果一致率和延迟"""
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(index), min(sample, len(index)), replace=False))
+    queries = np.asarray(index.embeddings[rows], dtype=np.float32)
+    expected, single = [], []
+    for query in queries:  # 与分片检索一样逐个查询，延迟才可比
+        start = time.perf_counter()
+        _, best_rows = index.exact_topk(query[None], k)
+        single.append((time.perf_counter() - start) * 1000)
+        expected.append([index.path_of(row) for row in best_rows[0]])
+
+    latencies, agree, total, statuses = [], 0, 0, Counter()
+    for query, truth in zip(queries, expected):
+        start = time.perf_counter()
+        results, status = coordinator.search(query, k=k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        statuses.update(value.split(':')[0] for value in status.values())
+        found = {result['path'] for result in results[0]}
+        agree += len(found & set(truth))
+        total += len(truth)
+    return {'queries': len(queries), 'k': k, 'single_ms': float(np.mean(single)), 'sharded_ms': float(np.mean(latencies)),
+            'sharded_p50_ms': float(np.percentile(latencies, 50)), 'sharded_p90_ms': float(np.percentile(latencies, 90)),
+            'agreement': agree / max(total, 1), 'status': dict(statuses)}
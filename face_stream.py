@@ -0,0 +1,89 @@
+import cv2
+
+import face_engine
+import face_enroll
+from face_metrics import metrics
+
+STREAM_DETECTOR = 'opencv'
+STREAM_THRESHOLD = 0.6  # 没有标定阈值时使用（见 face_calibrate）
+MATCH_COLOR = (0, 255, 0)
+UNKNOWN_COLOR = (0, 0, 255)
+
+
+class StreamRecognizer:
+    """实时识别引擎：每帧只检测一次，直接用检测得到的对齐人脸提取特征并在特征库中检索"""
+
+    def __init__(self, db_path, detector_backend=STREAM_DETECTOR, threshold=None,
+                 model_name=face_engine.MODEL_NAME):
+        self.index = face_enroll.LiveGallery(db_path, model_name)  # 新登记的人无需重启即可识别
+        self.detector_backend = detector_backend
+        if threshold is None:
+            threshold = face_engine.find_threshold(model_name, detector_backend, default=STREAM_THRESHOLD)
+        self.threshold = threshold
+        self.model_name = model_name
+
+    def detect(self, frame):
+        """检测帧中的人脸，没有人脸时返回空列表（不会把整帧当作人脸）"""
+        with metrics.span('detect'):
+            faces = face_engine.detect_faces(frame, detector_backend=self.detector_backend, enforce_detection=True)
+        metrics.inc('faces_detected', len(faces))
+        return faces
+
+    def identify(self, faces):
+        """为已检测到的人脸批量提取特征并检索，结果与 faces 一一对应"""
+        if not faces:
+            return []
+        with metrics.span('embed'):
+            embeddings = face_engine.embed_faces(faces, model_name=self.model_name)
+        with metrics.span('search'):
+            matches = self.index.search(embeddings, k=1, threshold=self.threshold)
+        matched = sum(1 for results in matches if results)
+        metrics.inc('faces_matched', matched)
+        metrics.inc('faces_unknown', len(faces) - matched)
+        return [face_result(face, results[0] if results else None) for face, results in zip(faces, matches)]
+
+    def recognize(self, frame):
+        """检测并识别一帧中的所有人脸"""
+        return self.identify(self.detect(frame))
+
+
+def face_rect(face):
+    """检测结果中的人脸框 (x, y, w, h)"""
+    area = face['facial_area']
+    return area['x'], area['y'], area['w'], area['h']
+
+
+def face_result(face, match):
+    """把检测框和最佳匹配整理为绘制所需的结果：{"rect", "identity", "distance", "text", "color"}"""
+    rect = face_rect(face)
+    if match is None:
+        identity, distance, similarity, color = "unknown face", None, 0, UNKNOWN_COLOR
+    else:
+        identity, distance = match['identity'], match['distance']
+        similarity = (1 - distance) * 100
+        color = MATCH_COLOR
+    return {"rect": rect, "identity": identity, "distance": distance, "text": f"{identity}: {similarity:.1f}%",
+            "color": color}
+
+
+def draw_results(frame, results):
+    """在帧上绘制人脸框和识别结果"""
+    with metrics.span('draw'):
+        for result in results:
+            x, y, w, h = result["rect"]
+            color = result["color"]
+            cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
+            cv2.putText(frame, result["text"], (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+    return frame
+
+
+def draw_status(frame, text):
+    """在画面左下角绘制一行状态信息"""
+    cv2.putText(frame, text, (10, frame.shape[0] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+    return frame
+
+
+def draw_metrics(frame):
+    """在画面左上角叠加 FPS 和各阶段耗时"""
+    cv2.putText(frame, metrics.overlay_text(), (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 1)
+    return frame
@@ -0,0 +1,165 @@
+import queue
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+POLL_MS = 50  # 界面线程取结果的间隔
+MAX_EVENTS = 200  # 每次最多处理的事件数，避免结果很多时长时间占用界面线程
+
+
+class TaskCancelled(Exception):
+    """任务已被取消"""
+
+
+class Task:
+    """提交到后台执行的一个任务，任务函数通过它汇报进度、检查是否已被取消"""
+
+    def __init__(self, executor, key, func, args, callbacks):
+        self.key = key
+        self.func = func
+        self.args = args
+        self.callbacks = callbacks
+        self.future = None
+        self.superseded = False  # 被同一 key 的新请求取代，结束时不再回调
+        self._executor = executor
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """请求取消：任务在下一次 check() / progress() 时结束，正在进行的推理无法中断，但其结果会被丢弃"""
+        self._cancelled.set()
+
+    def check(self):
+        if self.cancelled:
+            raise TaskCancelled()
+
+    def progress(self, message):
+        """汇报进度（在界面线程中回调 on_progress）；任务已被取消时抛出 TaskCancelled 以尽早结束"""
+        self.check()
+        self._executor._events.put((self, 'progress', message))
+
+    def same_request(self, func, args):
+        try:
+            return self.func == func and bool(self.args == args)
+        except Exception:  # 参数无法比较（如 numpy 数组）时视为不同的请求
+            return False
+
+
+class TaskExecutor:
+    """图形界面的后台任务执行器
+
+    耗时的推理在工作线程中执行，进度、结果和异常放入队列，由 Tk 主循环通过 after() 定时取出并在界面线程中回调，
+    工作线程从不直接操作控件。同一 key 的任务会合并：相同请求正在执行时重复提交直接返回该任务；请求不同时取消旧任务
+    （其结果被丢弃）再执行新任务。默认只有一个工作线程，模型不会被多个推理同时争用。
+    """
+
+    def __init__(self, master, workers=1, poll_ms=POLL_MS):
+        self.master = master
+        self.poll_ms = poll_ms
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='face-task')
+        self._events = queue.Queue()
+        self._active = {}  # key -> Task，只在界面线程中读写
+        self._closed = False
+        self._after_id = master.after(poll_ms, self._poll)
+
+    def submit(self, key, func, *args, on_done=None, on_error=None, on_progress=None, on_cancel=None):
+        """在后台执行 func(task, *args)，必须在界面线程中调用；回调同样在界面线程中执行"""
+        current = self._active.get(key)
+        if current is not None:
+            if not current.cancelled and current.same_request(func, args):
+                return current
+            current.superseded = True
+            current.cancel()
+        callbacks = {'done': on_done, 'error': on_error, 'progress': on_progress, 'cancelled': on_cancel}
+        task = Task(self, key, func, args, callbacks)
+        self._active[key] = task
+        task.future = self._pool.submit(self._run, task)
+        return task
+
+    def call(self, func, *args):
+        """从任意线程请求在界面线程中执行 func(*args)，用于后台线程更新控件"""
+        self._events.put((None, 'call', (func, args)))
+
+    def running(self, key):
+        task = self._active.get(key)
+        return task is not None and not task.cancelled
+
+    def cancel(self, key):
+        task = self._active.get(key)
+        if task is not None:
+            task.cancel()
+        return task is not None
+
+    def cancel_all(self):
+        cancelled = False
+        for task in list(self._active.values()):
+            if not task.cancelled:
+                task.cancel()
+                cancelled = True
+        return cancelled
+
+    def shutdown(self):
+        """窗口关闭时调用：取消所有任务并停止轮询，不等待正在进行的推理"""
+        self._closed = True
+        self.cancel_all()
+        if self._after_id is not None:
+            self.master.after_cancel(self._after_id)
+            self._after_id = None
+        self._pool.shutdown(wait=False)
+
+    def _run(self, task):
+        try:
+            task.check()
+            result = task.func(task, *task.args)
+            task.check()
+        except TaskCancelled:
+            self._events.put((task, 'cancelled', None))
+        except Exception as e:
+            self._events.put((task, 'error', e))
+        else:
+            self._events.put((task, 'done', result))
+
+    def _poll(self):
+        events = []
+        while len(events) < MAX_EVENTS:
+            try:
+                events.append(self._events.get_nowait())
+            except queue.Empty:
+                break
+        # 同一任务积压的多条进度只显示最新一条
+        last_progress = {id(task): i for i, (task, kind, value) in enumerate(events) if kind == 'progress'}
+        for i, (task, kind, value) in enumerate(events):
+            if kind == 'progress' and last_progress[id(task)] != i:
+                continue
+            try:
+                self._dispatch(task, kind, value)
+            except Exception:
+                traceback.print_exc()
+        if not self._closed:
+            self._after_id = self.master.after(self.poll_ms, self._poll)
+
+    def _dispatch(self, task, kind, value):
+        if kind == 'call':
+            func, args = value
+            func(*args)
+            return
+        if kind != 'progress' and self._active.get(task.key) is task:
+            del self._active[task.key]
+        if task.superseded:
+            return
+        if task.cancelled and kind != 'cancelled':
+            if kind == 'progress':
+                return
+            kind = 'cancelled'  # 取消后才完成的任务，结果丢弃
+        callback = task.callbacks[kind]
+        if callback is None:
+            if kind == 'error':
+                traceback.print_exception(type(value), value, value.__traceback__)
+            return
+        if kind == 'cancelled':
+            callback()
+        else:
+            callback(value)
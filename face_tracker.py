@@ -0,0 +1,166 @@
+import itertools
+
+import cv2
+import numpy as np
+
+import face_stream
+from face_metrics import metrics
+
+MIN_POINTS = 4
+
+
+def iou(a, b):
+    """两个 (x, y, w, h) 框的交并比"""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    inter_w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    inter_h = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = inter_w * inter_h
+    union = aw * ah + bw * bh - inter
+    return inter / union if union > 0 else 0.0
+
+
+def associate(tracks, rects, iou_threshold):
+    """按 IoU 从大到小贪心匹配已有轨迹和新检测框，返回 (匹配对, 未匹配轨迹, 未匹配检测)"""
+    candidates = sorted(((iou(track.rect, rect), t, d) for t, track in enumerate(tracks)
+                         for d, rect in enumerate(rects)), reverse=True)
+    matched, used_tracks, used_rects = [], set(), set()
+    for score, t, d in candidates:
+        if score < iou_threshold:
+            break
+        if t in used_tracks or d in used_rects:
+            continue
+        matched.append((t, d))
+        used_tracks.add(t)
+        used_rects.add(d)
+    unmatched_tracks = [t for t in range(len(tracks)) if t not in used_tracks]
+    unmatched_rects = [d for d in range(len(rects)) if d not in used_rects]
+    return matched, unmatched_tracks, unmatched_rects
+
+
+class Track:
+    """一个被持续跟踪的人脸"""
+
+    def __init__(self, track_id, rect):
+        self.track_id = track_id
+        self.rect = rect
+        self.result = None  # 最近一次识别结果
+        self.identified_at = None  # 最近一次识别时的帧号
+        self.misses = 0
+        self.points = None  # 光流跟踪的特征点
+
+    def view(self):
+        """生成绘制用的结果，识别结果跟随轨迹框移动"""
+        if self.result is None:
+            text, color = "...", face_stream.UNKNOWN_COLOR
+        else:
+            text, color = self.result["text"], self.result["color"]
+        return {"rect": self.rect, "track_id": self.track_id, "text": f"#{self.track_id} {text}", "color": color,
+                "identity": self.result["identity"] if self.result else None,
+                "distance": self.result["distance"] if self.result else None}
+
+
+class FaceTracker:
+    """识别关键帧之间的人脸跟踪
+
+    关键帧上做一次轻量检测，用 IoU 把检测框关联到已有轨迹；只有新出现、置信度低或到期需要刷新的轨迹
+    才提取特征并检索。非关键帧用金字塔 LK 光流把框平移到人脸的新位置，不做检测也不做识别。
+    """
+
+    def __init__(self, recognizer, detect_interval=3, iou_threshold=0.3, refresh_interval=90, retry_interval=15,
+                 max_misses=3, confident_distance=0.5):
+        self.recognizer = recognizer
+        self.detect_interval = detect_interval
+        self.iou_threshold = iou_threshold
+        self.refresh_interval = refresh_interval  # 已识别轨迹的定期复核间隔（帧）
+        self.retry_interval = retry_interval  # 未识别/低置信度轨迹的重试间隔（帧）
+        self.max_misses = max_misses
+        self.confident_distance = confident_distance  # 距离低于该值的识别结果视为高置信度
+        self.tracks = []
+        self.frame_index = 0
+        self.prev_gray = None
+        self.stats = {"frames": 0, "detections": 0, "embeddings": 0}
+        self._ids = itertools.count(1)
+
+    def update(self, frame, detect=None):
+        """处理一帧并返回当前所有轨迹的绘制结果，detect 为 None 时按固定间隔决定是否检测"""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if detect is None:
+            detect = self.frame_index % self.detect_interval == 0
+        if detect:
+            self._detect_and_identify(frame, gray)
+        elif self.prev_gray is not None:
+            with metrics.span('track'):
+                self._propagate(gray)
+        self.prev_gray = gray
+        self.frame_index += 1
+        self.stats["frames"] += 1
+        return [track.view() for track in self.tracks]
+
+    def reset(self):
+        self.tracks = []
+        self.prev_gray = None
+
+    def _due(self, track):
+        """判断轨迹是否需要重新识别"""
+        if track.identified_at is None:
+            return True
+        distance = track.result["distance"] if track.result else None
+        confident = distance is not None and distance <= self.confident_distance
+        interval = self.refresh_interval if confident else self.retry_interval
+        return self.frame_index - track.identified_at >= interval
+
+    def _detect_and_identify(self, frame, gray):
+        faces = self.recognizer.detect(frame)
+        self.stats["detections"] += 1
+        rects = [face_stream.face_rect(face) for face in faces]
+        matched, unmatched_tracks, unmatched_rects = associate(self.tracks, rects, self.iou_threshold)
+
+        observed = []  # 本帧检测到的 (轨迹, 人脸)
+        for t, d in matched:
+            self.tracks[t].rect = rects[d]
+            self.tracks[t].misses = 0
+            observed.append((self.tracks[t], faces[d]))
+        for t in unmatched_tracks:
+            self.tracks[t].misses += 1
+        for d in unmatched_rects:
+            track = Track(next(self._ids), rects[d])
+            self.tracks.append(track)
+            observed.append((track, faces[d]))
+        # 清理连续多次未检测到的轨迹
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+
+        pending = [(track, face) for track, face in observed if self._due(track)]
+        if pending:
+            results = self.recognizer.identify([face for track, face in pending])
+            self.stats["embeddings"] += len(pending)
+            for (track, face), result in zip(pending, results):
+                track.result = result
+                track.identified_at = self.frame_index
+
+        for track in self.tracks:
+            track.points = self._sample_points(gray, track.rect)
+
+    @staticmethod
+    def _sample_points(gray, rect):
+        """在人脸框内取角点作为光流跟踪点"""
+        x, y, w, h = rect
+        mask = np.zeros_like(gray)
+        mask[max(0, y):max(0, y + h), max(0, x):max(0, x + w)] = 255
+        return cv2.goodFeaturesToTrack(gray, maxCorners=30, qualityLevel=0.01, minDistance=5, mask=mask)
+
+    def _propagate(self, gray):
+        """用光流中位位移平移每个轨迹框"""
+        for track in self.tracks:
+            if track.points is None or len(track.points) < MIN_POINTS:
+                continue
+            points, status, err = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, track.points, None,
+                                                           winSize=(15, 15), maxLevel=2)
+            ok = status.reshape(-1) == 1
+            if ok.sum() < MIN_POINTS:
+                track.points = None
+                continue
+            dx, dy = np.median((points[ok] - track.points[ok]).reshape(-1, 2), axis=0)
+            x, y, w, h = track.rect
+            track.rect = (int(round(x + dx)), int(round(y + dy)), w, h)
+            track.points = points[ok].reshape(-1, 1, 2)
@@ -0,0 +1,191 @@
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+import face_engine
+import face_stream
+from face_metrics import metrics
+
+_END = object()
+
+
+class FrameDirectory:
+    """把按文件名排序的图片序列包装成与 cv2.VideoCapture 相同的 read() / grab() 接口"""
+
+    def __init__(self, path, fps=25.0):
+        self.paths = [os.path.join(path, rel_path) for rel_path in face_engine.list_images(path)]
+        self.fps = fps
+        self.position = 0
+
+    def isOpened(self):
+        return bool(self.paths)
+
+    def read(self):
+        while self.position < len(self.paths):
+            frame = cv2.imread(self.paths[self.position])
+            self.position += 1
+            if frame is not None:
+                return True, frame
+        return False, None
+
+    def grab(self):
+        """跳过一帧，不读取图片"""
+        if self.position >= len(self.paths):
+            return False
+        self.position += 1
+        return True
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return len(self.paths)
+        return 0
+
+    def release(self):
+        pass
+
+
+def open_source(source):
+    """打开视频文件、图片序列文件夹、摄像头编号或 rtsp:// 等网络流"""
+    if os.path.isdir(source):
+        capture = FrameDirectory(source)
+    elif source.isdigit():
+        capture = cv2.VideoCapture(int(source))
+    else:
+        capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f"无法打开视频源: {source}")
+    return capture
+
+
+def decode_frames(capture, frames, stride=1, stop=None):
+    """后台解码线程：按 stride 抽帧放入有界队列（队列满时等待，归档视频不丢帧），结束时放入 _END
+
+    跳过的帧只 grab() 前进，不做 retrieve() 的解码和颜色转换（图片序列不读文件），只有保留的帧才 read()。
+    """
+    index = 0
+    try:
+        while stop is None or not stop.is_set():
+            if index % stride:
+                if not capture.grab():
+                    break
+            else:
+                ret, frame = capture.read()
+                if not ret:
+                    break
+                metrics.inc('frames_read')
+                frames.put((index, frame))
+            index += 1
+    finally:
+        frames.put(_END)
+
+
+def frame_record(index, fps, results):
+    """一帧的输出记录：帧号、时间戳和每张人脸的身份与位置"""
+    return {'frame': index, 'time': index / fps if fps else None,
+            'faces': [{'box': list(map(int, result['rect'])), 'identity': result['identity'],
+                       'distance': result['distance']} for result in results]}
+
+
+def process_video(source, db_path, output=None, video_output=None, stride=1, workers=None, batch_size=32,
+                  detector_backend=face_stream.STREAM_DETECTOR, threshold=None,
+                  queue_size=64, on_progress=None):
+    """无界面处理视频 / 图片序列 / 网络流，每帧输出一行 JSON，可选输出带标注的视频
+
+    解码在后台线程进行；检测由线程池并行处理多帧；多帧的人脸攒成一批统一提取特征并检索。
+    返回统计信息。
+    """
+    capture = open_source(source)
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+    recognizer = face_stream.StreamRecognizer(db_path, detector_backend=detector_backend, threshold=threshold)
+    workers = workers or os.cpu_count() or 1
+    frames = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    decoder = threading.Thread(target=decode_frames, args=(capture, frames, stride, stop), daemon=True)
+    out = open(output, 'w', encoding='utf-8') if output else sys.stdout
+    writer = None
+    stats = {'frames': 0, 'faces': 0, 'matched': 0, 'errors': 0, 'fps': fps, 'stride': stride}
+    lock = threading.Lock()
+    start = time.perf_counter()
+
+    def detect(item):
+        index, frame = item
+        try:
+            return index, frame, recognizer.detect(frame)
+        except Exception:
+            metrics.inc('errors')
+            with lock:
+                stats['errors'] += 1
+            return index, frame, []
+
+    def flush(pending):
+        """对攒好的若干帧一次性提取特征并检索，按帧序写出结果"""
+        nonlocal writer
+        faces = [face for index, frame, detected in pending for face in detected]
+        results = recognizer.identify(faces) if faces else []
+        position = 0
+        for index, frame, detected in pending:
+            frame_results = results[position:position + len(detected)]
+            position += len(detected)
+            out.write(json.dumps(frame_record(index, fps, frame_results), ensure_ascii=False) + "\n")
+            stats['frames'] += 1
+            stats['faces'] += len(frame_results)
+            stats['matched'] += sum(1 for result in frame_results if result['distance'] is not None)
+            metrics.inc('frames_analysed')
+            if video_output:
+                face_stream.draw_results(frame, frame_results)
+                if writer is None:
+                    h, w = frame.shape[:2]
+                    writer = cv2.VideoWriter(video_output, cv2.VideoWriter_fourcc(*'mp4v'), fps / stride, (w, h))
+                writer.write(frame)
+        if on_progress is not None:
+            on_progress(stats['frames'], time.perf_counter() - start)
+
+    decoder.start()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            finished = False
+            pending, pending_faces = [], 0
+            while not finished:
+                chunk = []
+                while len(chunk) < workers * 2:
+                    item = frames.get()
+                    if item is _END:
+                        finished = True
+                        break
+                    chunk.append(item)
+                for index, frame, detected in pool.map(detect, chunk):
+                    pending.append((index, frame, detected))
+                    pending_faces += len(detected)
+                # 人脸凑满一批再提取特征；长时间没有人脸时也按帧数定期写出，避免积压过多帧
+                if pending_faces >= batch_size or len(pending) >= batch_size * 4 or (finished and pending):
+                    flush(pending)
+                    pending, pending_faces = [], 0
+    finally:
+        stop.set()
+        while decoder.is_alive():
+            try:
+                frames.get_nowait()  # 提前退出时让解码线程不再阻塞在队列上
+            except queue.Empty:
+                decoder.join(timeout=0.1)
+        capture.release()
+        if writer is not None:
+            writer.release()
+        if output:
+            out.close()
+        else:
+            out.flush()
+
+    elapsed = time.perf_counter() - start
+    stats['elapsed'] = elapsed
+    stats['processing_fps'] = stats['frames'] / elapsed if elapsed > 0 else 0.0
+    # 相对实时的倍数：处理的视频时长 / 实际耗时
+    stats['realtime_factor'] = stats['frames'] * stride / fps / elapsed if elapsed > 0 and fps else None
+    return stats
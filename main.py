@@ -4,8 +4,46 @@ import tkinter as tk
 from tkinter import filedialog, messagebox, Text, ttk
 
 import cv2
-from PIL import Image, ImageTk
-from deepface import DeepFace
+from PIL import ImageTk
+
+import face_attributes
+import face_engine
+import face_image
+import face_index
+import face_metrics
+import face_scheduler
+import face_stream
+import face_tasks
+import face_tracker
+
+# 设置环境变量 FACE_DETECTOR=cascade 使用级联检测（参数见 face_cascade）
+DETECTOR_BACKEND = os.environ.get('FACE_DETECTOR', 'retinaface')
+
+
+# 后台任务：在工作线程中执行，通过 task.progress 汇报进度，不直接操作界面控件
+def verify_task(task, img1_path, img2_path):
+    task.progress(f"正在提取人脸特征: {os.path.basename(img1_path)}...")
+    faces1, embeddings1 = face_engine.represent(img1_path, detector_backend=DETECTOR_BACKEND)
+    task.progress(f"正在提取人脸特征: {os.path.basename(img2_path)}...")
+    faces2, embeddings2 = face_engine.represent(img2_path, detector_backend=DETECTOR_BACKEND)
+    if not faces1 or not faces2:
+        raise ValueError("未检测到人脸")
+    return face_engine.verification_result(embeddings1, embeddings2, detector_backend=DETECTOR_BACKEND)
+
+
+def find_task(task, img_path, db_path):
+    task.progress(f"正在加载特征库: {db_path}...")
+    # 首次使用时建立特征库，逐张汇报进度，取消后在下一张图片处停止
+    face_index.open_index(db_path, on_progress=lambda done, total: task.progress(
+        f"正在建立特征库: {done}/{total} 张图片"))
+    task.progress("正在识别人脸...")
+    return face_index.find(img_path, db_path, k=5, probe_detector=DETECTOR_BACKEND)
+
+
+def analyze_task(task, img_path):
+    task.progress(f"正在分析: {os.path.basename(img_path)}...")
+    return face_attributes.analyze_image(img_path, actions=['age', 'gender', 'race', 'emotion'],
+                                         detector_backend=DETECTOR_BACKEND)
 
 
 # 1. 创建主窗口 - 暗黑极简风格
@@ -15,7 +53,10 @@ class FaceRecognitionApp:
         master.title("面部识别系统")
         master.geometry("1000x700")
         master.configure(bg="#121212")
-        master.bind("<Escape>", self.stop_stream_analysis)
+        master.bind("<Escape>", self.on_escape)
+        master.protocol("WM_DELETE_WINDOW", self.on_close)
+        # 推理在后台线程执行，结果由主循环定时取回，窗口不会卡住
+        self.tasks = face_tasks.TaskExecutor(master)
 
         # 设置应用图标
         try:
@@ -114,12 +155,38 @@ class FaceRecognitionApp:
         self.stream_active = False
         self.stream_thread = None
         self.capture = None
+        self.metrics_exporter = None
 
     def update_status(self, message):
         """更新状态栏"""
         self.status_label.config(text=message)
         self.master.update_idletasks()
 
+    def task_failed(self, title, message, status):
+        """生成后台任务出错时的回调"""
+
+        def on_error(e):
+            messagebox.showerror(title, f"{message}: {str(e)}")
+            self.text_output.insert(tk.END, f"错误详情: {str(e)}\n")
+            self.update_status(status)
+
+        return on_error
+
+    def task_cancelled(self):
+        self.update_status("已取消")
+
+    def on_escape(self, event=None):
+        """ESC 停止实时分析，或取消正在进行的验证、识别、分析任务"""
+        if self.stream_active:
+            self.stop_stream_analysis()
+        elif self.tasks.cancel_all():
+            self.update_status("正在取消...")
+
+    def on_close(self):
+        self.stop_stream_analysis()
+        self.tasks.shutdown()
+        self.master.destroy()
+
     # 2. 人脸验证
     def show_verify_screen(self):
         self.update_status("请选择两张图片进行人脸验证...")
@@ -145,34 +212,32 @@ class FaceRecognitionApp:
         self.display_image(img2_path)
         self.update_status(f"已选择图像2: {os.path.basename(img2_path)}")
 
-        if img1_path and img2_path:
-            self.update_status("正在进行人脸验证...")
-            try:
-                result = DeepFace.verify(img1_path, img2_path, enforce_detection=False, detector_backend='retinaface')
-                self.notebook.select(1)  # 切换到分析结果标签页
-                verified = "匹配" if result['verified'] else "不匹配"
-                distance = result['distance']
-                threshold = result['threshold']
-
-                self.text_output.insert(tk.END, "===== 人脸验证结果 =====\n", "title")
-                self.text_output.insert(tk.END, f"验证结果: {verified}\n")
-                self.text_output.insert(tk.END, f"相似度: {1 - distance:.4f}\n")
-                self.text_output.insert(tk.END, f"距离值: {distance:.4f} (阈值: {threshold:.4f})\n")
-                self.text_output.insert(tk.END, f"模型: {result['model']}\n")
-
-                # 设置结果颜色
-                if result['verified']:
-                    self.text_output.tag_add("success", "2.0", "2.end")
-                    self.text_output.tag_config("success", foreground="#4caf50")
-                else:
-                    self.text_output.tag_add("error", "2.0", "2.end")
-                    self.text_output.tag_config("error", foreground="#f44336")
-
-                self.update_status("人脸验证完成")
-            except Exception as e:
-                messagebox.showerror("验证错误", f"人脸验证失败: {str(e)}")
-                self.text_output.insert(tk.END, f"错误详情: {str(e)}\n")
-                self.update_status("验证出错")
+        self.update_status("正在进行人脸验证... (按ESC取消)")
+        self.tasks.submit('analysis', verify_task, img1_path, img2_path, on_done=self.show_verify_result,
+                          on_error=self.task_failed("验证错误", "人脸验证失败", "验证出错"),
+                          on_progress=self.update_status, on_cancel=self.task_cancelled)
+
+    def show_verify_result(self, result):
+        self.notebook.select(1)  # 切换到分析结果标签页
+        verified = "匹配" if result['verified'] else "不匹配"
+        distance = result['distance']
+        threshold = result['threshold']
+
+        self.text_output.insert(tk.END, "===== 人脸验证结果 =====\n", "title")
+        self.text_output.insert(tk.END, f"验证结果: {verified}\n")
+        self.text_output.insert(tk.END, f"相似度: {1 - distance:.4f}\n")
+        self.text_output.insert(tk.END, f"距离值: {distance:.4f} (阈值: {threshold:.4f})\n")
+        self.text_output.insert(tk.END, f"模型: {result['model']}\n")
+
+        # 设置结果颜色
+        if result['verified']:
+            self.text_output.tag_add("success", "2.0", "2.end")
+            self.text_output.tag_config("success", foreground="#4caf50")
+        else:
+            self.text_output.tag_add("error", "2.0", "2.end")
+            self.text_output.tag_config("error", foreground="#f44336")
+
+        self.update_status("人脸验证完成")
 
     # 3. 人脸识别
     def show_find_screen(self):
@@ -197,38 +262,32 @@ class FaceRecognitionApp:
             self.update_status("取消选择数据库")
             return
 
-        if img_path and db_path:
-            self.update_status(f"正在识别人脸，数据库: {db_path}...")
-            try:
-                dfs = DeepFace.find(img_path=img_path, db_path=db_path, enforce_detection=False,
-                                    detector_backend='retinaface')
-                self.notebook.select(1)  # 切换到分析结果标签页
-                self.text_output.insert(tk.END, "===== 人脸识别结果 =====\n", "title")
-
-                if not dfs or dfs[0].empty:
-                    self.text_output.insert(tk.END, "未在数据库中找到匹配的人脸\n")
-                    self.update_status("未找到匹配")
-                    return
-
-                for df in dfs:
-                    # 只显示前5个匹配结果
-                    top_results = df.head(5)
-
-                    for idx, row in top_results.iterrows():
-                        identity = os.path.basename(os.path.dirname(row['identity']))
-                        distance = row['distance']
-                        similarity = (1 - distance) * 100
-
-                        self.text_output.insert(tk.END, f"\n身份: {identity}\n")
-                        self.text_output.insert(tk.END, f"相似度: {similarity:.2f}%\n")
-                        self.text_output.insert(tk.END, f"文件路径: {row['identity']}\n")
-                        self.text_output.insert(tk.END, "-" * 50 + "\n")
-
-                self.update_status(f"找到 {len(dfs[0])} 个匹配结果")
-            except Exception as e:
-                messagebox.showerror("识别错误", f"人脸识别失败: {str(e)}")
-                self.text_output.insert(tk.END, f"错误详情: {str(e)}\n")
-                self.update_status("识别出错")
+        self.update_status(f"正在识别人脸，数据库: {db_path}... (按ESC取消)")
+        self.tasks.submit('analysis', find_task, img_path, db_path, on_done=self.show_find_result,
+                          on_error=self.task_failed("识别错误", "人脸识别失败", "识别出错"),
+                          on_progress=self.update_status, on_cancel=self.task_cancelled)
+
+    def show_find_result(self, matches):
+        self.notebook.select(1)  # 切换到分析结果标签页
+        self.text_output.insert(tk.END, "===== 人脸识别结果 =====\n", "title")
+
+        if not matches or not any(results for face, results in matches):
+            self.text_output.insert(tk.END, "未在数据库中找到匹配的人脸\n")
+            self.update_status("未找到匹配")
+            return
+
+        for face, results in matches:
+            # 只显示前5个匹配结果
+            for result in results:
+                distance = result['distance']
+                similarity = (1 - distance) * 100
+
+                self.text_output.insert(tk.END, f"\n身份: {result['identity']}\n")
+                self.text_output.insert(tk.END, f"相似度: {similarity:.2f}%\n")
+                self.text_output.insert(tk.END, f"文件路径: {result['path']}\n")
+                self.text_output.insert(tk.END, "-" * 50 + "\n")
+
+        self.update_status(f"找到 {len(matches[0][1])} 个匹配结果")
 
     # 4. 面部属性分析
     def show_analyze_screen(self):
@@ -243,81 +302,79 @@ class FaceRecognitionApp:
             return
 
         self.display_image(img_path)
-        self.update_status(f"正在分析: {os.path.basename(img_path)}...")
-        try:
-            objs = DeepFace.analyze(img_path, actions=['age', 'gender', 'race', 'emotion'], enforce_detection=False,
-                                    detector_backend='retinaface')
-            self.notebook.select(1)  # 切换到分析结果标签页
-            for obj in objs:
-                # 格式化性别输出
-                gender_data = obj['gender']
-                man_prob = gender_data.get('Man', 0)
-                woman_prob = gender_data.get('Woman', 0)
-
-                if man_prob > 90 or woman_prob > 90:
-                    gender_str = "男" if man_prob > woman_prob else "女"
-                    gender_color = "#4caf50"  # 绿色表示高置信度
-                elif man_prob > 60 or woman_prob > 60:
-                    dominant = "男" if man_prob > woman_prob else "女"
-                    gender_str = f"大概率{dominant} (男:{man_prob:.1f}%, 女:{woman_prob:.1f}%)"
-                    gender_color = "#ff9800"  # 橙色表示中等置信度
-                else:
-                    gender_str = f"无法判断 (男:{man_prob:.1f}%, 女:{woman_prob:.1f}%)"
-                    gender_color = "#f44336"  # 红色表示低置信度
-
-                # 格式化种族输出
-                race_data = obj['race']
-                # 获取概率最高的种族
-                dominant_race = max(race_data, key=race_data.get)
-
-                # 种族名称映射到中文
-                race_mapping = {'asian': '亚洲人', 'indian': '印度人', 'black': '黑人', 'white': '白人',
-                    'middle eastern': '中东人', 'latino hispanic': '拉丁裔'}
-
-                race_str = race_mapping.get(dominant_race, dominant_race)
-
-                # 格式化情感输出
-                emotion_mapping = {'angry': '生气', 'disgust': '厌恶', 'fear': '恐惧', 'happy': '开心', 'sad': '伤心',
-                    'surprise': '惊讶', 'neutral': '中性'}
-
-                emotion_str = emotion_mapping.get(obj['dominant_emotion'], obj['dominant_emotion'])
-
-                # 输出格式化结果
-                self.text_output.insert(tk.END, "===== 面部分析结果 =====\n", "title")
-                self.text_output.insert(tk.END, f"年龄: {obj['age']}\n")
-                self.text_output.insert(tk.END, f"性别: {gender_str}\n")
-                self.text_output.tag_add("gender", "3.0", "3.end")
-                self.text_output.tag_config("gender", foreground=gender_color)
-
-                self.text_output.insert(tk.END, f"种族: {race_str}\n")
-                self.text_output.insert(tk.END, f"情感: {emotion_str}\n\n")
-
-                # 添加详细数据
-                self.text_output.insert(tk.END, "详细分析数据:\n", "subtitle")
-                self.text_output.insert(tk.END, f"  - 性别概率: 男 {man_prob:.1f}%, 女 {woman_prob:.1f}%\n")
-
-                # 种族概率 - 按概率降序排列
-                self.text_output.insert(tk.END, "  - 种族概率 (降序):\n")
-                # 按概率值降序排序
-                sorted_race = sorted(race_data.items(), key=lambda x: x[1], reverse=True)
-                for race, prob in sorted_race:
-                    chinese_race = race_mapping.get(race, race)
-                    self.text_output.insert(tk.END, f"      {chinese_race}: {prob:.1f}%\n")
-
-                # 情感概率 - 按概率降序排列
-                self.text_output.insert(tk.END, "  - 情感概率 (降序):\n")
-                emotion_data = obj['emotion']
-                # 按概率值降序排序
-                sorted_emotion = sorted(emotion_data.items(), key=lambda x: x[1], reverse=True)
-                for emotion, prob in sorted_emotion:
-                    chinese_emotion = emotion_mapping.get(emotion, emotion)
-                    self.text_output.insert(tk.END, f"      {chinese_emotion}: {prob:.1f}%\n")
-
-            self.update_status("面部分析完成")
-        except Exception as e:
-            messagebox.showerror("分析错误", f"面部分析失败: {str(e)}")
-            self.text_output.insert(tk.END, f"错误详情: {str(e)}\n")
-            self.update_status("分析出错")
+        self.update_status(f"正在分析: {os.path.basename(img_path)}... (按ESC取消)")
+        self.tasks.submit('analysis', analyze_task, img_path, on_done=self.show_analyze_result,
+                          on_error=self.task_failed("分析错误", "面部分析失败", "分析出错"),
+                          on_progress=self.update_status, on_cancel=self.task_cancelled)
+
+    def show_analyze_result(self, objs):
+        self.notebook.select(1)  # 切换到分析结果标签页
+        for obj in objs:
+            # 格式化性别输出
+            gender_data = obj['gender']
+            man_prob = gender_data.get('Man', 0)
+            woman_prob = gender_data.get('Woman', 0)
+
+            if man_prob > 90 or woman_prob > 90:
+                gender_str = "男" if man_prob > woman_prob else "女"
+                gender_color = "#4caf50"  # 绿色表示高置信度
+            elif man_prob > 60 or woman_prob > 60:
+                dominant = "男" if man_prob > woman_prob else "女"
+                gender_str = f"大概率{dominant} (男:{man_prob:.1f}%, 女:{woman_prob:.1f}%)"
+                gender_color = "#ff9800"  # 橙色表示中等置信度
+            else:
+                gender_str = f"无法判断 (男:{man_prob:.1f}%, 女:{woman_prob:.1f}%)"
+                gender_color = "#f44336"  # 红色表示低置信度
+
+            # 格式化种族输出
+            race_data = obj['race']
+            # 获取概率最高的种族
+            dominant_race = max(race_data, key=race_data.get)
+
+            # 种族名称映射到中文
+            race_mapping = {'asian': '亚洲人', 'indian': '印度人', 'black': '黑人', 'white': '白人',
+                'middle eastern': '中东人', 'latino hispanic': '拉丁裔'}
+
+            race_str = race_mapping.get(dominant_race, dominant_race)
+
+            # 格式化情感输出
+            emotion_mapping = {'angry': '生气', 'disgust': '厌恶', 'fear': '恐惧', 'happy': '开心', 'sad': '伤心',
+                'surprise': '惊讶', 'neutral': '中性'}
+
+            emotion_str = emotion_mapping.get(obj['dominant_emotion'], obj['dominant_emotion'])
+
+            # 输出格式化结果
+            self.text_output.insert(tk.END, "===== 面部分析结果 =====\n", "title")
+            self.text_output.insert(tk.END, f"年龄: {obj['age']}\n")
+            self.text_output.insert(tk.END, f"性别: {gender_str}\n")
+            self.text_output.tag_add("gender", "3.0", "3.end")
+            self.text_output.tag_config("gender", foreground=gender_color)
+
+            self.text_output.insert(tk.END, f"种族: {race_str}\n")
+            self.text_output.insert(tk.END, f"情感: {emotion_str}\n\n")
+
+            # 添加详细数据
+            self.text_output.insert(tk.END, "详细分析数据:\n", "subtitle")
+            self.text_output.insert(tk.END, f"  - 性别概率: 男 {man_prob:.1f}%, 女 {woman_prob:.1f}%\n")
+
+            # 种族概率 - 按概率降序排列
+            self.text_output.insert(tk.END, "  - 种族概率 (降序):\n")
+            # 按概率值降序排序
+            sorted_race = sorted(race_data.items(), key=lambda x: x[1], reverse=True)
+            for race, prob in sorted_race:
+                chinese_race = race_mapping.get(race, race)
+                self.text_output.insert(tk.END, f"      {chinese_race}: {prob:.1f}%\n")
+
+            # 情感概率 - 按概率降序排列
+            self.text_output.insert(tk.END, "  - 情感概率 (降序):\n")
+            emotion_data = obj['emotion']
+            # 按概率值降序排序
+            sorted_emotion = sorted(emotion_data.items(), key=lambda x: x[1], reverse=True)
+            for emotion, prob in sorted_emotion:
+                chinese_emotion = emotion_mapping.get(emotion, emotion)
+                self.text_output.insert(tk.END, f"      {chinese_emotion}: {prob:.1f}%\n")
+
+        self.update_status("面部分析完成")
 
     def toggle_stream_analysis(self):
         """切换实时分析状态"""
@@ -328,6 +385,9 @@ class FaceRecognitionApp:
 
     def start_stream_analysis(self):
         """开始实时分析"""
+        if self.stream_thread is not None and self.stream_thread.is_alive():
+            self.update_status("正在停止上一次实时分析，请稍候...")
+            return
         self.update_status("请选择数据库文件夹...")
         self.clear_output()
         self.notebook.select(1)  # 切换到分析结果标签页
@@ -366,100 +426,75 @@ class FaceRecognitionApp:
             self.capture = cv2.VideoCapture(0)
             self.capture.set(cv2.CAP_PROP_FPS, 30)
             if not self.capture.isOpened():
-                self.update_status("无法打开摄像头")
-                self.text_output.insert(tk.END, "错误: 无法访问摄像头\n")
-                self.stop_stream_analysis()
+                self.tasks.call(self.update_status, "无法打开摄像头")
+                self.tasks.call(self.text_output.insert, tk.END, "错误: 无法访问摄像头\n")
                 return
             cv2.namedWindow('Real-time Face Recognition', cv2.WINDOW_NORMAL)
             cv2.resizeWindow('Real-time Face Recognition', 800, 600)
-            frame_counter = 0
-            cached_results = []  # 存储上一轮分析结果：[{"rect": (x,y,w,h), "text": str, "color": tuple}]
+            # 由调度器按运动量和推理耗时决定哪些帧做检测，只识别新出现或需要复核的人脸，其余帧用光流跟踪人脸框
+            tracker = face_tracker.FaceTracker(face_stream.StreamRecognizer(db_path))
+            scheduler = face_scheduler.RecognitionScheduler(target_fps=30)
+            # 设置环境变量 FACE_METRICS_PORT / FACE_METRICS_JSONL / FACE_METRICS_OVERLAY 开启指标导出和叠加显示
+            metrics = face_metrics.metrics
+            self.metrics_exporter = face_metrics.MetricsExporter(metrics, port=face_metrics.ENV_PORT,
+                                                                 jsonl_path=face_metrics.ENV_JSONL).start()
             while self.stream_active:
                 ret, frame = self.capture.read()
                 if not ret:
                     print("无法从摄像头读取帧！")
                     break
+                metrics.inc('frames_read')
                 try:
-                    if frame_counter % 3 == 0:
-                        cached_results = []  # 清空缓存
-                        detections = DeepFace.extract_faces(img_path=frame, detector_backend='opencv',
-                                                            enforce_detection=False)
-                        all_results = DeepFace.find(img_path=frame, db_path=db_path, enforce_detection=False,
-                                                    silent=True)
-                        for i, det in enumerate(detections):
-                            facial_area = det['facial_area']
-                            x, y, w, h = facial_area['x'], facial_area['y'], facial_area['w'], facial_area['h']
-                            face_info = {"rect": (x, y, w, h)}
-                            if i < len(all_results):
-                                face_results = all_results[i]
-                                if face_results.empty:
-                                    identity = "no matched"
-                                    similarity = 0
-                                    color = (0, 0, 255)
-                                else:
-                                    best_match = face_results.sort_values('distance').iloc[0]
-                                    if best_match['distance'] <= 0.6:
-                                        identity = os.path.basename(os.path.dirname(best_match['identity']))
-                                        similarity = (1 - best_match['distance']) * 100
-                                        color = (0, 255, 0)
-                                    else:
-                                        identity = "unknown face"
-                                        similarity = 0
-                                        color = (0, 0, 255)
-                            else:
-                                identity = "no results"
-                                similarity = 0
-                                color = (0, 0, 255)
-                            text = f"{identity}: {similarity:.1f}%"
-                            face_info["text"] = text
-                            face_info["color"] = color
-                            cached_results.append(face_info)  # 缓存结果
-                            cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
-                            cv2.putText(frame, text, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+                    if scheduler.should_run(frame, bool(tracker.tracks)):
+                        metrics.inc('frames_analysed')
+                        results = scheduler.timed(tracker.update, frame, detect=True)
                     else:
-                        for result in cached_results:
-                            x, y, w, h = result["rect"]
-                            text = result["text"]
-                            color = result["color"]
-                            cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
-                            cv2.putText(frame, text, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+                        metrics.inc('frames_skipped')
+                        results = tracker.update(frame, detect=False)
+                    face_stream.draw_results(frame, results)
+                    face_stream.draw_status(frame, scheduler.status_text())
                 except Exception as e:
                     import traceback
                     traceback.print_exc()
                     print(f"发生错误: {e}")
-                    cached_results = []  # 出错时清空缓存
+                    metrics.inc('errors')
+                    tracker.reset()  # 出错时清空轨迹
+                if face_metrics.ENV_OVERLAY:
+                    face_stream.draw_metrics(frame)
                 cv2.imshow('Real-time Face Recognition', frame)
-                frame_counter = (frame_counter + 1) % 3  # 计数循环0-1-2
+                metrics.frame()
 
                 if cv2.waitKey(1) == 27:
-                    self.stop_stream_analysis()
                     break
 
-            self.cleanup_stream()
-            self.update_status("实时分析已停止")
+            print(scheduler.summary())
+            self.tasks.call(self.update_status, "实时分析已停止")
+            self.tasks.call(self.text_output.insert, tk.END, "实时分析已停止\n")
         except Exception as e:
-            self.update_status(f"实时分析出错: {str(e)}")
-            self.text_output.insert(tk.END, f"错误详情: {str(e)}\n")
-            self.cleanup_stream()
+            self.tasks.call(self.update_status, f"实时分析出错: {str(e)}")
+            self.tasks.call(self.text_output.insert, tk.END, f"错误详情: {str(e)}\n")
         finally:
+            # 摄像头和 OpenCV 窗口由本线程释放，界面控件只通过 tasks.call 交给主线程更新
             self.stream_active = False
-            self.master.after(0, self.restore_stream_button)
+            self.cleanup_stream()
+            self.tasks.call(self.restore_stream_button)
 
     def cleanup_stream(self):
         """清理实时分析资源"""
         if self.capture is not None:
             self.capture.release()
             self.capture = None
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.stop()
+            self.metrics_exporter = None
         cv2.destroyAllWindows()
 
     def stop_stream_analysis(self, event=None):
         """停止实时分析"""
         if self.stream_active:
+            # 只通知分析线程退出，资源释放和按钮恢复由分析线程结束时完成
             self.stream_active = False
             self.update_status("正在停止实时分析...")
-            self.text_output.insert(tk.END, "实时分析已停止\n")
-            self.cleanup_stream()
-            self.restore_stream_button()
 
     def restore_stream_button(self):
         """恢复实时分析按钮的原始状态"""
@@ -474,12 +509,10 @@ class FaceRecognitionApp:
         """显示选中的图片"""
         try:
             self.notebook.select(0)
-            img = Image.open(img_path)
             tab_width = self.image_tab.winfo_width() - 20
             tab_height = self.image_tab.winfo_height() - 20
-            # 调整图片大小以适应窗口
-            if tab_width > 0 and tab_height > 0:
-                img.thumbnail((tab_width, tab_height), Image.LANCZOS)
+            # 预览用缩小解码的图像，并留在缓存中供随后的人脸检测直接使用，不再按原分辨率解码两次
+            img = face_image.preview(img_path, (tab_width, tab_height))
             img_tk = ImageTk.PhotoImage(img)
             self.image_label.config(image=img_tk)
             self.image_label.image = img_tk  # 保持引用
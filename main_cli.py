@@ -1,8 +1,41 @@
 import argparse
+import json
 import os
+import sys
+import time
 
-import cv2
-from deepface import DeepFace
+import face_client
+from face_profile import profiler
+
+# cv2、deepface（以及 tensorflow）等重量级依赖只在具体命令需要时才导入，--help 和参数校验可以立即返回
+
+use_server = True  # 有模型服务在运行时自动使用
+detector_backend = None  # --detector 指定的检测器，None 时各命令使用自己的默认检测器
+
+
+def detector(default='retinaface'):
+    return detector_backend or default
+
+
+def remote(endpoint, payload):
+    """模型服务在运行时把请求转发给它并返回结果，否则返回 None 由本进程自行计算"""
+    # 模型服务使用自己启动时的检测器，指定 --detector 时在本进程中计算
+    if not use_server or detector_backend or not face_client.server_available():
+        return None
+    return face_client.request(endpoint, payload)
+
+
+def preload_models(models=(), detectors=(), actions=()):
+    """--profile-startup 时提前加载本次命令要用的模型，分别统计每个模型的加载耗时"""
+    if not profiler.enabled:
+        return
+    import face_engine
+    for detector_backend in detectors:
+        face_engine.warm_detector(detector_backend)
+    for model_name in models:
+        face_engine.get_model(model_name)
+    for action in actions:
+        face_engine.get_attribute_model(action)
 
 
 # python main_cli.py verify images/cxk/cxk1.png images/cxk/cxk2.png
@@ -10,7 +43,11 @@ def verify_faces(img1_path, img2_path):
     """人脸验证功能"""
     print(f"正在验证: {img1_path} 和 {img2_path}")
     try:
-        result = DeepFace.verify(img1_path, img2_path, enforce_detection=False, detector_backend='retinaface')
+        result = remote('verify', {'img1': os.path.abspath(img1_path), 'img2': os.path.abspath(img2_path)})
+        if result is None:
+            import face_engine
+            preload_models(models=['VGG-Face'], detectors=[detector()])
+            result = face_engine.verify(img1_path, img2_path, detector_backend=detector())
         verified = "匹配" if result['verified'] else "不匹配"
         similarity = 1 - result['distance']
 
@@ -24,30 +61,53 @@ def verify_faces(img1_path, img2_path):
 
 
 # python main_cli.py find images/cxk/cxk1.png images
-def find_face(img_path, db_path):
+def find_face(img_path, db_path, nprobe=None, shortlist=None, rerank=None, shards=None, shard_timeout=None):
     """人脸识别功能"""
     print(f"在数据库 {db_path} 中识别图像 {img_path}")
     try:
-        dfs = DeepFace.find(img_path=img_path, db_path=db_path, enforce_detection=False, detector_backend='retinaface')
+        if shards:
+            # 在分片服务上检索，特征在本进程中提取
+            import face_shard
+            preload_models(detectors=[detector()])
+            coordinator = face_shard.ShardCoordinator(shards.split(','),
+                                                      timeout=shard_timeout or face_shard.DEFAULT_TIMEOUT)
+            try:
+                matches, status = face_shard.find(img_path, coordinator, k=5, detector_backend=detector(),
+                                                  nprobe=nprobe, shortlist=shortlist, rerank=rerank)
+            finally:
+                coordinator.close()
+            failed = {i: value for i, value in status.items() if value != 'ok'}
+            if failed:
+                print("警告: 以下分片没有返回结果，结果可能不完整: " +
+                      ", ".join(f"{coordinator.addresses[i]} ({value})" for i, value in sorted(failed.items())))
+        else:
+            matches = remote('find', {'img': os.path.abspath(img_path), 'db': os.path.abspath(db_path), 'k': 5,
+                                      'nprobe': nprobe, 'shortlist': shortlist, 'rerank': rerank})
+        if matches is None:
+            import face_index
+            preload_models(detectors=[detector()])
+            # 特征库仍按 retinaface 建立，--detector 只替换待识别图像的检测器
+            matches = face_index.find(img_path, db_path, k=5, probe_detector=detector(), nprobe=nprobe,
+                                      shortlist=shortlist, rerank=rerank)
 
-        if not dfs or dfs[0].empty:
+        if not matches or not any(results for face, results in matches):
             print("\n===== 人脸识别结果 =====")
             print("未在数据库中找到匹配的人脸")
             return
 
         print("\n===== 人脸识别结果 =====")
-        print(f"找到 {len(dfs[0])} 个匹配结果")
+        print(f"找到 {len(matches[0][1])} 个匹配结果")
         print("\n前5个匹配结果:")
 
-        for df in dfs:
-            top_results = df.head(5)
-            for idx, row in top_results.iterrows():
-                identity = os.path.basename(os.path.dirname(row['identity']))
-                similarity = (1 - row['distance']) * 100
+        for face, results in matches:
+            for result in results:
+                similarity = (1 - result['distance']) * 100
 
-                print(f"\n身份: {identity}")
+                print(f"\n身份: {result['identity']}")
                 print(f"相似度: {similarity:.2f}%")
-                print(f"文件路径: {row['identity']}")
+                if 'prototype_distance' in result:
+                    print(f"身份原型相似度: {(1 - result['prototype_distance']) * 100:.2f}%")
+                print(f"文件路径: {result['path']}")
                 print("-" * 50)
     except Exception as e:
         print(f"识别失败: {str(e)}")
@@ -58,7 +118,12 @@ def analyze_face(img_path):
     """面部属性分析功能"""
     print(f"正在分析图像: {img_path}")
     try:
-        objs = DeepFace.analyze(img_path, actions=['age', 'gender', 'race', 'emotion'], enforce_detection=False, detector_backend='retinaface')
+        objs = remote('analyze', {'img': os.path.abspath(img_path), 'actions': ['age', 'gender', 'race', 'emotion']})
+        if objs is None:
+            import face_attributes
+            preload_models(detectors=[detector()], actions=['age', 'gender', 'race', 'emotion'])
+            objs = face_attributes.analyze_image(img_path, actions=['age', 'gender', 'race', 'emotion'],
+                                                 detector_backend=detector())
 
         print("\n===== 面部分析结果 =====")
         for i, obj in enumerate(objs):
@@ -119,12 +184,36 @@ def analyze_face(img_path):
         print(f"分析失败: {str(e)}")
 
 
+# python main_cli.py analyze-batch images/ --actions emotion -o emotions.jsonl
+def analyze_batch(probes, actions, output=None, batch_size=32):
+    """批量面部属性分析功能"""
+    import face_batch
+
+    try:
+        start = time.time()
+        summary = face_batch.analyze_batch(probes, actions, output=output, detector_backend=detector(),
+                                           batch_size=batch_size)
+        print(f"批量分析完成: 共 {summary['images']} 张图片，{summary['faces']} 张人脸，失败 {summary['errors']} 张，"
+              f"耗时 {time.time() - start:.2f} 秒", file=sys.stderr)
+    except Exception as e:
+        print(f"批量分析失败: {str(e)}", file=sys.stderr)
+
+
 # python main_cli.py stream images
-def stream_analysis(db_path):
+def stream_analysis(db_path, pipelined=False, workers=2, target_fps=15, metrics_port=None, metrics_jsonl=None,
+                    overlay=False):
     """实时分析功能"""
+    import cv2
+    import face_metrics
+    import face_scheduler
+    import face_stream
+    import face_tracker
+    from face_metrics import metrics
+
     print(f"启动实时分析，数据库: {db_path}")
     print("按ESC键可退出实时分析")
 
+    exporter = None
     try:
         capture = cv2.VideoCapture(0)
         if not capture.isOpened():
@@ -134,6 +223,17 @@ def stream_analysis(db_path):
         cv2.namedWindow('Real-time Face Recognition', cv2.WINDOW_NORMAL)
         cv2.resizeWindow('Real-time Face Recognition', 800, 600)
 
+        exporter = face_metrics.MetricsExporter(metrics, port=metrics_port, jsonl_path=metrics_jsonl).start()
+        if metrics_port:
+            print(f"指标导出: http://127.0.0.1:{metrics_port}/metrics")
+
+        if pipelined:
+            pipelined_stream_analysis(capture, db_path, workers, overlay)
+            return
+
+        recognizer = face_stream.StreamRecognizer(db_path, detector_backend=detector(face_stream.STREAM_DETECTOR))
+        tracker = face_tracker.FaceTracker(recognizer)
+        scheduler = face_scheduler.RecognitionScheduler(target_fps=target_fps)
         print("实时分析运行中...")
         while True:
             if cv2.waitKey(1) == 27:  # ESC键
@@ -142,33 +242,572 @@ def stream_analysis(db_path):
             ret, frame = capture.read()
             if not ret:
                 break
+            metrics.inc('frames_read')
 
             try:
-                results = DeepFace.find(img_path=frame, db_path=db_path, enforce_detection=False, silent=True)
-
-                if results and not results[0].empty:
-                    result = results[0].iloc[0]
-                    identity = os.path.basename(os.path.dirname(result['identity']))
-                    similarity = (1 - result['distance']) * 100
-
-                    text = f"{identity}: {similarity:.2f}%"
-                    cv2.putText(frame, text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+                if scheduler.should_run(frame, bool(tracker.tracks)):
+                    metrics.inc('frames_analysed')
+                    results = scheduler.timed(tracker.update, frame, detect=True)
+                else:
+                    metrics.inc('frames_skipped')
+                    results = tracker.update(frame, detect=False)
+                face_stream.draw_results(frame, results)
+                face_stream.draw_status(frame, scheduler.status_text())
             except:
-                pass
+                metrics.inc('errors')
+                tracker.reset()
 
+            if overlay:
+                face_stream.draw_metrics(frame)
             cv2.imshow('Real-time Face Recognition', frame)
+            metrics.frame()
 
         capture.release()
         cv2.destroyAllWindows()
+        print(scheduler.summary())
         print("实时分析已停止")
     except Exception as e:
         print(f"实时分析出错: {str(e)}")
+    finally:
+        if exporter is not None:
+            exporter.stop()
+
+
+def pipelined_stream_analysis(capture, db_path, workers, overlay=False):
+    """流水线模式：采集、推理、绘制分别在不同线程，显示帧率不受推理速度限制"""
+    import cv2
+    import face_pipeline
+    import face_stream
+    from face_metrics import metrics
+
+    recognizer = face_stream.StreamRecognizer(db_path, detector_backend=detector(face_stream.STREAM_DETECTOR))
+    pipeline = face_pipeline.StreamPipeline(capture, recognizer.recognize, workers=workers).start()
+    print(f"实时分析运行中 (流水线模式，{workers} 个推理线程)...")
+    last_seq = None
+    try:
+        while cv2.waitKey(1) != 27:  # ESC键
+            seq, frame = pipeline.render(last_seq=last_seq)
+            if frame is None:
+                if pipeline.finished:
+                    break
+                continue
+            last_seq = seq
+            if overlay:
+                face_stream.draw_metrics(frame)
+            cv2.imshow('Real-time Face Recognition', frame)
+            metrics.frame()
+    finally:
+        pipeline.stop()
+        capture.release()
+        cv2.destroyAllWindows()
+    stats = pipeline.stats
+    print(f"采集 {stats['frames_read']} 帧，识别 {stats['frames_analysed']} 帧，丢弃 {stats['frames_dropped']} 帧，"
+          f"显示 {stats['frames_rendered']} 帧")
+    print(f"平均端到端延迟: {stats['latency_ms']:.0f} ms，平均推理耗时: {stats['inference_ms']:.0f} ms")
+    print("实时分析已停止")
+
+
+# python main_cli.py process-video footage.mp4 images -o frames.jsonl --video-out annotated.mp4
+def process_video(source, db_path, output=None, video_output=None, stride=1, workers=None, batch_size=32):
+    """无界面处理视频文件、图片序列或网络流"""
+    import face_video
+
+    def progress(frames, elapsed):
+        print(f"\r已处理 {frames} 帧，{frames / max(elapsed, 1e-9):.1f} 帧/秒", end='', file=sys.stderr)
+
+    try:
+        stats = face_video.process_video(source, db_path, output=output, video_output=video_output, stride=stride,
+                                         workers=workers, batch_size=batch_size, on_progress=progress)
+        realtime = f"，{stats['realtime_factor']:.1f} 倍实时速度" if stats['realtime_factor'] else ""
+        print(f"\n处理完成: {stats['frames']} 帧，{stats['faces']} 张人脸，匹配 {stats['matched']} 张，"
+              f"失败 {stats['errors']} 帧，耗时 {stats['elapsed']:.2f} 秒 ({stats['processing_fps']:.1f} 帧/秒{realtime})",
+              file=sys.stderr)
+        if video_output:
+            print(f"标注视频已写入: {video_output}", file=sys.stderr)
+    except Exception as e:
+        print(f"视频处理失败: {str(e)}", file=sys.stderr)
+
+
+# python main_cli.py stream-multi images 0 1 rtsp://camera/stream --fps 5
+def multi_stream_analysis(db_path, sources, target_fps, max_age=1.0, output=None, display=False, stats_interval=10):
+    """多路视频源共用一套模型做实时识别"""
+    import cv2
+    import face_multi
+    import face_stream
+
+    try:
+        fps = target_fps[0] if len(target_fps) == 1 else target_fps
+        scheduler = face_multi.MultiStreamScheduler(sources, db_path, target_fps=fps, max_age=max_age).start()
+    except Exception as e:
+        print(f"多路实时分析启动失败: {str(e)}", file=sys.stderr)
+        return
+
+    out = open(output, 'w', encoding='utf-8') if output else (None if display else sys.stdout)
+    stopping = []
+    last_report = [time.time()]
+
+    def on_result(source_id, seq, frame, results):
+        if out is not None:
+            record = face_multi.result_record(source_id, sources[source_id], seq, results)
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        if display:
+            face_stream.draw_results(frame, results)
+            cv2.imshow(f"Source {source_id}", frame)
+            if cv2.waitKey(1) == 27:  # ESC键
+                stopping.append(True)
+        if time.time() - last_report[0] >= stats_interval:
+            last_report[0] = time.time()
+            print(face_multi.format_summary(scheduler.summary()), file=sys.stderr)
+
+    print(f"多路实时分析: {len(sources)} 路视频源 (按 Ctrl+C 停止)", file=sys.stderr)
+    try:
+        scheduler.run(on_result, should_stop=lambda: bool(stopping))
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"多路实时分析出错: {str(e)}", file=sys.stderr)
+    finally:
+        scheduler.stop()
+        if display:
+            cv2.destroyAllWindows()
+        if output and out is not None:
+            out.close()
+    print(face_multi.format_summary(scheduler.summary()), file=sys.stderr)
+
+
+# python main_cli.py verify-batch pairs.csv -o results.jsonl
+def verify_batch(pairs_path, output=None, batch_size=32):
+    """批量人脸验证功能"""
+    import face_batch
+
+    try:
+        start = time.time()
+        summary = face_batch.verify_batch(pairs_path, output=output, detector_backend=detector(),
+                                          batch_size=batch_size)
+        print(f"批量验证完成: 共 {summary['pairs']} 对，匹配 {summary['verified']} 对，失败 {summary['errors']} 对，"
+              f"耗时 {time.time() - start:.2f} 秒", file=sys.stderr)
+    except Exception as e:
+        print(f"批量验证失败: {str(e)}", file=sys.stderr)
+
+
+# python main_cli.py find-batch probes/ VGG-Face2 -o matches.jsonl
+def find_batch(probes, db_path, output=None, fmt='jsonl', workers=None, k=5):
+    """多进程批量人脸识别功能"""
+    import face_batch
+
+    try:
+        start = time.time()
+        # 与 find 相同，特征库仍按 retinaface 建立，--detector 只替换待识别图片的检测器
+        summary = face_batch.find_batch(probes, db_path, output=output, fmt=fmt, workers=workers, k=k,
+                                        probe_detector=detector())
+        elapsed = time.time() - start
+        print(f"批量识别完成: 共 {summary['images']} 张图片，{summary['faces']} 张人脸，匹配 {summary['matched']} 张，"
+              f"失败 {summary['errors']} 张，耗时 {elapsed:.2f} 秒 ({summary['images'] / max(elapsed, 1e-9):.1f} 张/秒)",
+              file=sys.stderr)
+    except Exception as e:
+        print(f"批量识别失败: {str(e)}", file=sys.stderr)
+
+
+# python main_cli.py index VGG-Face2
+def index_gallery(db_path, rebuild=False, pkl_path=None, ann=False, nlist=None, nprobe=None, storage=None, pq_m=64):
+    """增量更新数据库特征库"""
+    import face_index
+
+    print(f"正在更新数据库特征库: {db_path}")
+    try:
+        if pkl_path:
+            index = face_index.import_deepface_pickle(db_path, pkl_path)
+            print(f"已从 {pkl_path} 导入 {len(index)} 条人脸特征")
+            return
+
+        start = time.time()
+        index, stats = face_index.update_index(db_path, rebuild=rebuild)
+
+        print("\n===== 特征库更新结果 =====")
+        print(f"新增图片: {stats['added']}")
+        print(f"修改图片: {stats['changed']}")
+        print(f"删除图片: {stats['removed']}")
+        print(f"未变图片: {stats['unchanged']}")
+        if stats.get('failed'):
+            print(f"提取失败: {stats['failed']} (下次运行时重试)")
+        print(f"人脸总数: {len(index)}")
+        if ann and len(index):
+            import face_ann
+            ivf = face_index.build_ann(index, nlist=nlist, nprobe=nprobe or face_ann.DEFAULT_NPROBE)
+            print(f"倒排近似索引: {ivf.nlist} 个倒排表，默认 nprobe={ivf.nprobe}")
+        elif index.ann is not None:
+            print(f"倒排近似索引: {index.ann.nlist} 个倒排表（已随特征库更新）")
+        if storage and len(index):
+            quantized = face_index.build_quantized(index, storage, pq_m=pq_m)
+            print(f"压缩特征: {storage}，占用内存 {quantized.nbytes / 2 ** 20:.1f} MB "
+                  f"(原始 {index.embeddings.nbytes / 2 ** 20:.1f} MB)")
+        elif index.quantized is not None:
+            print(f"压缩特征: {index.quantized.codec.name}（已随特征库更新）")
+        print(f"耗时: {time.time() - start:.2f} 秒")
+        print(f"特征库位置: {index.index_dir}")
+    except Exception as e:
+        print(f"更新特征库失败: {str(e)}")
+
+
+# python main_cli.py ann-bench VGG-Face2
+def ann_benchmark(db_path, sample=200, k=5, nprobes=(1, 2, 4, 8, 16, 32, 64)):
+    """倒排近似检索与精确检索的 recall@k / 延迟对比"""
+    import face_ann
+    import face_index
+
+    try:
+        index = face_index.open_index(db_path, build=False)
+        if index.ann is None:
+            print("特征库还没有倒排近似索引，请先运行: python main_cli.py index <db> --ann")
+            return
+        print(f"特征库: {len(index)} 张人脸，{index.ann.nlist} 个倒排表，查询 {min(sample, len(index))} 次，k={k}")
+        print(f"\n{'nprobe':>8} {'recall@' + str(k):>10} {'延迟(ms)':>10} {'候选数':>12}")
+        for row in face_ann.benchmark(index, sample=sample, k=k, nprobes=nprobes):
+            name = '精确' if row['nprobe'] == 0 else str(row['nprobe'])
+            print(f"{name:>8} {row['recall']:>10.3f} {row['latency_ms']:>10.2f} {row['candidates']:>12.0f}")
+    except Exception as e:
+        print(f"基准测试失败: {str(e)}")
+
+
+# python main_cli.py quant-report VGG-Face2
+def quantization_report(db_path, sample=200, k=5, rerank=100, formats=('float16', 'int8', 'pq'), pq_m=64):
+    """对比各压缩存储格式的内存、延迟和准确率"""
+    import face_index
+    import face_quant
+
+    try:
+        index = face_index.open_index(db_path, build=False)
+        print(f"特征库: {len(index)} 张人脸，{len(index.identities)} 个身份，留一法查询 {min(sample, len(index))} 次")
+        print(f"\n{'格式':<8} {'重排':>6} {'内存(MB)':>10} {'字节/人脸':>10} {'码本(KB)':>10} {'延迟(ms)':>10} "
+              f"{'top1':>8} {'recall@' + str(k):>10}")
+        rows = face_quant.report(index, formats=formats, sample=sample, k=k, rerank=rerank, pq_m=pq_m)
+        for row in rows:
+            print(f"{row['format']:<8} {row['rerank']:>6} {row['memory_mb']:>10.1f} {row['bytes_per_face']:>10.0f} "
+                  f"{row['fixed_bytes'] / 1024:>10.1f} {row['latency_ms']:>10.2f} {row['top1']:>8.3f} "
+                  f"{row['recall']:>10.3f}")
+        print("\n按完整 VGG-Face2（331 万张人脸）估算的常驻内存:")
+        for row in rows:
+            if not row['rerank']:
+                projected = row['bytes_per_face'] * 3_310_000 + row['fixed_bytes']
+                print(f"{row['format']:<8} {projected / 2 ** 20:>10.0f} MB")
+    except Exception as e:
+        print(f"生成报告失败: {str(e)}")
+
+
+# python main_cli.py bench VGG-Face2 --json bench.json
+def run_benchmark(db_path, mode='auto', repeat=3, limit=None, gallery_size=0, json_path=None, baseline=None):
+    """分阶段基准测试：decode / detect / align / embed / search / render"""
+    import face_bench
+
+    try:
+        if mode == 'auto':
+            mode = 'real' if face_bench.weights_cached() else 'stub'
+        models = face_bench.RealModels() if mode == 'real' else face_bench.StubModels()
+        print(f"基准测试: {db_path}，模式 {mode}，重复 {repeat} 次", file=sys.stderr)
+        print(f"\n{'阶段':<8} {'次数':>6} {'p50(ms)':>9} {'p90(ms)':>9} {'p99(ms)':>9} {'吞吐(/s)':>10} {'峰值内存(MB)':>12}",
+              file=sys.stderr)
+
+        def show(stage, stats):
+            throughput = f"{stats['throughput']:.1f}" if stats.get('throughput') else '-'
+            rss = f"{stats['peak_rss_mb']:.0f}" if stats.get('peak_rss_mb') is not None else '-'
+            print(f"{stage:<8} {stats['count']:>6} {stats.get('p50_ms', 0):>9.2f} {stats.get('p90_ms', 0):>9.2f} "
+                  f"{stats.get('p99_ms', 0):>9.2f} {throughput:>10} {rss:>12}", file=sys.stderr)
+
+        result = face_bench.run(db_path, models, repeat=repeat, limit=limit, gallery_size=gallery_size,
+                                on_stage=show)
+        print(f"\n图片 {result['images']} 张，人脸 {result['faces']} 张，特征库 {result['gallery_size']} 条",
+              file=sys.stderr)
+        if baseline:
+            print("\n与基线相比的 p50 耗时（>1 表示变慢）:", file=sys.stderr)
+            for stage, ratio in face_bench.compare(result, face_bench.load(baseline)).items():
+                print(f"{stage:<8} {ratio:>6.2f}x", file=sys.stderr)
+        if json_path == '-':
+            print(json.dumps(result, ensure_ascii=False, indent=2))
+        elif json_path:
+            face_bench.save(result, json_path)
+            print(f"结果已写入: {json_path}", file=sys.stderr)
+    except Exception as e:
+        print(f"基准测试失败: {str(e)}", file=sys.stderr)
+
+
+# python main_cli.py decode-bench photos/
+def preprocess_benchmark(db_path, mode='auto', max_side=None, repeat=3, limit=None, json_path=None):
+    """对比原分辨率预处理与缩小解码 + 缩小图检测的耗时和内存"""
+    import face_bench
+    import face_image
+
+    try:
+        if mode == 'auto':
+            mode = 'real' if face_bench.weights_cached() else 'stub'
+        models = face_bench.RealModels() if mode == 'real' else face_bench.StubModels()
+        max_side = max_side or face_image.DETECT_MAX_SIDE
+        result = face_bench.run_preprocess(db_path, models, max_side=max_side, repeat=repeat, limit=limit)
+        print(f"预处理基准: {db_path}，模式 {mode}，{result['images']} 张图片（平均 {result['megapixels']:.1f} 百万像素），"
+              f"检测长边 {max_side}，重复 {repeat} 次", file=sys.stderr)
+        print(f"\n{'流程':<8} {'预览p50(ms)':>12} {'检测p50(ms)':>12} {'合计p50(ms)':>12} {'合计p90(ms)':>12} "
+              f"{'峰值内存(MB)':>12}", file=sys.stderr)
+        for name, stats in result['pipelines'].items():
+            print(f"{name:<8} {stats['preview']['p50_ms']:>12.1f} {stats['detect']['p50_ms']:>12.1f} "
+                  f"{stats['total']['p50_ms']:>12.1f} {stats['total']['p90_ms']:>12.1f} {stats['peak_mb']:>12.1f}",
+                  file=sys.stderr)
+        print(f"\n加速 {result['speedup']:.2f}x，峰值内存降为 1/{result['memory_ratio']:.1f}", file=sys.stderr)
+        if mode == 'stub':
+            print("stub 模式的检测耗时与图像大小无关，检测上的收益需用 --mode real 测量", file=sys.stderr)
+        if json_path == '-':
+            print(json.dumps(result, ensure_ascii=False, indent=2))
+        elif json_path:
+            face_bench.save(result, json_path)
+            print(f"结果已写入: {json_path}", file=sys.stderr)
+    except Exception as e:
+        print(f"基准测试失败: {str(e)}", file=sys.stderr)
+
+
+# python main_cli.py detector-report VGG-Face2
+def detector_report(db_path, limit=None, iou=0.5, json_path=None):
+    """逐张对比精确检测器与级联检测器的耗时和检出人脸（以精确检测器为准计算 recall）"""
+    import face_cascade
+    import face_engine
+
+    try:
+        paths = [os.path.join(db_path, rel_path) for rel_path in face_engine.list_images(db_path)][:limit]
+        if not paths:
+            print(f"没有找到图片: {db_path}")
+            return
+        cascade = face_cascade.detector
+        print(f"检测器对比: {db_path}，{len(paths)} 张图片")
+        print(f"级联参数: 快速检测器 {cascade.fast_backend}（长边 {cascade.fast_max_side}），精确检测器 "
+              f"{cascade.refine_backend}，外扩 {cascade.pad}，最低置信度 {cascade.min_confidence}")
+        # 在原图上比较，排除缩小检测的影响；先各运行一次，加载模型的耗时不计入
+        face_engine.warm_detector(cascade.refine_backend)
+        face_engine.warm_detector(face_cascade.CASCADE)
+        cascade.stats.clear()
+        result = face_cascade.report(
+            paths,
+            lambda image: face_engine.detect_faces(image, detector_backend=cascade.refine_backend,
+                                                   enforce_detection=True, max_side=None),
+            lambda image: face_engine.detect_faces(image, detector_backend=face_cascade.CASCADE,
+                                                   enforce_detection=True, max_side=None),
+            iou_threshold=iou)
+        result['cascade_stats'] = cascade.summary()
+        result['settings'] = cascade.settings()
+        print(f"\n{'检测器':<12} {'平均(ms)':>10} {'p50(ms)':>10} {'p90(ms)':>10} {'人脸数':>8}")
+        print(f"{cascade.refine_backend:<12} {result['reference']['mean_ms']:>10.1f} {result['reference']['p50_ms']:>10.1f} "
+              f"{result['reference']['p90_ms']:>10.1f} {result['reference_faces']:>8}")
+        print(f"{'cascade':<12} {result['cascade']['mean_ms']:>10.1f} {result['cascade']['p50_ms']:>10.1f} "
+              f"{result['cascade']['p90_ms']:>10.1f} {result['cascade_faces']:>8}")
+        stats = result['cascade_stats']
+        recall = '-' if result['recall'] is None else f"{result['recall']:.3f}"
+        precision = '-' if result['precision'] is None else f"{result['precision']:.3f}"
+        print(f"\n加速 {result['speedup']:.2f}x，recall {recall}，precision {precision}（IoU≥{iou}）")
+        print(f"每张图候选 {stats['proposals_per_image']:.2f} 个，整图回退 {stats['full_fallback_rate']:.1%}，"
+              f"精确检测器处理的像素占 {stats['refined_fraction']:.1%}")
+        if json_path:
+            with open(json_path, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            print(f"结果已写入: {json_path}")
+    except Exception as e:
+        print(f"生成报告失败: {str(e)}")
+
+
+# python main_cli.py enroll VGG-Face2 zhangsan photo1.jpg photo2.jpg
+def enroll_person(db_path, identity, images, compact=True):
+    """登记一个人，正在运行的实时识别无需重启即可识别；随后把登记日志合并进特征库"""
+    import face_engine
+    import face_enroll
+
+    try:
+        preload_models(models=[face_engine.MODEL_NAME], detectors=[detector()])
+        # 与 find 相同，登记日志总写入 retinaface 特征库，--detector 只替换登记图片所用的检测器
+        records, failed = face_enroll.enroll(db_path, identity, images, probe_detector=detector())
+        for img_path, error in failed:
+            print(f"跳过 {img_path}: {error}")
+        if not records:
+            print("没有可登记的人脸")
+            return
+        print(f"已登记 {identity}: {len(records)} 张图片，正在运行的实时识别将在 "
+              f"{face_enroll.REFRESH_INTERVAL:g} 秒内生效")
+        if compact:
+            compact_log(db_path)
+    except Exception as e:
+        print(f"登记失败: {str(e)}")
+
+
+# python main_cli.py compact VGG-Face2
+def compact_log(db_path):
+    """把登记日志合并进特征库"""
+    import face_engine
+    import face_enroll
+
+    try:
+        start = time.time()
+        added = face_enroll.compact(db_path, face_engine.MODEL_NAME, face_engine.DETECTOR_BACKEND)
+        if added is None:
+            print("另一个进程正在合并登记日志")
+        else:
+            print(f"已把 {added} 张人脸合并进特征库，耗时 {time.time() - start:.2f} 秒")
+    except Exception as e:
+        print(f"合并登记日志失败: {str(e)}")
+
+
+# python main_cli.py calibrate VGG-Face2 --far 0.001
+def calibrate_thresholds(db_path, far=None, block=None, curve_path=None, config_path=None, save=True):
+    """用按身份分文件夹的图片库标定距离阈值：统计全部图片对的距离分布，输出 EER 和指定 FAR 下的阈值"""
+    import face_calibrate
+    import face_engine
+    import face_index
+
+    shown = [-1]
+
+    def progress(done, total):
+        percent = done * 100 // max(total, 1)
+        if percent != shown[0]:
+            shown[0] = percent
+            print(f"\r已比较 {done}/{total} 对 ({percent}%)", end='', file=sys.stderr, flush=True)
+
+    try:
+        index = face_index.open_index(db_path, face_engine.MODEL_NAME, detector())
+        far = far or face_calibrate.DEFAULT_FAR
+        entry, hist = face_calibrate.calibrate(index, far=far, block=block or face_calibrate.BLOCK,
+                                               on_progress=progress)
+        print(file=sys.stderr)
+        print(f"\n===== 阈值标定: {entry['model_name']} / {entry['detector_backend']} =====")
+        print(f"共 {entry['images']} 张人脸，{entry['identities']} 个身份，"
+              f"同一人 {entry['genuine_pairs']} 对，不同人 {entry['impostor_pairs']} 对")
+        print(f"EER: {entry['eer']:.4f} (阈值 {entry['eer_threshold']:.4f})")
+        print(f"\n{'目标FAR':>10} {'阈值':>8} {'实际FAR':>10} {'FRR':>8} {'TAR':>8}")
+        for point in entry['operating_points']:
+            print(f"{point['far_target']:>10.0e} {point['threshold']:>8.4f} {point['far']:>10.2e} "
+                  f"{point['frr']:>8.4f} {1 - point['frr']:>8.4f}")
+        default = face_engine.COSINE_THRESHOLDS.get(entry['model_name'], 0.68)
+        default_far, default_frr = hist.at_threshold(default)
+        print(f"\nDeepFace 默认阈值 {default:.4f}: FAR {default_far:.2e}，FRR {default_frr:.4f}")
+        print(f"FAR={far:g} 时的阈值: {entry['threshold']:.4f} (FAR {entry['far']:.2e}，FRR {entry['frr']:.4f})")
+        if curve_path:
+            face_calibrate.write_curve(curve_path, hist)
+            print(f"ROC/DET 曲线已写入 {curve_path}")
+        if save:
+            path = face_calibrate.save(entry, config_path)
+            print(f"标定结果已写入 {path}，verify / find / stream 将使用该阈值")
+    except Exception as e:
+        print(f"标定失败: {str(e)}")
+
+
+# python main_cli.py shard-build VGG-Face2 --shards 4
+def build_shards(db_path, n):
+    """按身份文件夹把特征库拆成 n 个分片"""
+    import face_index
+    import face_shard
+
+    try:
+        index = face_index.open_index(db_path)
+        sizes = face_shard.build_shards(index, n)
+        print(f"已把 {len(index)} 张人脸拆成 {n} 个分片: {face_shard.shards_root(index.index_dir, n)}")
+        for i, size in enumerate(sizes):
+            print(f"分片 {i}: {size} 张人脸")
+    except Exception as e:
+        print(f"拆分特征库失败: {str(e)}")
+
+
+def shard_dirs(db_path, n):
+    import face_index
+    import face_shard
+    index_dir = os.path.abspath(face_index.default_index_dir(db_path))
+    return [face_shard.shard_dir(index_dir, i, n) for i in range(n)], index_dir
+
+
+# python main_cli.py shard-worker VGG-Face2 --shard 0 --shards 4 --port 9100
+def serve_shard(db_path, shard, n, host, port):
+    """启动一个分片服务（可在另一台机器上运行，数据库文件夹中需要有对应的分片）"""
+    import face_shard
+
+    try:
+        face_shard.serve_shard(shard_dirs(db_path, n)[0][shard], host, port)
+    except Exception as e:
+        print(f"分片服务出错: {str(e)}")
+
+
+# python main_cli.py shard-serve VGG-Face2 --shards 4
+def serve_local_shards(db_path, n, host, base_port):
+    """在本机为每个分片启动一个进程，直到按 Ctrl+C"""
+    import face_shard
+
+    try:
+        cluster = face_shard.LocalShardCluster(shard_dirs(db_path, n)[1], n, host, base_port)
+        with cluster:
+            print(f"已启动 {n} 个分片服务，检索时使用: --shards {','.join(cluster.addresses)}")
+            try:
+                while all(process.is_alive() for process in cluster.processes):
+                    time.sleep(1)
+                print("有分片服务意外退出，停止全部分片")
+            except KeyboardInterrupt:
+                pass
+    except Exception as e:
+        print(f"分片服务出错: {str(e)}")
+
+
+# python main_cli.py shard-bench VGG-Face2 --shards 4
+def shard_benchmark(db_path, n, sample=200, k=5, base_port=None, timeout=None):
+    """在本机启动 n 个分片进程，对比分片检索与单进程精确检索的结果和延迟，再停掉一个分片测试降级"""
+    import face_index
+    import face_shard
+
+    try:
+        index = face_index.open_index(db_path, build=False)
+        dirs, index_dir = shard_dirs(db_path, n)
+        if not all(os.path.exists(os.path.join(path, face_index.META_FILE)) for path in dirs):
+            face_shard.build_shards(index, n)
+        cluster = face_shard.LocalShardCluster(index_dir, n, base_port=base_port or face_shard.DEFAULT_PORT)
+        with cluster:
+            coordinator = face_shard.ShardCoordinator(cluster.addresses, timeout=timeout or face_shard.DEFAULT_TIMEOUT)
+            try:
+                sizes = [info['count'] if info else 0 for info in coordinator.info()[0]]
+                print(f"特征库: {len(index)} 张人脸，{n} 个分片 ({', '.join(map(str, sizes))})，"
+                      f"查询 {min(sample, len(index))} 次，k={k}")
+                print(f"\n{'':<12} {'一致率':>8} {'单进程(ms)':>12} {'分片(ms)':>10} {'p50':>8} {'p90':>8}  分片状态")
+
+                def show(name, row):
+                    print(f"{name:<12} {row['agreement']:>8.3f} {row['single_ms']:>12.2f} {row['sharded_ms']:>10.2f} "
+                          f"{row['sharded_p50_ms']:>8.2f} {row['sharded_p90_ms']:>8.2f}  {row['status']}")
+
+                show('全部分片', face_shard.benchmark(index, coordinator, sample, k))
+                if n > 1:
+                    cluster.processes[-1].terminate()
+                    cluster.processes[-1].join()
+                    show('停掉一个分片', face_shard.benchmark(index, coordinator, sample, k))
+            finally:
+                coordinator.close()
+    except Exception as e:
+        print(f"基准测试失败: {str(e)}")
+
+
+# python main_cli.py serve
+def serve_models(host, port, max_batch, max_wait_ms, verbose=False):
+    """启动常驻模型服务"""
+    import face_server
+
+    try:
+        face_server.serve(host, port, max_batch=max_batch, max_wait=max_wait_ms / 1000, verbose=verbose)
+    except Exception as e:
+        print(f"模型服务出错: {str(e)}")
 
 
 def main():
     """命令行主函数"""
     parser = argparse.ArgumentParser(description="面部识别系统命令行版", formatter_class=argparse.RawTextHelpFormatter)
 
+    parser.add_argument('--no-server', action='store_true', help='不使用正在运行的模型服务，在本进程中加载模型')
+    parser.add_argument('--profile-startup', action='store_true', help='输出各依赖的导入耗时和各模型的加载耗时')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='不读写磁盘缓存（默认 ~/.face_cache，可用环境变量 FACE_CACHE_PATH 修改）')
+    parser.add_argument('--detector',
+                        help='人脸检测器：retinaface、opencv 等 DeepFace 检测器，或 cascade（快速检测器给出候选区域，\n'
+                             '精确检测器只检测候选区域附近）；默认 verify/find/analyze 用 retinaface，stream 用 opencv')
+    parser.add_argument('--cascade-fast', help='级联检测的快速检测器（默认 opencv）')
+    parser.add_argument('--cascade-refine', help='级联检测的精确检测器（默认 retinaface）')
+    parser.add_argument('--cascade-fast-side', type=int, help='快速检测所用缩小图的长边（默认 640）')
+    parser.add_argument('--cascade-pad', type=float, help='候选框每边外扩的比例（默认 0.5）')
+    parser.add_argument('--cascade-min-confidence', type=float, help='精确检测结果的最低置信度（默认 0.9）')
+
     subparsers = parser.add_subparsers(dest='command', title='可用命令', help='选择要执行的功能')
 
     # 人脸验证命令
@@ -176,18 +815,185 @@ def main():
     verify_parser.add_argument('img1', help='第一张图片路径')
     verify_parser.add_argument('img2', help='第二张图片路径')
 
+    # 批量人脸验证命令
+    verify_batch_parser = subparsers.add_parser('verify-batch', help='批量人脸验证 - 从 CSV/JSONL 读取图片对，结果按行输出 JSON')
+    verify_batch_parser.add_argument('pairs', help='图片对列表文件 (CSV 或 JSONL)')
+    verify_batch_parser.add_argument('-o', '--output', help='结果输出文件 (JSONL)，默认输出到标准输出')
+    verify_batch_parser.add_argument('--batch-size', type=int, default=32, help='特征提取的批大小')
+
     # 人脸识别命令
     find_parser = subparsers.add_parser('find', help='人脸识别 - 在数据库中查找相似人脸')
     find_parser.add_argument('img', help='待识别人脸图片路径')
     find_parser.add_argument('db', help='数据库文件夹路径')
+    find_parser.add_argument('--nprobe', type=int, help='近似检索扫描的倒排表个数，越大越准越慢；0 不使用倒排索引')
+    find_parser.add_argument('--shortlist', type=int,
+                             help='按身份两阶段检索：先用身份原型选出前 N 个身份，再对其图片逐张重排')
+    find_parser.add_argument('--rerank', type=int, help='使用压缩特征时用原始特征精确重排的候选数，0 不重排')
+    find_parser.add_argument('--shards', help='在分片服务上检索，逗号分隔的 host:port 列表（见 shard-serve）')
+    find_parser.add_argument('--shard-timeout', type=float, help='等待各分片返回的秒数，超时的分片本次跳过（默认 2）')
+
+    # 批量人脸识别命令
+    find_batch_parser = subparsers.add_parser('find-batch', help='批量人脸识别 - 多进程识别目录或列表中的所有图片')
+    find_batch_parser.add_argument('probes', help='待识别图片目录，或每行一个路径的列表文件')
+    find_batch_parser.add_argument('db', help='数据库文件夹路径')
+    find_batch_parser.add_argument('-o', '--output', help='结果输出文件，默认输出到标准输出')
+    find_batch_parser.add_argument('--format', dest='fmt', choices=['jsonl', 'csv'], default='jsonl', help='输出格式')
+    find_batch_parser.add_argument('--workers', type=int, help='进程数，默认为 CPU 核数')
+    find_batch_parser.add_argument('-k', type=int, default=5, help='每张人脸返回的候选数')
 
     # 面部属性分析命令
     analyze_parser = subparsers.add_parser('analyze', help='面部属性分析 - 分析年龄、性别、种族和情感')
     analyze_parser.add_argument('img', help='待分析图片路径')
 
+    # 批量面部属性分析命令
+    analyze_batch_parser = subparsers.add_parser('analyze-batch', help='批量面部属性分析 - 只加载所选属性的模型，结果按行输出 JSON')
+    analyze_batch_parser.add_argument('probes', help='图片目录，或每行一个路径的列表文件')
+    analyze_batch_parser.add_argument('--actions', nargs='+', default=['age', 'gender', 'race', 'emotion'],
+                                      choices=['age', 'gender', 'race', 'emotion'], help='要分析的属性')
+    analyze_batch_parser.add_argument('-o', '--output', help='结果输出文件 (JSONL)，默认输出到标准输出')
+    analyze_batch_parser.add_argument('--batch-size', type=int, default=32, help='属性模型的批大小（人脸数）')
+
     # 实时分析命令
     stream_parser = subparsers.add_parser('stream', help='实时分析 - 摄像头实时人脸识别')
     stream_parser.add_argument('db', help='数据库文件夹路径')
+    stream_parser.add_argument('--pipelined', action='store_true', help='流水线模式：采集、推理、绘制并行，丢弃过时帧')
+    stream_parser.add_argument('--workers', type=int, default=2, help='流水线模式下的推理线程数')
+    stream_parser.add_argument('--target-fps', type=float, default=15, help='目标显示帧率，推理耗时超出预算时自动降低识别频率')
+    stream_parser.add_argument('--metrics-port', type=int, help='在本地端口上以 Prometheus 文本格式导出指标 (/metrics)')
+    stream_parser.add_argument('--metrics-jsonl', help='每隔 5 秒把指标快照追加到 JSON Lines 文件')
+    stream_parser.add_argument('--overlay', action='store_true', help='在画面上叠加 FPS 和各阶段耗时')
+
+    # 多路实时分析命令
+    multi_parser = subparsers.add_parser('stream-multi', help='多路实时分析 - 多个摄像头/视频/网络流共用一套模型')
+    multi_parser.add_argument('db', help='数据库文件夹路径')
+    multi_parser.add_argument('sources', nargs='+', help='视频源：摄像头编号、视频文件、图片序列文件夹或 rtsp:// 地址')
+    multi_parser.add_argument('--fps', type=float, nargs='+', default=[5.0],
+                              help='每路的目标识别帧率，给一个值时所有视频源相同，否则与视频源一一对应')
+    multi_parser.add_argument('--max-age', type=float, default=1.0, help='帧送去识别时最多允许落后的秒数，过期直接丢弃')
+    multi_parser.add_argument('-o', '--output', help='识别结果输出文件 (JSONL)，默认输出到标准输出')
+    multi_parser.add_argument('--display', action='store_true', help='为每路视频源打开一个显示窗口')
+    multi_parser.add_argument('--stats-interval', type=float, default=10, help='每隔多少秒输出一次各路统计')
+
+    # 视频处理命令
+    video_parser = subparsers.add_parser('process-video', help='视频处理 - 无界面识别视频文件、图片序列或网络流，逐帧输出 JSON')
+    video_parser.add_argument('source', help='视频文件、图片序列文件夹、摄像头编号或 rtsp:// 地址')
+    video_parser.add_argument('db', help='数据库文件夹路径')
+    video_parser.add_argument('-o', '--output', help='逐帧结果输出文件 (JSONL)，默认输出到标准输出')
+    video_parser.add_argument('--video-out', help='输出带标注的视频 (mp4)')
+    video_parser.add_argument('--stride', type=int, default=1, help='每隔多少帧处理一帧')
+    video_parser.add_argument('--workers', type=int, help='并行检测的线程数，默认为 CPU 核数')
+    video_parser.add_argument('--batch-size', type=int, default=32, help='跨帧攒批提取特征的人脸数')
+
+    # 特征库更新命令
+    index_parser = subparsers.add_parser('index', help='特征库更新 - 只为新增或修改的图片提取特征')
+    index_parser.add_argument('db', help='数据库文件夹路径')
+    index_parser.add_argument('--rebuild', action='store_true', help='忽略已有特征库，全部重新提取')
+    index_parser.add_argument('--import-pkl', dest='pkl', help='从 DeepFace 生成的 ds_model_*.pkl 导入特征')
+    index_parser.add_argument('--ann', action='store_true', help='同时建立（或重新训练）倒排近似索引，用于大规模数据库')
+    index_parser.add_argument('--nlist', type=int, help='倒排表个数，默认约为 sqrt(人脸数)')
+    index_parser.add_argument('--nprobe', type=int, help='检索时默认扫描的倒排表个数')
+    index_parser.add_argument('--storage', choices=['float16', 'int8', 'pq'],
+                              help='同时生成常驻内存的压缩特征，原始特征只用于精确重排')
+    index_parser.add_argument('--pq-m', type=int, default=64, help='乘积量化的分段数（每张人脸占用的字节数）')
+
+    # 压缩存储对比报告命令
+    quant_parser = subparsers.add_parser('quant-report', help='压缩存储报告 - 对比 float16/int8/pq 的内存、延迟和准确率')
+    quant_parser.add_argument('db', help='数据库文件夹路径（按身份分文件夹）')
+    quant_parser.add_argument('--queries', type=int, default=200, help='抽样查询数')
+    quant_parser.add_argument('-k', type=int, default=5, help='recall@k 中的 k')
+    quant_parser.add_argument('--rerank', type=int, default=100, help='精确重排的候选数，0 只测不重排')
+    quant_parser.add_argument('--formats', nargs='+', choices=['float16', 'int8', 'pq'],
+                              default=['float16', 'int8', 'pq'], help='要对比的存储格式')
+    quant_parser.add_argument('--pq-m', type=int, default=64, help='乘积量化的分段数')
+
+    # 近似检索基准测试命令
+    ann_bench_parser = subparsers.add_parser('ann-bench', help='近似检索基准 - 对比不同 nprobe 的 recall@k 和延迟')
+    ann_bench_parser.add_argument('db', help='数据库文件夹路径')
+    ann_bench_parser.add_argument('--queries', type=int, default=200, help='抽样查询数')
+    ann_bench_parser.add_argument('-k', type=int, default=5, help='recall@k 中的 k')
+    ann_bench_parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64],
+                                  help='要测试的 nprobe 取值')
+
+    # 基准测试命令
+    bench_parser = subparsers.add_parser('bench', help='基准测试 - 分阶段统计耗时分位数、吞吐量和峰值内存')
+    bench_parser.add_argument('db', nargs='?', default='VGG-Face2', help='样例图片文件夹，默认 VGG-Face2')
+    bench_parser.add_argument('--mode', choices=['auto', 'stub', 'real'], default='auto',
+                              help='stub 为确定性的假检测器和特征提取器（无需模型权重）；auto 在已下载权重时用真实模型')
+    bench_parser.add_argument('--repeat', type=int, default=3, help='每个阶段重复的轮数')
+    bench_parser.add_argument('--limit', type=int, help='最多使用的图片数')
+    bench_parser.add_argument('--gallery-size', type=int, default=0, help='用随机特征把特征库补足到该规模，测试大库检索')
+    bench_parser.add_argument('--json', dest='json_path', help='把结果写成 JSON 文件（- 为标准输出），便于跨版本对比')
+    bench_parser.add_argument('--compare', dest='baseline', help='与之前保存的 JSON 结果对比')
+
+    # 预处理基准测试命令
+    decode_parser = subparsers.add_parser('decode-bench', help='预处理基准 - 对比原分辨率与缩小解码/检测的耗时和内存')
+    decode_parser.add_argument('db', nargs='?', default='VGG-Face2', help='图片文件夹，默认 VGG-Face2')
+    decode_parser.add_argument('--mode', choices=['auto', 'stub', 'real'], default='auto',
+                               help='stub 为确定性的假检测器（无需模型权重）；auto 在已下载权重时用真实检测器')
+    decode_parser.add_argument('--max-side', type=int, help='检测用缩小图的长边（默认 1280）')
+    decode_parser.add_argument('--repeat', type=int, default=3, help='重复的轮数')
+    decode_parser.add_argument('--limit', type=int, help='最多使用的图片数')
+    decode_parser.add_argument('--json', dest='json_path', help='把结果写成 JSON 文件（- 为标准输出）')
+
+    # 检测器对比命令
+    detector_parser = subparsers.add_parser('detector-report', help='检测器对比 - 级联检测与精确检测的耗时和 recall')
+    detector_parser.add_argument('db', nargs='?', default='VGG-Face2', help='图片文件夹，默认 VGG-Face2')
+    detector_parser.add_argument('--limit', type=int, help='最多使用的图片数')
+    detector_parser.add_argument('--iou', type=float, default=0.5, help='判定为同一张人脸的最小 IoU')
+    detector_parser.add_argument('--json', dest='json_path', help='把结果写成 JSON 文件')
+
+    # 人员登记命令
+    enroll_parser = subparsers.add_parser('enroll', help='人员登记 - 添加一个人的照片，正在运行的实时识别无需重启即可识别')
+    enroll_parser.add_argument('db', help='数据库文件夹路径')
+    enroll_parser.add_argument('identity', help='身份名（数据库中的文件夹名）')
+    enroll_parser.add_argument('images', nargs='+', help='该人的照片，每张取最大的人脸')
+    enroll_parser.add_argument('--no-compact', action='store_true', help='只写入登记日志，稍后用 compact 命令合并')
+
+    compact_parser = subparsers.add_parser('compact', help='合并登记日志 - 把登记日志并入特征库')
+    compact_parser.add_argument('db', help='数据库文件夹路径')
+
+    # 阈值标定命令
+    calibrate_parser = subparsers.add_parser('calibrate', help='阈值标定 - 统计全部图片对的距离分布，输出 ROC/DET、EER 和阈值')
+    calibrate_parser.add_argument('db', help='按身份分文件夹的图片库')
+    calibrate_parser.add_argument('--far', type=float, help='目标误识率 (FAR)，默认 0.001')
+    calibrate_parser.add_argument('--block', type=int, help='分块大小，临时内存约为 block^2 * 16 字节（默认 2048）')
+    calibrate_parser.add_argument('--curve', help='把 ROC/DET 曲线写成 CSV 文件')
+    calibrate_parser.add_argument('--config', help='标定结果文件，默认 ~/.face_calibration.json（环境变量 FACE_CALIBRATION_PATH）')
+    calibrate_parser.add_argument('--dry-run', action='store_true', help='只输出结果，不写入标定结果文件')
+
+    # 分片检索命令
+    shard_build_parser = subparsers.add_parser('shard-build', help='特征库分片 - 按身份文件夹拆成多个分片')
+    shard_build_parser.add_argument('db', help='数据库文件夹路径')
+    shard_build_parser.add_argument('--shards', type=int, default=4, help='分片数')
+
+    shard_worker_parser = subparsers.add_parser('shard-worker', help='分片服务 - 为一个分片提供检索（可在其它机器上运行）')
+    shard_worker_parser.add_argument('db', help='数据库文件夹路径')
+    shard_worker_parser.add_argument('--shard', type=int, required=True, help='分片序号')
+    shard_worker_parser.add_argument('--shards', type=int, default=4, help='分片数')
+    shard_worker_parser.add_argument('--host', default=face_client.DEFAULT_HOST, help='监听地址')
+    shard_worker_parser.add_argument('--port', type=int, default=9100, help='监听端口')
+
+    shard_serve_parser = subparsers.add_parser('shard-serve', help='本机分片服务 - 每个分片启动一个进程')
+    shard_serve_parser.add_argument('db', help='数据库文件夹路径')
+    shard_serve_parser.add_argument('--shards', type=int, default=4, help='分片数')
+    shard_serve_parser.add_argument('--host', default=face_client.DEFAULT_HOST, help='监听地址')
+    shard_serve_parser.add_argument('--base-port', type=int, default=9100, help='第一个分片的端口，其余依次加一')
+
+    shard_bench_parser = subparsers.add_parser('shard-bench', help='分片检索基准 - 本机多进程分片与单进程检索对比')
+    shard_bench_parser.add_argument('db', help='数据库文件夹路径')
+    shard_bench_parser.add_argument('--shards', type=int, default=4, help='分片数')
+    shard_bench_parser.add_argument('--queries', type=int, default=200, help='抽样查询数')
+    shard_bench_parser.add_argument('-k', type=int, default=5, help='每次查询返回的候选数')
+    shard_bench_parser.add_argument('--base-port', type=int, default=9100, help='第一个分片的端口')
+    shard_bench_parser.add_argument('--timeout', type=float, help='等待各分片返回的秒数（默认 2）')
+
+    # 模型服务命令
+    serve_parser = subparsers.add_parser('serve', help='模型服务 - 常驻内存，其它命令自动通过它执行')
+    serve_parser.add_argument('--host', default=face_client.DEFAULT_HOST, help='监听地址')
+    serve_parser.add_argument('--port', type=int, default=face_client.DEFAULT_PORT, help='监听端口')
+    serve_parser.add_argument('--max-batch', type=int, default=32, help='特征提取合批的最大人脸数')
+    serve_parser.add_argument('--max-wait-ms', type=float, default=5, help='合批时最多等待的毫秒数')
+    serve_parser.add_argument('--verbose', action='store_true', help='打印每个请求的日志')
 
     args = parser.parse_args()
 
@@ -195,14 +1001,76 @@ def main():
         parser.print_help()
         return
 
+    global use_server
+    use_server = not args.no_server
+    if args.no_cache:
+        import face_cache
+        face_cache.enabled = False
+    if args.profile_startup:
+        profiler.enable()
+    global detector_backend
+    detector_backend = args.detector
+    cascade_settings = {'fast': args.cascade_fast, 'refine': args.cascade_refine, 'fast_max_side': args.cascade_fast_side,
+                        'pad': args.cascade_pad, 'min_confidence': args.cascade_min_confidence}
+    if any(value is not None for value in cascade_settings.values()):
+        import face_cascade
+        face_cascade.configure(**cascade_settings)
+
+    with profiler.span(f"run {args.command}"):
+        run_command(args)
+    profiler.report()
+
+
+def run_command(args):
+    """执行解析后的子命令"""
     if args.command == 'verify':
         verify_faces(args.img1, args.img2)
+    elif args.command == 'verify-batch':
+        verify_batch(args.pairs, args.output, args.batch_size)
     elif args.command == 'find':
-        find_face(args.img, args.db)
+        find_face(args.img, args.db, args.nprobe, args.shortlist, args.rerank, args.shards, args.shard_timeout)
+    elif args.command == 'find-batch':
+        find_batch(args.probes, args.db, args.output, args.fmt, args.workers, args.k)
     elif args.command == 'analyze':
         analyze_face(args.img)
+    elif args.command == 'analyze-batch':
+        analyze_batch(args.probes, args.actions, args.output, args.batch_size)
     elif args.command == 'stream':
-        stream_analysis(args.db)
+        stream_analysis(args.db, args.pipelined, args.workers, args.target_fps, args.metrics_port, args.metrics_jsonl,
+                        args.overlay)
+    elif args.command == 'bench':
+        run_benchmark(args.db, args.mode, args.repeat, args.limit, args.gallery_size, args.json_path, args.baseline)
+    elif args.command == 'decode-bench':
+        preprocess_benchmark(args.db, args.mode, args.max_side, args.repeat, args.limit, args.json_path)
+    elif args.command == 'stream-multi':
+        multi_stream_analysis(args.db, args.sources, args.fps, args.max_age, args.output, args.display,
+                              args.stats_interval)
+    elif args.command == 'process-video':
+        process_video(args.source, args.db, args.output, args.video_out, args.stride, args.workers, args.batch_size)
+    elif args.command == 'detector-report':
+        detector_report(args.db, args.limit, args.iou, args.json_path)
+    elif args.command == 'enroll':
+        enroll_person(args.db, args.identity, args.images, not args.no_compact)
+    elif args.command == 'compact':
+        compact_log(args.db)
+    elif args.command == 'calibrate':
+        calibrate_thresholds(args.db, args.far, args.block, args.curve, args.config, not args.dry_run)
+    elif args.command == 'shard-build':
+        build_shards(args.db, args.shards)
+    elif args.command == 'shard-worker':
+        serve_shard(args.db, args.shard, args.shards, args.host, args.port)
+    elif args.command == 'shard-serve':
+        serve_local_shards(args.db, args.shards, args.host, args.base_port)
+    elif args.command == 'shard-bench':
+        shard_benchmark(args.db, args.shards, args.queries, args.k, args.base_port, args.timeout)
+    elif args.command == 'serve':
+        serve_models(args.host, args.port, args.max_batch, args.max_wait_ms, args.verbose)
+    elif args.command == 'index':
+        index_gallery(args.db, args.rebuild, args.pkl, args.ann, args.nlist, args.nprobe, args.storage, args.pq_m)
+    elif args.command == 'ann-bench':
+        ann_benchmark(args.db, args.queries, args.k, args.nprobe)
+    elif args.command == 'quant-report':
+        quantization_report(args.db, args.queries, args.k, args.rerank, args.formats, args.pq_m)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,55 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import face_cache  # noqa: E402
+import face_calibrate  # noqa: E402
+import face_engine  # noqa: E402
+import face_index  # noqa: E402
+
+DIM = 64
+
+
+@pytest.fixture(autouse=True)
+def isolated(tmp_path, monkeypatch):
+    """不读写用户目录下的标定配置和磁盘缓存"""
+    monkeypatch.setattr(face_calibrate, 'CONFIG_PATH', str(tmp_path / 'calibration.json'))
+    monkeypatch.setattr(face_cache, 'enabled', False)
+    face_index._loaded.clear()
+    yield
+    face_index._loaded.clear()
+
+
+def random_faces(rng, identities, per_identity, dim=DIM, noise=0.6):
+    """每个身份一个随机中心加噪声，返回 (人脸记录, 归一化特征)"""
+    centers = rng.standard_normal((identities, dim))
+    embeddings = np.repeat(centers, per_identity, axis=0) + noise * rng.standard_normal((identities * per_identity, dim))
+    faces = [{'path': f"p{i // per_identity:03d}/{i}.jpg", 'identity': f"p{i // per_identity:03d}",
+              'x': 0, 'y': 0, 'w': 1, 'h': 1} for i in range(len(embeddings))]
+    return faces, face_engine.l2_normalize(embeddings)
+
+
+@pytest.fixture
+def gallery(tmp_path):
+    """数据库文件夹 + 默认位置上的小特征库（20 个身份，每个身份 10 张），返回 (数据库路径, 特征库)"""
+    db_path = str(tmp_path / 'db')
+    os.makedirs(db_path)
+    faces, embeddings = random_faces(np.random.default_rng(0), 20, 10)
+    index_dir = os.path.abspath(face_index.default_index_dir(db_path))
+    meta = {'db_path': db_path, 'model_name': face_engine.MODEL_NAME,
+            'detector_backend': face_engine.DETECTOR_BACKEND}
+    face_index.GalleryIndex.write(index_dir, embeddings, faces, meta, manifest={})
+    return db_path, face_index.GalleryIndex.load(index_dir)
+
+
+def stub_represent(monkeypatch, embeddings):
+    """让 face_engine.represent 对任何图片都返回给定特征（每行一张人脸），不需要模型"""
+    embeddings = face_engine.l2_normalize(np.atleast_2d(embeddings))
+    faces = [{'facial_area': {'x': 0, 'y': 0, 'w': 10 + i, 'h': 10 + i}, 'confidence': 1.0}
+             for i in range(len(embeddings))]
+    monkeypatch.setattr(face_engine, 'represent', lambda img, **kwargs: (faces, embeddings))
+    return faces, embeddings
@@ -0,0 +1,83 @@
+import json
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import face_bench
+import face_engine
+import face_index
+
+SAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'VGG-Face2')
+
+
+@pytest.fixture(scope='module')
+def stub_result():
+    return face_bench.run(SAMPLES, face_bench.StubModels(), repeat=2, gallery_size=2000)
+
+
+def _stub_embeddings(models):
+    """对全部样例图片依次检测、对齐、提取特征"""
+    vectors = []
+    for rel_path in face_engine.list_images(SAMPLES):
+        img = cv2.imread(os.path.join(SAMPLES, rel_path))
+        vectors.append(models.embed(models.align(img, models.detect(img))))
+    return np.concatenate(vectors)
+
+
+def test_every_stage_reported(stub_result):
+    assert stub_result['mode'] == 'stub'
+    assert stub_result['images'] == len(face_engine.list_images(SAMPLES)) > 0
+    assert stub_result['gallery_size'] == 2000
+    assert set(stub_result['stages']) == set(face_bench.STAGES)
+    for stage in face_bench.STAGES:
+        stats = stub_result['stages'][stage]
+        for key in ('p50_ms', 'p90_ms', 'p99_ms', 'throughput', 'peak_rss_mb'):
+            assert key in stats, (stage, key)
+        assert stats['count'] > 0
+        assert 0 <= stats['p50_ms'] <= stats['p90_ms'] <= stats['p99_ms'] <= stats['max_ms']
+        assert stats['throughput'] > 0
+
+
+def test_result_is_json(stub_result, tmp_path):
+    path = str(tmp_path / 'bench.json')
+    face_bench.save(stub_result, path)
+    loaded = face_bench.load(path)
+    assert loaded == json.loads(json.dumps(stub_result))
+    assert set(face_bench.compare(loaded, stub_result)) == set(face_bench.STAGES)
+    assert all(ratio == pytest.approx(1.0) for ratio in face_bench.compare(loaded, stub_result).values())
+
+
+def test_stub_models_are_deterministic():
+    first = _stub_embeddings(face_bench.StubModels())
+    second = _stub_embeddings(face_bench.StubModels())
+    assert first.shape == (len(face_engine.list_images(SAMPLES)), face_bench.STUB_DIM)
+    np.testing.assert_array_equal(first, second)
+    np.testing.assert_allclose(np.linalg.norm(first, axis=1), 1.0, rtol=1e-5)
+
+
+@pytest.mark.parametrize('stage', ['detect', 'embed', 'search'])
+def test_stage_benchmark(stage, request):
+    """有 pytest-benchmark 时对单个阶段计时，可用 --benchmark-json 保存并在版本间对比"""
+    pytest.importorskip('pytest_benchmark')
+    benchmark = request.getfixturevalue('benchmark')
+    models = face_bench.StubModels()
+    img = cv2.imread(os.path.join(SAMPLES, face_engine.list_images(SAMPLES)[0]))
+    faces = models.align(img, models.detect(img))
+    if stage == 'detect':
+        benchmark(models.detect, img)
+    elif stage == 'embed':
+        benchmark(models.embed, faces)
+    else:
+        gallery = face_engine.l2_normalize(np.random.default_rng(0).standard_normal((20000, face_bench.STUB_DIM)))
+        records = [{'path': f"synthetic/{i}.jpg", 'identity': 'synthetic'} for i in range(len(gallery))]
+        index = face_index.GalleryIndex(None, gallery, records, {'db_path': SAMPLES})
+        benchmark(index.search, models.embed(faces), 5)
+
+
+@pytest.mark.skipif(not face_bench.weights_cached(), reason="没有缓存的 VGG-Face 权重")
+def test_real_models():
+    result = face_bench.run(SAMPLES, face_bench.RealModels(), repeat=1, limit=3)
+    assert result['mode'] == 'real'
+    assert set(result['stages']) == set(face_bench.STAGES)
@@ -0,0 +1,160 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+import face_engine
+import face_enroll
+import face_index
+from conftest import DIM, random_faces, stub_represent
+
+
+def _photos(tmp_path, count, name='photo'):
+    paths = []
+    for i in range(count):
+        path = tmp_path / f"{name}{i}.jpg"
+        path.write_bytes(f"{name}{i}".encode())
+        paths.append(str(path))
+    return paths
+
+
+def _new_person(seed=1):
+    return face_engine.l2_normalize(np.random.default_rng(seed).standard_normal(DIM))
+
+
+def _identities(results):
+    return [result['identity'] for result in results[0]]
+
+
+def test_append_and_read_segment(gallery):
+    db_path, index = gallery
+    faces, embeddings = random_faces(np.random.default_rng(2), 2, 2)
+    first = face_enroll.append(index.index_dir, faces[:2], embeddings[:2])
+    second = face_enroll.append(index.index_dir, faces[2:], embeddings[2:])
+    assert face_enroll.list_segments(index.index_dir) == sorted([first, second])
+    assert not [name for name in os.listdir(face_enroll.log_dir(index.index_dir)) if name.endswith('.tmp')]
+    read_faces, read_embeddings = face_enroll.read_segment(index.index_dir, second)
+    assert read_faces == faces[2:]
+    np.testing.assert_array_equal(read_embeddings, embeddings[2:])
+    assert face_enroll.pending_segments(index) == sorted([first, second])
+
+
+def test_snapshot_dedups_by_path(gallery):
+    db_path, index = gallery
+    faces, embeddings = random_faces(np.random.default_rng(2), 1, 3)
+    faces = [dict(face, path=f"log/{i}.jpg", identity='log') for i, face in enumerate(faces)]
+    face_enroll.append(index.index_dir, faces, embeddings)
+    # 同一图片再次登记，以及已在特征库中的图片，都不重复计入
+    face_enroll.append(index.index_dir, [faces[0], index.faces[0]], np.stack([embeddings[0], index.embeddings[0]]))
+    snapshot = face_enroll.load_snapshot(db_path)
+    assert [face['path'] for face in snapshot.faces] == [face['path'] for face in faces]
+    assert len(snapshot) == len(index) + 3
+    assert face_enroll.load_snapshot(db_path, previous=snapshot) is snapshot
+
+
+def test_snapshot_search_merges_log(gallery):
+    db_path, index = gallery
+    person = _new_person()
+    faces = [{'path': f"new/{i}.jpg", 'identity': 'new', 'x': 0, 'y': 0, 'w': 1, 'h': 1} for i in range(2)]
+    face_enroll.append(index.index_dir, faces, face_engine.l2_normalize([person, person + 0.1]))
+    snapshot = face_enroll.load_snapshot(db_path)
+
+    found = snapshot.search(person, k=3, threshold=0.5)[0]
+    assert [result['path'] for result in found[:2]] == [os.path.join(db_path, 'new/0.jpg'),
+                                                        os.path.join(db_path, 'new/1.jpg')]
+    assert found[0]['row'] == len(index) and type(found[0]['row']) is int
+
+    identities = snapshot.search_identities(np.stack([person, index.embeddings[0]]), k=3, threshold=2.0)
+    new = identities[0][0]
+    assert new['identity'] == 'new'
+    assert new['prototype_distance'] == pytest.approx(1 - float(face_engine.l2_normalize(
+        face_engine.l2_normalize([person, person + 0.1]).mean(axis=0)) @ person), abs=1e-5)
+    assert [image['path'] for image in new['images']] == [os.path.join(db_path, 'new/0.jpg'),
+                                                          os.path.join(db_path, 'new/1.jpg')]
+    assert identities[1][0]['identity'] == index.faces[0]['identity']
+
+
+def test_enroll_refresh_compact(gallery, tmp_path, monkeypatch):
+    db_path, index = gallery
+    person = _new_person()
+    stub_represent(monkeypatch, person)
+    live = face_enroll.LiveGallery(db_path, interval=None)
+    assert 'newguy' not in _identities(live.search(person, k=1, threshold=0.3))
+
+    records, failed = face_enroll.enroll(db_path, 'newguy', _photos(tmp_path, 2))
+    assert not failed and [record['path'] for record in records] == ['newguy/photo0.jpg', 'newguy/photo1.jpg']
+    assert os.path.exists(os.path.join(db_path, 'newguy', 'photo0.jpg'))
+    assert live.refresh()
+    assert _identities(live.search(person, k=1, threshold=0.3)) == ['newguy']
+    assert len(live.snapshot.faces) == 2
+
+    before = live.snapshot
+    assert face_enroll.compact(db_path) == 2
+    assert face_enroll.list_segments(index.index_dir) == []
+    # 合并后旧快照仍可检索（旧版本的特征库和已读入的日志人脸都还在）
+    assert _identities(before.search(person, k=1, threshold=0.3)) == ['newguy']
+    assert len(before.index) == len(index)
+
+    assert live.refresh()
+    assert live.snapshot is not before
+    assert len(live.snapshot.index) == len(index) + 2 and not live.snapshot.faces
+    assert _identities(live.search(person, k=1, threshold=0.3)) == ['newguy']
+    assert os.path.islink(index.index_dir)
+    assert set(face_index.GalleryIndex.load(index.index_dir).load_manifest()) == {face['path'] for face in records}
+    assert face_enroll.compact(db_path) == 0
+
+
+def test_compact_while_reader_searches(gallery, tmp_path, monkeypatch):
+    db_path, index = gallery
+    live = face_enroll.LiveGallery(db_path, interval=None)
+    errors, stop = [], threading.Event()
+
+    def reader():
+        while not stop.is_set():
+            try:
+                live.refresh()
+                live.search(index.embeddings[0], k=3)
+                live.search_identities(index.embeddings[:1], k=3)
+            except Exception as e:
+                errors.append(e)
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    try:
+        for i in range(5):
+            stub_represent(monkeypatch, _new_person(10 + i))
+            face_enroll.enroll(db_path, f"person{i}", _photos(tmp_path, 2, name=f"p{i}_"))
+            face_enroll.compact(db_path)
+    finally:
+        stop.set()
+        thread.join()
+    assert errors == []
+    live.refresh()
+    assert len(live.snapshot.index) == len(index) + 10 and not live.snapshot.faces
+    assert len(face_index._versions(index.index_dir)) <= face_index.KEEP_VERSIONS
+
+
+def test_refresh_keeps_snapshot_without_gallery(gallery, monkeypatch):
+    db_path, index = gallery
+    live = face_enroll.LiveGallery(db_path, interval=None)
+    snapshot = live.snapshot
+    monkeypatch.setattr(face_index, 'build_index', lambda *args, **kwargs: pytest.fail("刷新时不应重建特征库"))
+    os.remove(index.index_dir)
+    assert not live.refresh()
+    assert live.snapshot is snapshot and len(live) == len(index)
+
+
+def test_long_log_is_compacted_in_background(gallery, tmp_path, monkeypatch):
+    db_path, index = gallery
+    monkeypatch.setattr(face_enroll, 'COMPACT_THRESHOLD', 3)
+    stub_represent(monkeypatch, _new_person())
+    live = face_enroll.LiveGallery(db_path, interval=None)
+    face_enroll.enroll(db_path, 'newguy', _photos(tmp_path, 2))
+    live.refresh()
+    assert live._compaction is None
+    face_enroll.enroll(db_path, 'newguy', _photos(tmp_path, 1, name='more'))
+    live.refresh()
+    live._compaction.join()
+    live.refresh()
+    assert len(live.snapshot.index) == len(index) + 3 and not live.snapshot.faces
@@ -0,0 +1,48 @@
+import json
+
+import numpy as np
+import pytest
+
+import face_index
+import face_server
+from conftest import stub_represent
+
+
+def _server_find(monkeypatch, payload, faces, embeddings):
+    service = face_server.FaceService()
+    monkeypatch.setattr(service, '_represent', lambda img_path: (faces, embeddings))
+    # 与 HTTP 接口一样经过 JSON 序列化
+    return json.loads(json.dumps(service.find(payload), default=face_server._to_json))
+
+
+def _summary(matches):
+    return [[(result['identity'], result['path'], round(result['distance'], 5)) for result in results]
+            for face, results in matches]
+
+
+@pytest.mark.parametrize('options', [
+    {'rerank': 0}, {'rerank': 3}, {'rerank': None}, {'nprobe': 2}, {'nprobe': 0}, {'shortlist': 4},
+    {'threshold': 0.0}, {'threshold': 2.0, 'rerank': 0},
+])
+def test_find_matches_local(gallery, monkeypatch, options):
+    db_path, index = gallery
+    face_index.build_ann(index, nlist=8, nprobe=1)
+    face_index.build_quantized(index, 'int8', rerank=50)
+    rng = np.random.default_rng(1)
+    faces, embeddings = stub_represent(monkeypatch, index.embeddings[[3, 57]] + 0.4 * rng.standard_normal((2, 64)))
+
+    local = face_index.find('probe.jpg', db_path, k=5, **options)
+    served = _server_find(monkeypatch, dict(options, img='probe.jpg', db=db_path, k=5), faces, embeddings)
+    assert _summary(served) == _summary(local)
+
+
+def test_rerank_changes_compressed_results(gallery, monkeypatch):
+    """rerank 必须真正传到检索：不重排的 int8 距离与重排后的精确距离不同"""
+    db_path, index = gallery
+    face_index.build_quantized(index, 'int8', rerank=50)
+    faces, embeddings = stub_represent(monkeypatch, index.embeddings[3])
+    payload = {'img': 'probe.jpg', 'db': db_path, 'k': 5, 'threshold': 2.0}
+    approximate = _server_find(monkeypatch, dict(payload, rerank=0), faces, embeddings)
+    exact = _server_find(monkeypatch, dict(payload, rerank=50), faces, embeddings)
+    assert _summary(approximate) != _summary(exact)
+    assert exact[0][1][0]['distance'] == pytest.approx(0.0, abs=1e-5)
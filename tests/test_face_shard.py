@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+
+import face_index
+import face_shard
+from conftest import stub_represent
+
+
+@pytest.fixture
+def coordinator(gallery):
+    """把特征库拆成 3 个分片，在本进程的线程中启动分片服务"""
+    db_path, index = gallery
+    face_index.build_ann(index, nlist=8, nprobe=2)
+    face_index.build_quantized(index, 'int8', rerank=50)
+    face_shard.build_shards(index, 3)
+    servers = []
+    for i in range(3):
+        server = face_shard._ShardServer(('127.0.0.1', 0), face_shard._ShardHandler)
+        server.worker = face_shard.ShardWorker(face_shard.shard_dir(index.index_dir, i, 3))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    coordinator = face_shard.ShardCoordinator([f"127.0.0.1:{server.server_address[1]}" for server in servers],
+                                              timeout=10)
+    yield coordinator
+    coordinator.close()
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def _summary(matches):
+    return [[(result['identity'], result['path'], round(result['distance'], 5)) for result in results]
+            for face, results in matches]
+
+
+def test_shards_keep_compressed_storage(gallery, coordinator):
+    db_path, index = gallery
+    for i in range(3):
+        shard = face_index.GalleryIndex.load(face_shard.shard_dir(index.index_dir, i, 3))
+        assert shard.quantized is not None and shard.quantized.codec.name == 'int8'
+        assert shard.ann is not None and (shard.ann.centroids == index.ann.centroids).all()
+
+
+@pytest.mark.parametrize('options', [
+    {}, {'rerank': 0}, {'rerank': 0, 'nprobe': 0}, {'nprobe': 8}, {'shortlist': 4}, {'threshold': 2.0, 'rerank': 0},
+])
+def test_sharded_find_matches_local(gallery, coordinator, monkeypatch, options):
+    db_path, index = gallery
+    stub_represent(monkeypatch, index.embeddings[[3, 57, 120]])
+    local = face_index.find('probe.jpg', db_path, k=5, **options)
+    sharded, status = face_shard.find('probe.jpg', coordinator, k=5, **options)
+    assert set(status.values()) == {'ok'}
+    assert _summary(sharded) == _summary(local)
@@ -0,0 +1,65 @@
+import queue
+
+import cv2
+import numpy as np
+import pytest
+
+import face_video
+
+
+def _drain(frames):
+    items = []
+    while True:
+        item = frames.get_nowait()
+        if item is face_video._END:
+            return items
+        items.append(item)
+
+
+@pytest.fixture
+def frame_dir(tmp_path):
+    for i in range(10):
+        cv2.imwrite(str(tmp_path / f"{i:03d}.png"), np.full((8, 8, 3), i, dtype=np.uint8))
+    return str(tmp_path)
+
+
+@pytest.mark.parametrize('stride', [1, 3, 4])
+def test_stride_reads_only_kept_images(frame_dir, monkeypatch, stride):
+    decoded = []
+    imread = cv2.imread
+    monkeypatch.setattr(cv2, 'imread', lambda path, *args: decoded.append(path) or imread(path, *args))
+    frames = queue.Queue()
+    face_video.decode_frames(face_video.FrameDirectory(frame_dir), frames, stride=stride)
+    items = _drain(frames)
+    assert [index for index, frame in items] == list(range(0, 10, stride))
+    assert [int(frame[0, 0, 0]) for index, frame in items] == list(range(0, 10, stride))
+    assert len(decoded) == len(items)
+
+
+class _Capture:
+    """记录 grab / read 调用的假视频源"""
+
+    def __init__(self, count):
+        self.count = count
+        self.position = 0
+        self.calls = []
+
+    def grab(self):
+        self.calls.append('grab')
+        self.position += 1
+        return self.position <= self.count
+
+    def read(self):
+        self.calls.append('read')
+        self.position += 1
+        if self.position > self.count:
+            return False, None
+        return True, np.full((2, 2, 3), self.position - 1, dtype=np.uint8)
+
+
+def test_skipped_video_frames_are_grabbed():
+    capture = _Capture(7)
+    frames = queue.Queue()
+    face_video.decode_frames(capture, frames, stride=3)
+    assert [index for index, frame in _drain(frames)] == [0, 3, 6]
+    assert capture.calls[:7] == ['read', 'grab', 'grab', 'read', 'grab', 'grab', 'read']